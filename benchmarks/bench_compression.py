@@ -0,0 +1,126 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Memory saved by compressing the details of log entries
+
+Fills a log with 1000 entries of errors raised through a few code paths,
+without compression, sharing the lines of frames, with zlib and with a
+zlib dictionary, and reports
+the memory they use, the time to add an entry and the time to read the
+details of one::
+
+    python benchmarks/bench_compression.py
+"""
+import sys
+import time
+import tracemalloc
+
+from zope.error.error import ErrorReportingUtility
+from zope.error.error import _cleanup_temp_log
+
+
+ENTRIES = 1000
+
+MODES = [
+    ('uncompressed', {}),
+    ('interned frames', {'intern_frames': True}),
+    ('zlib', {'compress_details': True}),
+    ('zlib dictionary', {'compress_details': True,
+                         'compression_dictionary': True}),
+]
+
+
+class Request:
+
+    URL = 'http://www.example.com/folder/page/@@edit'
+    principal = None
+
+    def __init__(self, number):
+        self._items = [
+            ('HTTP_HOST', 'www.example.com'),
+            ('HTTP_USER_AGENT', 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0)'
+                                ' Gecko/20100101 Firefox/120.0'),
+            ('HTTP_COOKIE', 'session=%08x; theme=dark' % number),
+            ('PATH_INFO', '/folder/page%d/@@edit' % (number % 50)),
+            ('REMOTE_ADDR', '192.0.2.%d' % (number % 250)),
+            ('REQUEST_METHOD', 'POST'),
+            ('form.title', 'Title %d' % number),
+        ]
+
+    def items(self):
+        return self._items
+
+
+def traverse(path, depth, number):
+    # Tracebacks of different depths through a few functions.
+    if depth:
+        return [render, publish, traverse][depth % 3](path, depth - 1, number)
+    raise KeyError('Missing item %d at %s' % (number, path))
+
+
+def publish(path, depth, number):
+    return traverse(path, depth, number)
+
+
+def render(path, depth, number):
+    return traverse(path, depth, number)
+
+
+def getExcInfo(number):
+    try:
+        traverse('/folder/page', 10 + number % 7, number)
+    except KeyError:
+        return sys.exc_info()
+
+
+def fill(properties, infos):
+    utility = ErrorReportingUtility()
+    utility.setProperties(ENTRIES, copy_to_zlog=False, **properties)
+    start = time.perf_counter()
+    for number, info in enumerate(infos):
+        utility.raising(info, Request(number))
+    return utility, (time.perf_counter() - start) / len(infos)
+
+
+def main():
+    infos = [getExcInfo(number) for number in range(ENTRIES)]
+    # Warm up the caches of the formatter.
+    fill({}, infos)[0]._resetLog()
+    print('{:<16} {:>14} {:>12} {:>12}'.format(
+        'mode', 'KiB per 1000', 'us/insert', 'us/details'))
+    for name, properties in MODES:
+        # Measure the time without tracing memory, which slows it down.
+        utility, insert = fill(properties, infos)
+        ids = [entry.id for entry in utility.getLogEntries()]
+        start = time.perf_counter()
+        for id in ids:
+            utility.getLogEntryDetails(id)
+        details = (time.perf_counter() - start) / len(ids)
+        utility._resetLog()
+
+        # The memory held by the log is what is freed when dropping it.
+        tracemalloc.start()
+        utility, _insert = fill(properties, infos)
+        before = tracemalloc.get_traced_memory()[0]
+        utility._resetLog()
+        used = before - tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        print('{:<16} {:>14.0f} {:>12.1f} {:>12.1f}'.format(
+            name, used / 1024 * 1000 / ENTRIES, insert * 1e6,
+            details * 1e6))
+    _cleanup_temp_log()
+
+
+if __name__ == '__main__':
+    main()
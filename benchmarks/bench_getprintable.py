@@ -0,0 +1,83 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Micro-benchmark of getPrintable on a realistic request dump
+
+Compares ``getPrintable`` with the implementation that always escaped::
+
+    python benchmarks/bench_getprintable.py
+"""
+import timeit
+from xml.sax.saxutils import escape as xml_escape
+
+from zope.error.error import getPrintable
+
+
+def getPrintableAlwaysEscaping(value, as_html=False):
+    # getPrintable before it looked for characters to escape.
+    if not isinstance(value, str):
+        if not isinstance(value, bytes):
+            value = str(value)
+        if isinstance(value, bytes):
+            value = value.decode('utf-8', errors="zope.error.printedreplace")
+    if not as_html:
+        value = xml_escape(value)
+    return value
+
+
+# The items of a typical request, as dumped by _getRequestAsHTML.
+REQUEST = {
+    'CONTENT_LENGTH': '0',
+    'GATEWAY_INTERFACE': 'CGI/1.1',
+    'HTTP_ACCEPT': 'text/html,application/xhtml+xml,application/xml;q=0.9,'
+                   'image/avif,image/webp,*/*;q=0.8',
+    'HTTP_ACCEPT_ENCODING': 'gzip, deflate, br',
+    'HTTP_ACCEPT_LANGUAGE': 'en-US,en;q=0.5',
+    'HTTP_CONNECTION': 'keep-alive',
+    'HTTP_COOKIE': 'session=7f3a9c2e1b; _ga=GA1.2.1234567890.1700000000;'
+                   ' theme=dark',
+    'HTTP_HOST': 'www.example.com',
+    'HTTP_REFERER': 'https://www.example.com/folder/page?a=1&b=2',
+    'HTTP_USER_AGENT': 'Mozilla/5.0 (X11; Linux x86_64; rv:120.0)'
+                       ' Gecko/20100101 Firefox/120.0',
+    'PATH_INFO': '/folder/page/@@edit',
+    'QUERY_STRING': 'form.submitted=1&title=Hello',
+    'REMOTE_ADDR': '192.0.2.10',
+    'REQUEST_METHOD': 'POST',
+    'SCRIPT_NAME': '',
+    'SERVER_NAME': 'www.example.com',
+    'SERVER_PORT': '443',
+    'SERVER_PROTOCOL': 'HTTP/1.1',
+    'form.title': 'Hello <world>',
+    'form.body': b'Some body text with a non-UTF-8 byte: \xe1',
+}
+
+VALUES = [value for item in REQUEST.items() for value in item]
+
+
+def dump(getPrintable):
+    for value in VALUES:
+        getPrintable(value)
+
+
+def main(number=20000, repeat=5):
+    for name, func in [('always escaping', getPrintableAlwaysEscaping),
+                       ('getPrintable', getPrintable)]:
+        best = min(timeit.repeat(
+            lambda: dump(func), number=number, repeat=repeat))
+        print('{:<16} {:8.2f} us per request dump'.format(
+            name, best / number * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Benchmarks of the error reporting hot path
+
+Measures ``ErrorReportingUtility.raising`` in various situations, reading
+the log and copying errors to the Event Log::
+
+    python benchmarks/bench_raising.py
+    python benchmarks/bench_raising.py raising_deep getLogEntries_2000
+
+To quantify a regression, save the results of one version and compare
+those of another with them::
+
+    python benchmarks/bench_raising.py --save before.json
+    python benchmarks/bench_raising.py --compare before.json
+
+Only the standard library is used, so the benchmarks run offline.
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+import timeit
+
+from zope.error.error import ErrorReportingUtility
+from zope.error.error import _cleanup_temp_log
+from zope.error.error import getFormattedTracebacks
+
+
+BENCHMARKS = {}
+
+
+def benchmark(name, operations=1):
+    """Registers a benchmark.
+
+    The decorated function sets up the benchmark and returns the function
+    to time, which performs *operations* operations per call.
+    """
+    def register(setup):
+        BENCHMARKS[name] = (setup, operations)
+        return setup
+    return register
+
+
+class Request:
+    """A request with *count* items of *size* characters."""
+
+    URL = 'http://www.example.com/folder/page/@@edit'
+    principal = None
+
+    def __init__(self, count=20, size=40):
+        self._items = {
+            'HTTP_HEADER_%03d' % i: ('v%03d ' % i) * (size // 5)
+            for i in range(count)}
+
+    def items(self):
+        return self._items.items()
+
+
+def recurse(depth):
+    if depth > 1:
+        recurse(depth - 1)
+    raise ValueError('Invalid value')
+
+
+def getExcInfo(depth=1):
+    try:
+        recurse(depth)
+    except ValueError:
+        return sys.exc_info()
+
+
+def makeUtility(**properties):
+    utility = ErrorReportingUtility()
+    properties.setdefault('copy_to_zlog', False)
+    utility.setProperties(**dict({'keep_entries': 20}, **properties))
+    return utility
+
+
+def raising(info, request=None, **properties):
+    utility = makeUtility(**properties)
+    return lambda: utility.raising(info, request)
+
+
+@benchmark('raising_no_request')
+def bench_raising_no_request():
+    return raising(getExcInfo())
+
+
+@benchmark('raising_request')
+def bench_raising_request():
+    return raising(getExcInfo(), Request())
+
+
+@benchmark('raising_deep')
+def bench_raising_deep():
+    return raising(getExcInfo(depth=100))
+
+
+@benchmark('raising_large_request')
+def bench_raising_large_request():
+    return raising(getExcInfo(), Request(count=500, size=1000))
+
+
+@benchmark('raising_aggregated')
+def bench_raising_aggregated():
+    return raising(getExcInfo(), Request(), aggregate_duplicates=True)
+
+
+THREADS = 32
+RAISES_PER_THREAD = 50
+
+
+@benchmark('raising_threads', operations=THREADS * RAISES_PER_THREAD)
+def bench_raising_threads():
+    info = getExcInfo(depth=10)
+    request = Request()
+    utility = makeUtility(keep_entries=1000)
+
+    def worker(start):
+        start.wait()
+        for _i in range(RAISES_PER_THREAD):
+            utility.raising(info, request)
+
+    def run():
+        start = threading.Event()
+        threads = [threading.Thread(target=worker, args=(start,))
+                   for _i in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+    return run
+
+
+def fillLog(keep_entries):
+    info = getExcInfo()
+    request = Request()
+    utility = makeUtility(keep_entries=keep_entries)
+    for _i in range(keep_entries):
+        utility.raising(info, request)
+    return utility
+
+
+def bench_getLogEntries(keep_entries):
+    utility = fillLog(keep_entries)
+    return utility.getLogEntries
+
+
+def bench_queryLogEntries(keep_entries):
+    # A page of the summaries shown in a listing.
+    utility = fillLog(keep_entries)
+    return lambda: utility.queryLogEntries(offset=0, limit=20)
+
+
+def bench_getLogEntryById(keep_entries):
+    utility = fillLog(keep_entries)
+    ids = [entry.id for entry in utility.getLogEntries()]
+    oldest, middle, newest = ids[-1], ids[len(ids) // 2], ids[0]
+
+    def run():
+        utility.getLogEntryById(oldest)
+        utility.getLogEntryById(middle)
+        utility.getLogEntryById(newest)
+        utility.getLogEntryById('missing')
+    return run
+
+
+for keep_entries in (20, 200, 2000):
+    benchmark('getLogEntries_%d' % keep_entries)(
+        lambda keep_entries=keep_entries: bench_getLogEntries(keep_entries))
+    benchmark('queryLogEntries_%d' % keep_entries)(
+        lambda keep_entries=keep_entries: bench_queryLogEntries(keep_entries))
+    benchmark('getLogEntryById_%d' % keep_entries, operations=4)(
+        lambda keep_entries=keep_entries: bench_getLogEntryById(keep_entries))
+
+
+def copyToZlog(**properties):
+    info = getExcInfo(depth=10)
+    utility = makeUtility(copy_to_zlog=True, **properties)
+    # The traceback as formatted for the error log, which _record reuses.
+    tb_text = getFormattedTracebacks(info)[0]
+    return lambda: utility._do_copy_to_zlog(
+        time.time(), 'ValueError', Request.URL, info, tb_text=tb_text)
+
+
+@benchmark('copy_to_zlog_allowed')
+def bench_copy_to_zlog_allowed():
+    # The burst is never used up, so every error is logged.
+    return copyToZlog(zlog_rate_burst=sys.maxsize)
+
+
+@benchmark('copy_to_zlog_rate_limited')
+def bench_copy_to_zlog_rate_limited():
+    # After the first five errors all are suppressed.
+    return copyToZlog(zlog_rate_burst=5, zlog_rate_period=3600)
+
+
+def run(name, number, repeat):
+    setup, operations = BENCHMARKS[name]
+    try:
+        timer = timeit.Timer(setup())
+        if not number:
+            # Time enough calls to take at least 0.2 seconds.
+            number, _time = timer.autorange()
+        best = min(timer.repeat(number=number, repeat=repeat))
+    finally:
+        _cleanup_temp_log()
+    return best / number / operations
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help='benchmarks to run, all by default: %s'
+                        % ', '.join(BENCHMARKS))
+    parser.add_argument('-n', '--number', type=int, default=0,
+                        help='calls per timing, by default as many as take'
+                        ' 0.2 seconds')
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+                        help='timings of which the best is reported'
+                        ' (default: %(default)s)')
+    parser.add_argument('--save', metavar='FILE',
+                        help='save the results as JSON')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare with results saved before')
+    options = parser.parse_args(args)
+    for name in options.names:
+        if name not in BENCHMARKS:
+            parser.error('Unknown benchmark %r' % (name,))
+
+    baseline = {}
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+
+    # Errors copied to the Event Log go nowhere.
+    logger = logging.getLogger('SiteError')
+    logger.addHandler(logging.NullHandler())
+    logger.propagate = False
+
+    results = {}
+    for name in options.names or BENCHMARKS:
+        results[name] = seconds = run(name, options.number, options.repeat)
+        line = '{:<28} {:10.2f} us'.format(name, seconds * 1e6)
+        if name in baseline:
+            line += '  {:6.2f}x'.format(seconds / baseline[name])
+        print(line)
+
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
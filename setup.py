@@ -75,6 +75,7 @@ setup(name='zope.error',
       ],
       extras_require={
           'test': [
+              'zope.component',
               'zope.testing >= 3.8',
               'zope.testrunner',
           ],
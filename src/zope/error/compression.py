@@ -0,0 +1,124 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Compression of the tracebacks and request dumps of logged errors
+
+Tracebacks are short texts that repeat the same frames over and over
+across entries, but rarely within one, so zlib compresses each of them
+poorly on its own.  A preset dictionary made of recent tracebacks lets
+zlib refer to what the other entries contain.
+"""
+__docformat__ = 'restructuredtext'
+
+import zlib
+from collections import deque
+from threading import Lock
+
+
+class ZlibCodec:
+    """Compresses text with zlib, using the preset dictionary *zdict* if
+    given.
+
+    Codecs do not change, so data compressed by one can always be
+    decompressed by it.
+    """
+
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION, zdict=None):
+        self.level = level
+        self.zdict = zdict
+        self._compressor = None
+        if zdict is not None:
+            # Setting the dictionary is expensive, copying a compressor
+            # that has it is not.
+            self._compressor = zlib.compressobj(level, zdict=zdict)
+
+    def compress(self, text):
+        data = text.encode('utf-8', 'surrogatepass')
+        if self.zdict is None:
+            return zlib.compress(data, self.level)
+        compressor = self._compressor
+        if compressor is None:
+            compressor = zlib.compressobj(self.level, zdict=self.zdict)
+        else:
+            compressor = compressor.copy()
+        return compressor.compress(data) + compressor.flush()
+
+    def retire(self):
+        """Frees the memory used to compress quickly with the dictionary.
+
+        The codec is still used to decompress, and rarely to compress.
+        """
+        self._compressor = None
+
+    def decompress(self, data):
+        if self.zdict is None:
+            data = zlib.decompress(data)
+        else:
+            decompressor = zlib.decompressobj(zdict=self.zdict)
+            data = decompressor.decompress(data) + decompressor.flush()
+        return data.decode('utf-8', 'surrogatepass')
+
+
+# The codec compressing without a dictionary.
+ZLIB = ZlibCodec()
+
+
+class DictionaryTrainer:
+    """Builds preset dictionaries from recent texts.
+
+    :meth:`getCodec` returns a :class:`ZlibCodec` with a dictionary made of
+    the texts most recently added with :meth:`addSample`, at most *size*
+    bytes of them, the most recent last, where zlib finds them most
+    cheaply.  The dictionary is rebuilt after the first few samples and
+    then every *interval* samples.  Each dictionary stays in memory as
+    long as data compressed with it does, but only the current codec keeps
+    the state to compress quickly with it.
+    """
+
+    def __init__(self, size=32 * 1024, interval=256,
+                 level=zlib.Z_DEFAULT_COMPRESSION):
+        self.size = size
+        self.interval = interval
+        self.level = level
+        self._lock = Lock()
+        self._samples = deque()
+        self._sample_size = 0
+        self._count = 0
+        self._codec = ZlibCodec(level)
+
+    def getCodec(self):
+        """Returns the codec with the current dictionary."""
+        return self._codec
+
+    def addSample(self, *texts):
+        """Adds *texts*, which may be None, to the samples."""
+        with self._lock:
+            for text in texts:
+                if text:
+                    data = text.encode('utf-8', 'surrogatepass')
+                    self._samples.append(data)
+                    self._sample_size += len(data)
+            while (self._samples and self._sample_size
+                   - len(self._samples[0]) >= self.size):
+                self._sample_size -= len(self._samples.popleft())
+            self._count += 1
+            count = self._count
+            # Train after 1, 2, 4, ... samples, until there are enough.
+            if (count % self.interval == 0
+                    or count < self.interval and not count & (count - 1)):
+                self._train()
+
+    def _train(self):
+        zdict = b''.join(self._samples)[-self.size:]
+        self._codec.retire()
+        self._codec = ZlibCodec(self.level, zdict)
@@ -17,11 +17,17 @@ This is a port of the Zope 2 error reporting object
 """
 __docformat__ = 'restructuredtext'
 
+import atexit
 import codecs
+import functools
+import hashlib
+import itertools
 import logging
+import os
+import sqlite3
 import time
-from random import random
 from threading import Lock
+from time import perf_counter
 from xml.sax.saxutils import escape as xml_escape
 
 import zope.location.interfaces
@@ -29,12 +35,39 @@ from persistent import Persistent
 from zope.exceptions.exceptionformatter import format_exception
 from zope.interface import implementer
 
+from zope.error.compression import ZLIB
+from zope.error.compression import DictionaryTrainer
+from zope.error.export import BatchExporter
+from zope.error.export import getFrames
+from zope.error.export import makeRecord
+from zope.error.export import makeSink
+from zope.error.formatter import clearCache as clearFormatterCache
+from zope.error.formatter import format_exception_dual
+from zope.error.interfaces import IErrorLogStorageFactory
 from zope.error.interfaces import IErrorReportingUtility
 from zope.error.interfaces import ILocalErrorReportingUtility
+from zope.error.journal import JournalLog
+from zope.error.log import EntryDetails
+from zope.error.log import ErrorLogEntry
+from zope.error.log import RingBufferLog
+from zope.error.log import StringTable
+from zope.error.metrics import Metrics
+from zope.error.ratelimit import RateLimiter
+from zope.error.recorder import DROP_OLDEST
+from zope.error.recorder import OVERFLOW_POLICIES
+from zope.error.recorder import BackgroundRecorder
+from zope.error.sampling import Sampler
+from zope.error.shared import SharedLog
+from zope.error.snapshot import TracebackSnapshot
 
 
-# Restrict the rate at which errors are sent to the Event Log
-_rate_restrict_pool = {}
+try:
+    from zope.component import queryUtility
+except ModuleNotFoundError:  # pragma: no cover
+    queryUtility = None
+
+# Restrict the rate at which errors are sent to the Event Log. These are the
+# defaults for the zlog_rate_period and zlog_rate_burst properties.
 
 # The number of seconds that must elapse on average between sending two
 # exceptions of the same name into the the Event Log. one per minute.
@@ -46,10 +79,76 @@ _rate_restrict_period = 60
 _rate_restrict_burst = 5
 
 # _temp_logs holds the logs.
-_temp_logs = {}  # { oid -> [ traceback string ] }
+_temp_logs = {}  # { oid -> RingBufferLog }
+
+# _recorders holds the background recorders used in asynchronous mode.
+_recorders = {}  # { oid -> BackgroundRecorder }
+
+# _rate_limiters restrict the rate at which errors are copied to the Event
+# Log.
+_rate_limiters = {}  # { oid -> RateLimiter }
+
+RATE_LIMIT_KEYS = ('type', 'fingerprint')
+
+# _samplers decide which occurrences of frequent errors are recorded.
+_samplers = {}  # { oid -> Sampler }
+
+# _exporters write the structured records of logged errors.
+_exporters = {}  # { oid -> BatchExporter }
+
+# The number of seconds to wait for pending records when an exporter is
+# closed.
+_export_close_timeout = 5.0
+
+# _trainers build the dictionaries the details of entries are compressed
+# with.
+_trainers = {}  # { oid -> DictionaryTrainer }
+
+# _string_tables hold the formatted frames shared by the entries of a log.
+_string_tables = {}  # { oid -> StringTable }
+
+# _metrics count the errors and time recording them.
+_metrics = {}  # { oid -> Metrics }
+
+# _aggregate_locks serialize adding the first entry of an aggregated error,
+# so that threads raising it at the same time do not add one each.
+_aggregate_locks = {}  # { oid -> _FingerprintLocks }
 
 cleanup_lock = Lock()
 
+# Entry ids are made of a per-process prefix and a sequence number, which
+# makes them unique and increasing.
+_entry_id_prefix = None
+_entry_id_sequence = None
+
+
+def _resetEntryIds():
+    global _entry_id_prefix, _entry_id_sequence
+    _entry_id_prefix = '%d.%d' % (time.time_ns() // 1000, os.getpid())
+    _entry_id_sequence = itertools.count(1)
+
+
+# The shared logs opened by the parent of a forked process, which the
+# process must neither use nor close.
+_inherited_logs = []
+
+
+def _afterFork():
+    _resetEntryIds()
+    # SQLite connections cannot be used across fork(), so forked workers
+    # open the shared log again.  Closing the inherited connection, even
+    # by garbage collecting it, could disturb the parent.
+    for key, log in list(_temp_logs.items()):
+        if isinstance(log, SharedLog):
+            _inherited_logs.append(_temp_logs.pop(key))
+
+
+_resetEntryIds()
+if hasattr(os, 'register_at_fork'):  # pragma: no branch
+    # Forked workers of pre-forking servers must not reuse the ids or the
+    # connection to the shared log of the parent.
+    os.register_at_fork(after_in_child=_afterFork)
+
 logger = logging.getLogger('SiteError')
 
 
@@ -62,7 +161,27 @@ def printedreplace(error):
 codecs.register_error("zope.error.printedreplace", printedreplace)
 
 
-def getPrintable(value, as_html=False):
+def _truncated(count, unit):
+    return "... [%d %s truncated]" % (count, unit)
+
+
+def _escape(value):
+    # Most text needs no escaping, and looking for the characters to
+    # escape is much faster than replacing them.
+    if '&' in value or '<' in value or '>' in value:
+        return xml_escape(value)
+    return value
+
+
+def getPrintable(value, as_html=False, max_size=0):
+    """Returns *value* as text, escaped for HTML unless *as_html* is true.
+
+    If *max_size* is given, at most that many characters of the value are
+    kept, followed by a truncation marker.
+    """
+    if type(value) is str and (not max_size or len(value) <= max_size):
+        return value if as_html else _escape(value)
+    truncated = 0
     if not isinstance(value, str):
         if not isinstance(value, bytes):
             # A call to str(obj) could raise anything at all.
@@ -77,18 +196,225 @@ def getPrintable(value, as_html=False):
                 return "<unprintable %s object>" % (
                     xml_escape(type(value).__name__))
         if isinstance(value, bytes):
+            if max_size and len(value) > max_size:
+                truncated = len(value) - max_size
+                value = value[:max_size]
             value = value.decode('utf-8', errors="zope.error.printedreplace")
-    return value if as_html else xml_escape(value)
+    if max_size and not truncated and len(value) > max_size:
+        truncated = len(value) - max_size
+        value = value[:max_size]
+    if not as_html:
+        value = _escape(value)
+    if truncated:
+        value += _truncated(truncated, "characters")
+    return value
+
+
+def getFormattedException(info, as_html=False, limit=None, max_size=0):
+    """Returns the formatted traceback of *info*.
+
+    *limit* is the maximum number of frames; the middle of longer
+    tracebacks is left out.  If *max_size* is given, the lines following
+    the first *max_size* characters are replaced by a truncation marker.
+    """
+    return _joinFormattedLines(
+        format_exception(*info, limit=limit, as_html=as_html),
+        as_html, max_size)
+
+
+def getFormattedTracebacks(info, limit=None, max_size=0):
+    """Returns the formatted traceback of *info* as text and as HTML.
+
+    This is the same as calling :func:`getFormattedException` with
+    *as_html* false and true, but walks the traceback only once.
+    """
+    text, html = _formatTracebackLines(info, limit, max_size)
+    return ''.join(text), ''.join(html)
+
+
+def _formatTracebackLines(info, limit=None, max_size=0, plain=None):
+    text, html = format_exception_dual(*info, limit=limit, plain=plain)
+    return (_printableLines(text, False, max_size),
+            _printableLines(html, True, max_size))
 
 
-def getFormattedException(info, as_html=False):
+def _joinFormattedLines(formatted, as_html, max_size=0):
+    return ''.join(_printableLines(formatted, as_html, max_size))
+
+
+def _printableLines(formatted, as_html, max_size=0):
     lines = []
-    for line in format_exception(as_html=as_html, *info):
-        line = getPrintable(line, as_html=as_html)
+    size = 0
+    # Tracebacks of recursive code repeat the same lines.
+    printable = {}
+    for line in formatted:
+        if line in printable:
+            line = printable[line]
+        else:
+            line = printable[line] = getPrintable(line, as_html=as_html)
         if not line.endswith("\n"):
             line += "<br />\n" if as_html else "\n"
+        size += len(line)
         lines.append(line)
-    return "".join(lines)
+    if max_size and size > max_size and len(lines) > 2:
+        lines = _truncateLines(lines, as_html, size, max_size)
+    return lines
+
+
+def _truncateLines(lines, as_html, size, max_size):
+    # Keep the first line and the last one, with the exception, and as
+    # many frames from the start and the end as fit in *max_size*; the
+    # frames in the middle are replaced by a truncation marker.
+    first, frames, last = lines[0], lines[1:-1], lines[-1]
+    template = "<li>%s</li>\n" if as_html else "%s\n"
+    budget = (max_size - len(first) - len(last)
+              - len(template % _truncated(len(frames), "lines")))
+    head = []
+    tail = []
+    head_size = tail_size = 0
+    start = 0
+    end = len(frames)
+    while start < end:
+        # Take the next frame from whichever end has used less.
+        if head_size <= tail_size:
+            line = frames[start]
+            if head_size + tail_size + len(line) > budget:
+                break
+            head.append(line)
+            head_size += len(line)
+            start += 1
+        else:
+            line = frames[end - 1]
+            if head_size + tail_size + len(line) > budget:
+                break
+            tail.append(line)
+            tail_size += len(line)
+            end -= 1
+    tail.reverse()
+    # In HTML, frames are list items.
+    marker = template % _truncated(end - start, "lines")
+    return [first] + head + [marker] + tail + [last]
+
+
+class _FingerprintLocks:
+    """A lock per fingerprint, kept while threads hold or wait for it."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self._locks = {}  # { fingerprint -> [Lock, number of threads] }
+
+    def __len__(self):
+        return len(self._locks)
+
+    def acquire(self, fingerprint):
+        with self._lock:
+            held = self._locks.get(fingerprint)
+            if held is None:
+                held = self._locks[fingerprint] = [Lock(), 0]
+            held[1] += 1
+        held[0].acquire()
+
+    def release(self, fingerprint):
+        with self._lock:
+            held = self._locks[fingerprint]
+            held[0].release()
+            held[1] -= 1
+            if not held[1]:
+                del self._locks[fingerprint]
+
+
+class _RequestCopy:
+    """The parts of a request needed to record an error.
+
+    Requests may be closed or reused once the response has been sent, so
+    asynchronous recording works on a copy.
+    """
+
+    def __init__(self, request):
+        self.principal = getattr(request, 'principal', None)
+        if hasattr(request, 'URL'):
+            self.URL = str(request.URL)
+        self._items = list(request.items())
+
+    def __bool__(self):
+        return True
+
+    def items(self):
+        return self._items
+
+
+# The settings read while recording an error, see _UtilityCopy.
+_RECORDING_SETTINGS = (
+    'keep_entries', 'max_bytes', 'copy_to_zlog', 'lazy_formatting',
+    'aggregate_duplicates', 'aggregate_samples', 'zlog_rate_period',
+    'zlog_rate_burst', 'zlog_rate_key', 'max_value_size', 'max_request_size',
+    'max_traceback_size', 'max_frames', 'compress_details',
+    'compression_dictionary', 'intern_frames', 'storage',
+    'journal_directory', 'journal_segment_size', 'journal_max_segments',
+    'journal_fsync_interval', 'shared_log_path', 'shared_log_timeout',
+    'export_target', 'export_batch_size', 'export_interval')
+
+
+class _UtilityCopy:
+    """The settings of a utility needed to record an error.
+
+    Local utilities are persistent and must only be used from the thread of
+    their database connection, so asynchronous recording works on a copy
+    read by the thread raising the error.  The methods of the utility's
+    class are bound to the copy.
+    """
+
+    def __init__(self, utility):
+        self._class = type(utility)
+        self._log_key = utility._getLogKey()
+        for name in _RECORDING_SETTINGS:
+            setattr(self, name, getattr(utility, name))
+
+    def __getattr__(self, name):
+        value = getattr(self._class, name)
+        bind = getattr(value, '__get__', None)
+        return value if bind is None else bind(self, self._class)
+
+    def _getLogKey(self):
+        return self._log_key
+
+
+def getFingerprint(info):
+    """Returns a fingerprint of the exception type and where it was raised.
+
+    Exceptions of the same type raised through the same code path get the
+    same fingerprint, whatever their value.  Frames are identified by
+    module name, function name and line number, so fingerprints are stable
+    across processes and installation paths.
+    """
+    t, _v, tb = info
+    parts = ['{}.{}'.format(getattr(t, '__module__', ''),
+                            getattr(t, '__qualname__', t))]
+    if isinstance(tb, (str, bytes)):
+        parts.append(getPrintable(tb, as_html=True))
+    else:
+        while tb is not None:
+            frame = tb.tb_frame
+            code = frame.f_code
+            parts.append('{}:{}:{}'.format(
+                frame.f_globals.get('__name__', code.co_filename),
+                code.co_name, tb.tb_lineno))
+            tb = tb.tb_next
+    data = '\n'.join(parts).encode('utf-8', 'backslashreplace')
+    return hashlib.sha1(data, usedforsecurity=False).hexdigest()
+
+
+def _queryStorageFactory(name=''):
+    """Returns the storage factory utility with *name*, or None."""
+    if queryUtility is None:  # pragma: no cover
+        return None
+    return queryUtility(IErrorLogStorageFactory, name)
+
+
+def _renderSnapshot(snapshot, limit=None, max_size=0):
+    text, html = snapshot.formatDual(limit)
+    return (_joinFormattedLines(text, False, max_size),
+            _joinFormattedLines(html, True, max_size))
 
 
 @implementer(IErrorReportingUtility,
@@ -100,19 +426,210 @@ class ErrorReportingUtility(Persistent):
     __parent__ = __name__ = None
 
     keep_entries = 20
+    max_bytes = 0
     copy_to_zlog = True
+    lazy_formatting = False
+    async_recording = False
+    queue_size = 1000
+    overflow_policy = DROP_OLDEST
+    block_timeout = 1.0
+    aggregate_duplicates = False
+    # The number of recent occurrences kept with an aggregated entry.
+    aggregate_samples = 5
+    zlog_rate_period = _rate_restrict_period
+    zlog_rate_burst = _rate_restrict_burst
+    zlog_rate_key = 'type'
+    sample_first = 10
+    sample_rate = 1.0
+    sample_window = 60.0
+    # Size limits in characters and frames; 0 means unlimited.
+    max_value_size = 0
+    max_request_size = 0
+    max_traceback_size = 0
+    max_frames = 0
+    # Whether the tracebacks and request dump are stored compressed, and
+    # whether with a dictionary built from recent entries.
+    compress_details = False
+    compression_dictionary = False
+    # Whether the lines of tracebacks are shared between entries.
+    intern_frames = False
+    # The name of the IErrorLogStorageFactory utility.
+    storage = ''
+    # The on-disk journal, see setJournal.
+    journal_directory = None
+    journal_segment_size = 4 * 1024 * 1024
+    journal_max_segments = 16
+    journal_fsync_interval = 1.0
+    # The log shared between processes, see setSharedLog.
+    shared_log_path = None
+    shared_log_timeout = 0.1
+    # The structured export, see setExport.
+    export_target = None
+    export_batch_size = 100
+    export_interval = 5.0
     _ignored_exceptions = ('Unauthorized',)
 
+    def _getLogKey(self):
+        """Returns the key of this object's log in the module globals."""
+        return self._p_oid
+
     def _getLog(self):
         """Returns the log for this object.
         Careful, the log is shared between threads.
         """
-        log = _temp_logs.get(self._p_oid, None)
+        key = self._getLogKey()
+        log = _temp_logs.get(key, None)
         if log is None:
-            log = []
-            _temp_logs[self._p_oid] = log
+            # Creating a log may open files, so make sure only one thread
+            # creates it.
+            cleanup_lock.acquire()
+            try:
+                log = _temp_logs.get(key, None)
+                if log is None:
+                    log = _temp_logs[key] = self._createLog(key)
+            finally:
+                cleanup_lock.release()
         return log
 
+    def _createLog(self, key):
+        """Creates the storage of the log with *key*.
+
+        The storage named by the ``storage`` property comes first, then
+        the shared log and the journal configured for this object, then
+        the unnamed storage factory utility, and finally the in-memory
+        log.  If the shared log or the journal cannot be opened, the error
+        is logged and the log is kept in memory.
+        """
+        if self.storage:
+            factory = _queryStorageFactory(self.storage)
+            if factory is not None:
+                return factory(key, self.keep_entries, self.max_bytes)
+            logger.warning("No error log storage named %r,"
+                           " using the default", self.storage)
+        try:
+            if self.shared_log_path:
+                return SharedLog(
+                    self.shared_log_path, key, self.keep_entries,
+                    self.max_bytes, self.shared_log_timeout)
+            if self.journal_directory:
+                return JournalLog(
+                    self.journal_directory, self.keep_entries,
+                    self.max_bytes, self.journal_segment_size,
+                    self.journal_max_segments, self.journal_fsync_interval)
+        except (sqlite3.Error, OSError):
+            logger.exception("Error in ErrorReportingUtility while opening"
+                             " the error log, keeping it in memory")
+            return RingBufferLog(self.keep_entries, self.max_bytes)
+        factory = _queryStorageFactory()
+        if factory is not None:
+            return factory(key, self.keep_entries, self.max_bytes)
+        return RingBufferLog(self.keep_entries, self.max_bytes)
+
+    def _getRecorder(self):
+        """Returns the background recorder for this object."""
+        key = self._getLogKey()
+        recorder = _recorders.get(key, None)
+        if recorder is None:
+            cleanup_lock.acquire()
+            try:
+                recorder = _recorders.setdefault(key, BackgroundRecorder())
+            finally:
+                cleanup_lock.release()
+        return recorder
+
+    def _getSampler(self):
+        """Returns the sampler deciding which errors are recorded."""
+        key = self._getLogKey()
+        sampler = _samplers.get(key, None)
+        if sampler is None:
+            cleanup_lock.acquire()
+            try:
+                sampler = _samplers.setdefault(key, Sampler())
+            finally:
+                cleanup_lock.release()
+        return sampler
+
+    def _getRateLimiter(self):
+        """Returns the rate limiter for copies to the Event Log."""
+        key = self._getLogKey()
+        limiter = _rate_limiters.get(key, None)
+        if limiter is None:
+            cleanup_lock.acquire()
+            try:
+                limiter = _rate_limiters.setdefault(key, RateLimiter())
+            finally:
+                cleanup_lock.release()
+        limiter.period = self.zlog_rate_period
+        limiter.burst = self.zlog_rate_burst
+        return limiter
+
+    def _getTrainer(self):
+        """Returns the trainer of compression dictionaries."""
+        key = self._getLogKey()
+        trainer = _trainers.get(key, None)
+        if trainer is None:
+            cleanup_lock.acquire()
+            try:
+                trainer = _trainers.setdefault(key, DictionaryTrainer())
+            finally:
+                cleanup_lock.release()
+        return trainer
+
+    def _getStringTable(self):
+        """Returns the table of the lines shared by entries."""
+        key = self._getLogKey()
+        table = _string_tables.get(key, None)
+        if table is None:
+            cleanup_lock.acquire()
+            try:
+                table = _string_tables.setdefault(key, StringTable())
+            finally:
+                cleanup_lock.release()
+        return table
+
+    def _getMetrics(self):
+        """Returns the metrics of this object."""
+        key = self._getLogKey()
+        metrics = _metrics.get(key, None)
+        if metrics is None:
+            cleanup_lock.acquire()
+            try:
+                metrics = _metrics.setdefault(key, Metrics())
+            finally:
+                cleanup_lock.release()
+        return metrics
+
+    def _getAggregateLocks(self):
+        """Returns the locks for adding the first entry of an aggregated
+        error.
+        """
+        key = self._getLogKey()
+        locks = _aggregate_locks.get(key, None)
+        if locks is None:
+            cleanup_lock.acquire()
+            try:
+                locks = _aggregate_locks.setdefault(key, _FingerprintLocks())
+            finally:
+                cleanup_lock.release()
+        return locks
+
+    def _getExporter(self):
+        """Returns the exporter of structured records."""
+        key = self._getLogKey()
+        exporter = _exporters.get(key, None)
+        if exporter is None:
+            cleanup_lock.acquire()
+            try:
+                exporter = _exporters.get(key, None)
+                if exporter is None:
+                    exporter = _exporters[key] = BatchExporter(
+                        makeSink(self.export_target))
+            finally:
+                cleanup_lock.release()
+        exporter.batch_size = self.export_batch_size
+        exporter.interval = self.export_interval
+        return exporter
+
     def _getUsername(self, request):
         username = None
 
@@ -148,10 +665,21 @@ class ErrorReportingUtility(Persistent):
         return username
 
     def _getRequestAsHTML(self, request):
+        max_value_size = self.max_value_size
+        max_size = self.max_request_size
         lines = []
-        for key, value in sorted(request.items()):
-            lines.append("{}: {}<br />\n".format(
-                getPrintable(key), getPrintable(value)))
+        size = 0
+        items = sorted(request.items())
+        for index, (key, value) in enumerate(items):
+            line = "{}: {}<br />\n".format(
+                getPrintable(key, max_size=max_value_size),
+                getPrintable(value, max_size=max_value_size))
+            size += len(line)
+            if max_size and size > max_size:
+                lines.append(_truncated(len(items) - index, "items"))
+                lines.append("<br />\n")
+                break
+            lines.append(line)
         return "".join(lines)
 
     # Exceptions that happen all the time, so we dont need
@@ -162,82 +690,339 @@ class ErrorReportingUtility(Persistent):
         Called by ZopePublication.handleException method.
         """
         now = time.time()
-        t, _v, tb = info
+        t, _v, _tb = info
         try:
             strtype = getattr(t, '__name__', t)
             strtype = strtype.decode(
                 "utf-8") if isinstance(strtype, bytes) else strtype
+            metrics = self._getMetrics()
+            metrics.countRaised(strtype)
             if strtype in self._ignored_exceptions:
+                metrics.countIgnored(strtype)
                 return
 
-            tb_text = None
-            tb_html = None
-            if isinstance(tb, (str, bytes)):
-                tb_text = getPrintable(tb)
+            if self.sample_rate < 1 and not self._getSampler().sample(
+                    strtype, self.sample_first, self.sample_rate,
+                    self.sample_window, now):
+                return
+
+            if self.async_recording:
+                if request:
+                    request = _RequestCopy(request)
+                else:
+                    request = None
+                self._getRecorder().submit(
+                    functools.partial(_UtilityCopy(self)._record, now,
+                                      strtype, info, request),
+                    self.queue_size, self.overflow_policy,
+                    self.block_timeout)
             else:
-                tb_text = getFormattedException(info)
-                tb_html = getFormattedException(info, True)
+                self._record(now, strtype, info, request)
+        finally:
+            info = None
 
+    def _record(self, now, strtype, info, request):
+        """Formats an exception and adds it to the log."""
+        start = perf_counter()
+        # The time spent in each phase, as (phase, seconds) tuples.
+        durations = []
+        try:
             url = None
             username = None
-            req_html = None
             if request:
                 # TODO: Temporary fix, which Steve should undo. URL is
                 #      just too HTTPRequest-specific.
                 if hasattr(request, 'URL'):
                     url = str(request.URL)
+                started = perf_counter()
                 username = self._getUsername(request)
-                req_html = self._getRequestAsHTML(request)
-
-            strv = getPrintable(info[1])
+                durations.append(('username', perf_counter() - started))
 
+            fingerprint = getFingerprint(info)
+            # Check the rate limit first, so that the traceback is only
+            # formatted for the Event Log when it is copied there.
+            copy = False
+            if self.copy_to_zlog:
+                started = perf_counter()
+                copy = self._allowZlogCopy(now, strtype, fingerprint)
+                logging_time = perf_counter() - started
             log = self._getLog()
-            entry_id = str(now) + str(random())  # Low chance of collision
-
-            log.append({
-                'type': strtype,
-                'value': strv,
-                'time': time.ctime(now),
-                'id': entry_id,
-                'tb_text': tb_text,
-                'tb_html': tb_html,
-                'username': username,
-                'url': url,
-                'req_html': req_html,
-            })
-            cleanup_lock.acquire()
-            try:
-                if len(log) >= self.keep_entries:
-                    del log[:-self.keep_entries]
-            finally:
-                cleanup_lock.release()
+            # The text of the traceback, if formatted while recording, and
+            # its lines as the logging module formats them.
+            text = None
+            plain = [] if copy else None
+            if self.aggregate_duplicates:
+                sample = (now, url, username)
+                entry = log.addOccurrence(
+                    fingerprint, now, sample, self.aggregate_samples)
+                if entry is None:
+                    # Only threads raising the same error wait for each
+                    # other.
+                    locks = self._getAggregateLocks()
+                    locks.acquire(fingerprint)
+                    try:
+                        # Another thread may have added the entry meanwhile.
+                        entry = log.addOccurrence(
+                            fingerprint, now, sample, self.aggregate_samples)
+                        if entry is None:
+                            entry, text = self._addEntry(
+                                log, now, strtype, info, request, url,
+                                username, fingerprint, (sample,), durations,
+                                plain)
+                    finally:
+                        locks.release(fingerprint)
+            else:
+                entry, text = self._addEntry(
+                    log, now, strtype, info, request, url, username,
+                    fingerprint, (), durations, plain)
 
+            if self.export_target:
+                # Only export a traceback formatted here: that of the entry
+                # may still have to be rendered or decompressed.
+                self._getExporter().export(
+                    makeRecord(entry, getFrames(info[2]), now, text))
+
+            if copy:
+                # Reuse the traceback formatted with the entry, unless it
+                # is formatted lazily and may never be needed.
+                started = perf_counter()
+                self._do_copy_to_zlog(now, strtype, str(url), info,
+                                      tb_text=''.join(plain) or None,
+                                      limited=False)
+                logging_time += perf_counter() - started
             if self.copy_to_zlog:
-                self._do_copy_to_zlog(now, strtype, str(url), info)
+                durations.append(('logging', logging_time))
+            durations.append(('total', perf_counter() - start))
+            self._getMetrics().observe(durations)
         finally:
             info = None
 
-    def _do_copy_to_zlog(self, now, strtype, url, info):
-        # info is unused; logging.exception() will call sys.exc_info()
-        # work around this with an evil hack
-        when = _rate_restrict_pool.get(strtype, 0)
-        if now > when:
-            next_when = max(when,
-                            now - _rate_restrict_burst * _rate_restrict_period)
-            next_when += _rate_restrict_period
-            _rate_restrict_pool[strtype] = next_when
+    def _addEntry(self, log, now, strtype, info, request, url, username,
+                  fingerprint, samples, durations, plain=None):
+        """Adds an entry to *log* and returns it with the text of its
+        traceback, or None if it is formatted lazily.
+
+        The lines of the traceback as the logging module formats them are
+        added to *plain*, if it is a list and the traceback is formatted.
+        """
+        codec = None
+        trainer = None
+        table = None
+        if self.compress_details:
+            codec = ZLIB
+            if self.compression_dictionary:
+                trainer = self._getTrainer()
+                codec = trainer.getCodec()
+        elif self.intern_frames:
+            table = self._getStringTable()
+
+        started = perf_counter()
+        tb = info[2]
+        tb_text = None
+        tb_html = None
+        text = None
+        render = None
+        limit = self.max_frames or None
+        max_size = self.max_traceback_size
+        if isinstance(tb, (str, bytes)):
+            tb_text = text = getPrintable(tb, max_size=max_size)
+        elif self.lazy_formatting:
+            render = functools.partial(
+                _renderSnapshot, TracebackSnapshot(info), limit, max_size)
+        else:
+            tb_text, tb_html = _formatTracebackLines(
+                info, limit, max_size, plain)
+            text = ''.join(tb_text)
+            if table is None:
+                tb_text = text
+                tb_html = ''.join(tb_html)
+        durations.append(('formatting', perf_counter() - started))
+
+        req_html = None
+        if request:
+            started = perf_counter()
+            req_html = self._getRequestAsHTML(request)
+            durations.append(('request', perf_counter() - started))
+
+        entry_id = '%s.%d' % (_entry_id_prefix, next(_entry_id_sequence))
+        entry = ErrorLogEntry(
+            id=entry_id,
+            type=strtype,
+            value=getPrintable(info[1], max_size=self.max_value_size),
+            time=time.ctime(now),
+            username=username,
+            url=url,
+            render=render,
+            fingerprint=fingerprint,
+            first_seen=now,
+            last_seen=now,
+            samples=samples,
+            details=EntryDetails(tb_text, tb_html, req_html, codec, table),
+        )
+        if trainer is not None:
+            trainer.addSample(req_html, tb_text, tb_html)
+        started = perf_counter()
+        log.append(entry, self.keep_entries, self.max_bytes)
+        durations.append(('storing', perf_counter() - started))
+        return entry, text
+
+    def _allowZlogCopy(self, now, strtype, fingerprint=None):
+        """Returns whether the rate limit allows copying an error to the
+        Event Log, first logging how many copies it suppressed before.
+        """
+        if self.zlog_rate_key == 'fingerprint' and fingerprint is not None:
+            key = label = fingerprint
+        else:
+            key = label = strtype
+        limiter = self._getRateLimiter()
+        allowed = limiter.allow(key, now)
+        if allowed is None:
+            return False
+        suppressed, since = allowed
+        if suppressed:
+            if key is fingerprint:
+                label = '{} ({})'.format(strtype, fingerprint)
+            logger.warning("Suppressed %d %s in last %ds",
+                           suppressed, label, round(now - since))
+        return True
+
+    def _do_copy_to_zlog(self, now, strtype, url, info, fingerprint=None,
+                         tb_text=None, limited=True):
+        if limited and not self._allowZlogCopy(now, strtype, fingerprint):
+            return
+        tb = info[2]
+        if isinstance(tb, (str, bytes)):
+            # The logging module cannot format a preformatted traceback.
+            logger.error("%s\n%s", url, getPrintable(tb, as_html=True))
+        elif tb_text is None:
             logger.error(str(url), exc_info=info)
+        elif logger.isEnabledFor(logging.ERROR):
+            # Hand over the traceback, formatted along with the entry as
+            # the logging formatters would, which they use instead of
+            # formatting it again.
+            # The exception info is still passed for handlers that use it.
+            fn, lno, func, sinfo = logger.findCaller()
+            record = logger.makeRecord(
+                logger.name, logging.ERROR, fn, lno, str(url), (), info,
+                func, None, sinfo)
+            record.exc_text = tb_text.rstrip('\n')
+            logger.handle(record)
+
+    def getSamplingStatistics(self):
+        """Returns how many errors of each type were seen and recorded
+        while sampling.
+        """
+        sampler = _samplers.get(self._getLogKey())
+        if sampler is None:
+            return {}
+        return sampler.getStatistics()
+
+    def getRateLimitStatistics(self):
+        """Returns how many copies to the Event Log were rate limited."""
+        limiter = _rate_limiters.get(self._getLogKey())
+        if limiter is None:
+            return {'allowed': 0, 'suppressed': 0, 'keys': 0, 'pending': {}}
+        stats = limiter.getStatistics()
+        stats['pending'] = limiter.getSuppressed()
+        return stats
+
+    def flush(self, timeout=None):
+        """Waits until errors queued for background recording are logged.
+        """
+        recorder = _recorders.get(self._getLogKey())
+        if recorder is None:
+            return True
+        return recorder.flush(timeout)
+
+    def shutdown(self, timeout=None):
+        """Drains the background recording queue and stops its worker.
+        """
+        recorder = _recorders.pop(self._getLogKey(), None)
+        if recorder is None:
+            return True
+        return recorder.shutdown(timeout)
+
+    def getQueueStatistics(self):
+        recorder = _recorders.get(self._getLogKey())
+        if recorder is None:
+            return {'queued': 0, 'processed': 0, 'dropped': 0}
+        return recorder.getStatistics()
+
+    def getMetrics(self):
+        """Returns the counters and histograms of this object."""
+        metrics = _metrics.get(self._getLogKey())
+        if metrics is None:
+            stats = {'raised': {}, 'ignored': {}, 'durations': {}}
+        else:
+            stats = metrics.getStatistics()
+        zlog = self.getRateLimitStatistics()
+        stats['zlog_copies'] = zlog['allowed']
+        stats['zlog_suppressed'] = zlog['suppressed']
+        log = self.getLogStatistics()
+        stats['log_entries'] = log['entries']
+        stats['log_bytes'] = log['bytes']
+        stats['log_evicted'] = log['evicted']
+        queue = self.getQueueStatistics()
+        stats['queued'] = queue['queued']
+        stats['dropped'] = queue['dropped']
+        return stats
+
+    def getLogStatistics(self):
+        """Returns the size of the log."""
+        stats = self._getLog().getStatistics()
+        stats['keep_entries'] = self.keep_entries
+        stats['max_bytes'] = self.max_bytes
+        table = _string_tables.get(self._getLogKey())
+        if table is not None:
+            table_stats = table.getStatistics()
+            stats['interned_lines'] = table_stats['strings']
+            stats['interned_bytes'] = table_stats['bytes']
+        return stats
 
     def getProperties(self):
         return {
             'keep_entries': self.keep_entries,
+            'max_bytes': self.max_bytes,
             'copy_to_zlog': self.copy_to_zlog,
             'ignored_exceptions': self._ignored_exceptions,
+            'lazy_formatting': self.lazy_formatting,
+            'async_recording': self.async_recording,
+            'queue_size': self.queue_size,
+            'overflow_policy': self.overflow_policy,
+            'block_timeout': self.block_timeout,
+            'aggregate_duplicates': self.aggregate_duplicates,
+            'zlog_rate_period': self.zlog_rate_period,
+            'zlog_rate_burst': self.zlog_rate_burst,
+            'zlog_rate_key': self.zlog_rate_key,
+            'sample_first': self.sample_first,
+            'sample_rate': self.sample_rate,
+            'sample_window': self.sample_window,
+            'max_value_size': self.max_value_size,
+            'max_request_size': self.max_request_size,
+            'max_traceback_size': self.max_traceback_size,
+            'max_frames': self.max_frames,
+            'storage': self.storage,
+            'compress_details': self.compress_details,
+            'compression_dictionary': self.compression_dictionary,
+            'intern_frames': self.intern_frames,
         }
 
     def setProperties(self, keep_entries, copy_to_zlog=True,
-                      ignored_exceptions=()):
+                      ignored_exceptions=(), lazy_formatting=None,
+                      async_recording=None, queue_size=None,
+                      overflow_policy=None, block_timeout=None,
+                      aggregate_duplicates=None, zlog_rate_period=None,
+                      zlog_rate_burst=None, zlog_rate_key=None,
+                      sample_first=None, sample_rate=None,
+                      sample_window=None, max_value_size=None,
+                      max_request_size=None, max_traceback_size=None,
+                      max_frames=None, max_bytes=None, storage=None,
+                      compress_details=None, compression_dictionary=None,
+                      intern_frames=None):
         """Sets the properties of this site error log.
+
+        The optional properties after ``ignored_exceptions`` keep their
+        current value when passed as None.
         """
         self.keep_entries = int(keep_entries)
         self.copy_to_zlog = bool(copy_to_zlog)
@@ -246,46 +1031,243 @@ class ErrorReportingUtility(Persistent):
             for e in ignored_exceptions
             if e
         )
+        if max_bytes is not None:
+            self.max_bytes = max(0, int(max_bytes))
+        if storage is not None and storage != self.storage:
+            if storage and _queryStorageFactory(storage) is None:
+                raise ValueError('Unknown storage %r' % (storage,))
+            self.storage = storage
+            self._resetLog()
+        self._getLog().resize(self.keep_entries, self.max_bytes)
+        if lazy_formatting is not None:
+            self.lazy_formatting = bool(lazy_formatting)
+        if queue_size is not None:
+            queue_size = int(queue_size)
+            if queue_size < 1:
+                raise ValueError('queue_size must be at least 1')
+            self.queue_size = queue_size
+        if overflow_policy is not None:
+            if overflow_policy not in OVERFLOW_POLICIES:
+                raise ValueError(
+                    'Unknown overflow policy %r' % (overflow_policy,))
+            self.overflow_policy = overflow_policy
+        if block_timeout is not None:
+            self.block_timeout = float(block_timeout)
+        if async_recording is not None:
+            self.async_recording = bool(async_recording)
+        if aggregate_duplicates is not None:
+            self.aggregate_duplicates = bool(aggregate_duplicates)
+        if zlog_rate_period is not None:
+            self.zlog_rate_period = float(zlog_rate_period)
+        if zlog_rate_burst is not None:
+            zlog_rate_burst = int(zlog_rate_burst)
+            if zlog_rate_burst < 1:
+                raise ValueError('zlog_rate_burst must be at least 1')
+            self.zlog_rate_burst = zlog_rate_burst
+        if zlog_rate_key is not None:
+            if zlog_rate_key not in RATE_LIMIT_KEYS:
+                raise ValueError(
+                    'Unknown rate limit key %r' % (zlog_rate_key,))
+            self.zlog_rate_key = zlog_rate_key
+        if sample_first is not None:
+            self.sample_first = max(0, int(sample_first))
+        if sample_rate is not None:
+            sample_rate = float(sample_rate)
+            if not 0 <= sample_rate <= 1:
+                raise ValueError('sample_rate must be between 0 and 1')
+            self.sample_rate = sample_rate
+        if sample_window is not None:
+            self.sample_window = float(sample_window)
+        if max_value_size is not None:
+            self.max_value_size = max(0, int(max_value_size))
+        if max_request_size is not None:
+            self.max_request_size = max(0, int(max_request_size))
+        if max_traceback_size is not None:
+            self.max_traceback_size = max(0, int(max_traceback_size))
+        if max_frames is not None:
+            self.max_frames = max(0, int(max_frames))
+        if compress_details is not None:
+            self.compress_details = bool(compress_details)
+        if compression_dictionary is not None:
+            self.compression_dictionary = bool(compression_dictionary)
+        if intern_frames is not None:
+            self.intern_frames = bool(intern_frames)
 
     def getLogEntries(self):
         """Returns the entries in the log, most recent first.
 
-        Makes a copy to prevent changes.
+        The entries are immutable, so they are not copied.
         """
-        res = [entry.copy() for entry in self._getLog()]
-        res.reverse()
-        return res
+        return self._getLog().getEntries()
 
     def getLogEntryById(self, id):
         """Returns the specified log entry.
-        Makes a copy to prevent changes.  Returns None if not found.
+        Returns None if not found.
         """
-        for entry in self._getLog():
-            if entry['id'] == id:
-                return entry.copy()
+        return self._getLog().getEntryById(id)
 
+    def getLogEntryDetails(self, id):
+        """Returns the tracebacks and the request dump of the specified log
+        entry.  Returns None if not found.
+        """
+        entry = self._getLog().getEntryById(id)
+        if entry is None:
+            return None
+        return entry.getDetails()
 
-class RootErrorReportingUtility(ErrorReportingUtility):
-    rootId = 'root'
+    def queryLogEntries(self, offset=0, limit=20, type=None, since=None,
+                        until=None, username=None, url=None, text=None,
+                        full=False):
+        """Returns the logged entries matching the criteria, most recent
+        first, as summaries unless *full* is true.
+        """
+        entries = self._getLog().query(offset, limit, type, since, until,
+                                       username, url, text)
+        if full:
+            return entries
+        return [entry.getSummary() for entry in entries]
 
-    def _getLog(self):
-        """Returns the log for this object.
+    def getLogHistory(self, offset=0, limit=20):
+        """Returns logged entries, most recent first, including those only
+        kept in the journal.
+        """
+        log = self._getLog()
+        if isinstance(log, JournalLog):
+            return log.getHistory(offset, limit)
+        return log.getEntries()[offset:offset + limit]
 
-        Careful, the log is shared between threads.
+    def setJournal(self, directory, segment_size=None, max_segments=None,
+                   fsync_interval=None):
+        """Writes the log to an on-disk journal in *directory*.
+
+        The most recent entries are reloaded from the journal when the log
+        is created, so they survive restarts.  A *directory* of None stops
+        journaling.  The optional arguments keep their current value when
+        passed as None.
+
+        This is not part of the properties that can be set through the
+        web, as it writes to the file system.
+        """
+        self.journal_directory = directory or None
+        if segment_size is not None:
+            self.journal_segment_size = int(segment_size)
+        if max_segments is not None:
+            self.journal_max_segments = int(max_segments)
+        if fsync_interval is not None:
+            self.journal_fsync_interval = float(fsync_interval)
+        self._resetLog()
+
+    def setSharedLog(self, path, timeout=None):
+        """Stores the log in the SQLite database at *path*.
+
+        All processes using the same database share the log, so the log
+        shows the errors of all of them.  Writers wait at most *timeout*
+        seconds for each other; an entry that could not be written in time
+        is dropped.  A *path* of None stops sharing the log.  The shared
+        log takes precedence over a journal.
+
+        Like :meth:`setJournal`, this cannot be set through the web.
+        """
+        self.shared_log_path = path or None
+        if timeout is not None:
+            self.shared_log_timeout = float(timeout)
+        self._resetLog()
+
+    def setExport(self, target, batch_size=None, interval=None):
+        """Exports a structured record of each logged error to *target*.
+
+        *target* is the path of a JSON Lines file, or ``tcp://host:port``
+        to send the lines to a socket.  Records are written by a
+        background thread in batches of *batch_size*, or *interval*
+        seconds after the first record of a batch.  A *target* of None
+        stops exporting.  The optional arguments keep their current value
+        when passed as None.  The records pending for the previous target
+        are dropped if they cannot be written within five seconds.
+
+        Like :meth:`setJournal`, this cannot be set through the web.
         """
-        return _temp_logs.setdefault(self.rootId, [])
+        if target:
+            makeSink(target)  # Validate the target.
+        if batch_size is not None:
+            batch_size = int(batch_size)
+            if batch_size < 1:
+                raise ValueError('batch_size must be at least 1')
+            self.export_batch_size = batch_size
+        self.export_target = target or None
+        if interval is not None:
+            self.export_interval = float(interval)
+        exporter = _exporters.pop(self._getLogKey(), None)
+        if exporter is not None:
+            exporter.close(_export_close_timeout)
+
+    def getExportStatistics(self):
+        """Returns how many structured records were exported."""
+        exporter = _exporters.get(self._getLogKey())
+        if exporter is None:
+            return {'exported': 0, 'dropped': 0, 'pending': 0}
+        return exporter.getStatistics()
+
+    def _resetLog(self):
+        # Close the log, so it is created anew with the current settings.
+        log = _temp_logs.pop(self._getLogKey(), None)
+        if log is not None:
+            log.close()
+
+
+class RootErrorReportingUtility(ErrorReportingUtility):
+    rootId = 'root'
+
+    def _getLogKey(self):
+        return self.rootId
 
 
 globalErrorReportingUtility = RootErrorReportingUtility()
 
 
+def _shutdown_recorders(timeout=None):
+    while _recorders:
+        _key, recorder = _recorders.popitem()
+        recorder.shutdown(timeout)
+    while _exporters:
+        _key, exporter = _exporters.popitem()
+        exporter.close(timeout)
+
+
+# Give queued errors a chance to be logged and exported when the process
+# exits.
+atexit.register(_shutdown_recorders, 5.0)
+
+
 def _cleanup_temp_log():
-    _temp_logs.clear()
+    _shutdown_recorders()
+    clearFormatterCache()
+    while _temp_logs:
+        _key, log = _temp_logs.popitem()
+        log.close()
+    _rate_limiters.clear()
+    _samplers.clear()
+    _trainers.clear()
+    _string_tables.clear()
+    _metrics.clear()
+    _aggregate_locks.clear()
 
 
 def _clear():
     _cleanup_temp_log()
-    for k in 'keep_entries', 'copy_to_zlog', '_ignored_exceptions':
+    for k in ('keep_entries', 'max_bytes', 'copy_to_zlog',
+              '_ignored_exceptions', 'lazy_formatting', 'async_recording',
+              'queue_size', 'overflow_policy', 'block_timeout',
+              'aggregate_duplicates',
+              'zlog_rate_period', 'zlog_rate_burst', 'zlog_rate_key',
+              'sample_first', 'sample_rate', 'sample_window',
+              'max_value_size', 'max_request_size', 'max_traceback_size',
+              'max_frames', 'compress_details', 'compression_dictionary',
+              'intern_frames', 'storage',
+              'journal_directory',
+              'journal_segment_size',
+              'journal_max_segments', 'journal_fsync_interval',
+              'shared_log_path', 'shared_log_timeout', 'export_target',
+              'export_batch_size', 'export_interval'):
         try:
             delattr(globalErrorReportingUtility, k)
         except AttributeError:
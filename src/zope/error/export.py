@@ -0,0 +1,282 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Structured export of logged errors
+
+Errors are exported as JSON Lines: one JSON object per line, written in
+batches to a file or a TCP socket.
+"""
+__docformat__ = 'restructuredtext'
+
+import json
+import logging
+import socket
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger('SiteError')
+
+
+def getFrames(tb):
+    """Returns the module, file name, line number and function name of
+    each frame of the traceback *tb*, outermost first.
+    """
+    frames = []
+    if isinstance(tb, (str, bytes)):
+        return frames
+    while tb is not None:
+        frame = tb.tb_frame
+        code = frame.f_code
+        frames.append({
+            'module': frame.f_globals.get('__name__'),
+            'filename': code.co_filename,
+            'lineno': tb.tb_lineno,
+            'function': code.co_name,
+        })
+        tb = tb.tb_next
+    return frames
+
+
+def makeRecord(entry, frames, now, traceback=None):
+    """Returns the structured record exported for an occurrence at *now*
+    of the error logged as *entry*.
+
+    *traceback* is the text of the traceback, if it was formatted.  It is
+    not read from the entry, which may have to render or decompress it.
+    """
+    return {
+        'id': entry.id,
+        'timestamp': now,
+        'type': entry.type,
+        'value': entry.value,
+        'fingerprint': entry.fingerprint,
+        'url': entry.url,
+        'username': entry.username,
+        'frames': frames,
+        'traceback': traceback,
+        'count': entry.count,
+        'first_seen': entry.first_seen,
+        'last_seen': entry.last_seen,
+    }
+
+
+class FileSink:
+    """Appends lines to the file at *path*.
+
+    The file is opened for each batch, so it can be rotated.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, lines):
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.writelines(lines)
+
+    def close(self):
+        pass
+
+
+class SocketSink:
+    """Sends lines to a TCP socket at *host* and *port*.
+
+    The connection is opened when needed and reopened after an error.
+    """
+
+    def __init__(self, host, port, timeout=1.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self._socket = None
+
+    def write(self, lines):
+        data = ''.join(lines).encode('utf-8')
+        try:
+            if self._socket is None:
+                self._socket = socket.create_connection(
+                    (self.host, self.port), self.timeout)
+            self._socket.sendall(data)
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+
+
+def makeSink(target):
+    """Returns the sink for *target*, a file path or ``tcp://host:port``.
+    """
+    if target.startswith('tcp://'):
+        host, _sep, port = target[len('tcp://'):].rpartition(':')
+        if not host or not port.isdigit():
+            raise ValueError('Invalid export target %r' % (target,))
+        return SocketSink(host.strip('[]'), int(port))
+    return FileSink(target)
+
+
+class BatchExporter:
+    """Writes records as JSON Lines to *sink* in batches.
+
+    Each record is serialized once, when it is exported.  A background
+    thread writes the batch when it holds *batch_size* records, or
+    otherwise *interval* seconds after its first record, so exporting
+    never waits for the sink.  At most *max_pending* records wait to be
+    written; further ones are dropped, as is a batch that cannot be
+    written, and the error is logged.
+    """
+
+    def __init__(self, sink, batch_size=100, interval=5.0,
+                 max_pending=10000):
+        self.sink = sink
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_pending = max_pending
+        self.exported = 0
+        self.dropped = 0
+        self._condition = threading.Condition()
+        self._batch = []
+        # The full batches waiting for the background thread.
+        self._full = deque()
+        # The time the current batch is due.
+        self._deadline = None
+        # The number of records accepted, and of those written or dropped.
+        self._accepted = 0
+        self._done = 0
+        self._thread = None
+        self._stopping = False
+
+    def export(self, record):
+        """Adds *record*, a JSON serializable dictionary, to the batch."""
+        line = json.dumps(record, separators=(',', ':'), default=str) + '\n'
+        with self._condition:
+            if self._accepted - self._done >= self.max_pending:
+                self.dropped += 1
+                return
+            self._accepted += 1
+            batch = self._batch
+            batch.append(line)
+            if len(batch) >= self.batch_size:
+                self._full.append(self._takeBatch())
+            elif len(batch) == 1:
+                self._deadline = time.monotonic() + self.interval
+            else:
+                return
+            self._ensureWorker()
+            self._condition.notify_all()
+
+    def _takeBatch(self):
+        lines, self._batch = self._batch, []
+        self._deadline = None
+        return lines
+
+    def _ensureWorker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name='zope.error exporter', daemon=True)
+            self._thread.start()
+
+    def _nextBatch(self):
+        # Waits for a batch to write, or returns None when stopping.
+        while not self._stopping:
+            if self._full:
+                return self._full.popleft()
+            timeout = None
+            if self._deadline is not None:
+                timeout = self._deadline - time.monotonic()
+                if timeout <= 0:
+                    return self._takeBatch()
+            self._condition.wait(timeout)
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                lines = self._nextBatch()
+            if lines is None:
+                return
+            self._write(lines)
+
+    def _write(self, lines):
+        try:
+            self.sink.write(lines)
+        except Exception:
+            written = False
+            logger.exception("Error in ErrorReportingUtility while"
+                             " exporting %d errors", len(lines))
+        else:
+            written = True
+        with self._condition:
+            if written:
+                self.exported += len(lines)
+            else:
+                self.dropped += len(lines)
+            self._done += len(lines)
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits for the records exported so far to be written.
+
+        Returns False if they were not all written within *timeout*
+        seconds.
+        """
+        with self._condition:
+            if self._batch:
+                self._full.append(self._takeBatch())
+                self._ensureWorker()
+                self._condition.notify_all()
+            accepted = self._accepted
+            return self._condition.wait_for(
+                lambda: self._done >= accepted, timeout)
+
+    def close(self, timeout=None):
+        """Writes the pending records and closes the sink.
+
+        Records that could not be written within *timeout* seconds are
+        dropped, and False is returned.
+        """
+        if timeout is not None:
+            deadline = time.monotonic() + timeout
+        written = self.flush(timeout)
+        with self._condition:
+            self._stopping = True
+            # The batches the background thread has not started writing.
+            unwritten = sum(len(lines) for lines in self._full)
+            self._full.clear()
+            if unwritten:
+                self.dropped += unwritten
+                self._done += unwritten
+                logger.warning("ErrorReportingUtility dropped %d errors not"
+                               " exported within %s seconds",
+                               unwritten, timeout)
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            if timeout is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            thread.join(timeout)
+        self.sink.close()
+        return written
+
+    def getStatistics(self):
+        """Returns the number of exported, dropped and pending records."""
+        with self._condition:
+            return {
+                'exported': self.exported,
+                'dropped': self.dropped,
+                'pending': self._accepted - self._done,
+            }
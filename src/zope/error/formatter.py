@@ -0,0 +1,370 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Formatting of tracebacks as text and HTML in one pass
+
+:func:`format_exception_dual` produces the same lines as
+:func:`zope.exceptions.exceptionformatter.format_exception` does for
+``as_html`` false and true, but walks the traceback, reads the source
+lines and calls the traceback supplements only once.
+
+It can also produce the lines of :func:`traceback.format_exception`, as
+the :mod:`logging` module formats exceptions, in the same pass.
+
+The header and source line of frames are cached, so formatting the same
+traceback again is cheaper.
+"""
+__docformat__ = 'restructuredtext'
+
+import functools
+import linecache
+import os
+import sys
+import time
+import traceback
+from html import escape
+from types import TracebackType
+
+import zope.exceptions.exceptionformatter
+from zope.exceptions.exceptionformatter import HTMLExceptionFormatter
+from zope.exceptions.exceptionformatter import TextExceptionFormatter
+
+
+_TEXT_SEP = TextExceptionFormatter.line_sep
+_HTML_SEP = HTMLExceptionFormatter.line_sep
+_TEXT_PREFIX = 'Traceback (most recent call last):\n'
+_HTML_PREFIX = '<p>Traceback (most recent call last):</p>\r\n<ul>\n'
+_LIMIT_TEMPLATE = (
+    '...\n'
+    '{omitted} entries omitted, because limit is {limit}.\n'
+    'Set sys.tracebacklimit or {klass}.limit to a higher'
+    ' value to see omitted entries\n'
+    '...')
+_CAUSE_MESSAGE = ('\nThe above exception was the direct cause of the'
+                  ' following exception:\n\n')
+_CONTEXT_MESSAGE = ('\nDuring handling of the above exception, another'
+                    ' exception occurred:\n\n')
+
+
+class _Escaper:
+    """Escapes strings for HTML, escaping each distinct string once."""
+
+    def __init__(self):
+        self._escaped = {}
+
+    def __call__(self, s):
+        if type(s) is not str:
+            return escape(str(s), quote=False)
+        escaped = self._escaped.get(s)
+        if escaped is None:
+            escaped = self._escaped[s] = escape(s, quote=False)
+        return escaped
+
+
+def _printError():  # pragma: no cover
+    if zope.exceptions.exceptionformatter.DEBUG_EXCEPTION_FORMATTER:
+        traceback.print_exc()
+
+
+def _formatSupplement(supplement, tb, escape, text, html):
+    def addLine(line):
+        text.append('   - %s' % line)
+        html.append('<b>%s</b>' % escape(line))
+
+    url = getattr(supplement, 'source_url', None)
+    if url is not None:
+        addLine(url)
+
+    line = getattr(supplement, 'line', 0)
+    if line == -1:
+        line = tb.tb_lineno
+    col = getattr(supplement, 'column', -1)
+    if line:
+        if col is not None and col >= 0:
+            addLine('Line {}, Column {}'.format(line, col))
+        else:
+            addLine('Line %s' % line)
+    elif col is not None and col >= 0:
+        addLine('Column %s' % col)
+
+    expr = getattr(supplement, 'expression', None)
+    if expr:
+        addLine('Expression: %s' % expr)
+
+    warnings = getattr(supplement, 'warnings', None)
+    if warnings:
+        for warning in warnings:
+            addLine('Warning: %s' % warning)
+
+    getInfo = getattr(supplement, 'getInfo', None)
+    if getInfo is not None:
+        try:
+            extra = getInfo()
+            if extra:
+                text.append(extra)
+                html.append(escape(extra).replace(' ', '&nbsp;')
+                            .replace('\n', _HTML_SEP))
+        except Exception:  # pragma: no cover
+            _printError()
+
+
+# How often, in seconds, source files are checked for changes.
+STAT_INTERVAL = 1.0
+
+_mtimes = {}  # { filename -> (modification time, time of the check) }
+
+
+def _getModificationTime(filename):
+    """Returns the modification time of *filename*, or None.
+
+    The file is checked at most every :data:`STAT_INTERVAL` seconds.  When
+    it changed, the source lines cached by :mod:`linecache` are dropped.
+    """
+    now = time.monotonic()
+    cached = _mtimes.get(filename)
+    if cached is not None and now - cached[1] < STAT_INTERVAL:
+        return cached[0]
+    try:
+        mtime = os.stat(filename).st_mtime
+    except (OSError, ValueError):
+        mtime = None
+    if cached is not None and cached[0] != mtime:
+        linecache.checkcache(filename)
+    _mtimes[filename] = (mtime, now)
+    return mtime
+
+
+@functools.lru_cache(maxsize=1024)
+def _formatFrameLines(filename, name, modname, lineno, mtime):
+    """Returns the header and source line of a frame as text and HTML, and
+    as :func:`traceback.format_exception` formats them.
+
+    The modification time of the source file is part of the key, so that
+    lines of changed files are not used.
+    """
+    s = '  Module %s, line %d' % (modname, lineno)
+    s = s + ', in %s' % name
+    text = [s]
+    html = [escape(s, quote=False)]
+    plain = '  File "%s", line %d, in %s\n' % (filename, lineno, name)
+    line = linecache.getline(filename, lineno)
+    if line:
+        line = line.strip()
+        text.append('    ' + line)
+        html.append('    ' + escape(line, quote=False))
+        plain += '    %s\n' % line
+    return tuple(text), tuple(html), plain
+
+
+def clearCache():
+    """Clears the cached frame lines."""
+    _formatFrameLines.cache_clear()
+    _mtimes.clear()
+
+
+def getCacheInfo():
+    """Returns the ``hits``, ``misses`` and ``size`` of the frame cache."""
+    info = _formatFrameLines.cache_info()
+    return {'hits': info.hits, 'misses': info.misses,
+            'size': info.currsize}
+
+
+def formatFrameExtras(tb, escape=None):
+    """Returns the lines of the traceback supplement and info of the frame
+    of *tb*, as two lists of text and HTML lines.
+
+    *escape* escapes text for HTML.
+    """
+    if escape is None:
+        escape = _Escaper()
+    f = tb.tb_frame
+    f_locals = f.f_locals
+    f_globals = f.f_globals
+    text = []
+    html = []
+
+    if '__traceback_supplement__' in f_locals:
+        tbs = f_locals['__traceback_supplement__']
+    elif '__traceback_supplement__' in f_globals:
+        tbs = f_globals['__traceback_supplement__']
+    else:
+        tbs = None
+    if tbs is not None:
+        try:
+            supplement = tbs[0](*tbs[1:])
+            supplement_text = []
+            supplement_html = []
+            _formatSupplement(supplement, tb, escape,
+                              supplement_text, supplement_html)
+        except Exception:  # pragma: no cover
+            _printError()
+        else:
+            text.extend(supplement_text)
+            html.extend(supplement_html)
+
+    try:
+        tbi = f_locals.get('__traceback_info__', None)
+        if tbi is not None:
+            tbi_text = f'   - __traceback_info__: {tbi}'
+            tbi_html = '__traceback_info__: %s' % escape(tbi).replace(
+                '\n', _HTML_SEP)
+            text.append(tbi_text)
+            html.append(tbi_html)
+    except Exception:  # pragma: no cover
+        _printError()
+
+    return text, html
+
+
+def _formatFrame(tb, escape, frames=None):
+    f = tb.tb_frame
+    lineno = tb.tb_lineno
+    co = f.f_code
+    filename = co.co_filename
+    f_globals = f.f_globals
+
+    linecache.lazycache(filename, f_globals)
+    text, html, plain_lines = _formatFrameLines(
+        filename, co.co_name, f_globals.get('__name__', filename), lineno,
+        _getModificationTime(filename))
+    if frames is not None:
+        frames.append(plain_lines)
+    text = list(text)
+    html = list(html)
+
+    if type(tb) is TracebackType:
+        extras = formatFrameExtras(tb, escape)
+    else:
+        # Snapshots of tracebacks carry the lines formatted when they were
+        # taken.
+        extras = tb.tb_extras
+    text.extend(extras[0])
+    html.extend(extras[1])
+
+    return (_TEXT_SEP.join(text) + '\n',
+            '<li>%s</li>\n' % _HTML_SEP.join(html))
+
+
+def _obeyLimit(result, limit, klass):
+    if limit is not None and len(result) > limit:
+        # Cut out the middle part of the traceback.
+        tocut = len(result) - limit
+        lower = len(result) // 2 - tocut // 2
+        result[lower:lower + tocut] = [_LIMIT_TEMPLATE.format(
+            omitted=tocut, limit=limit, klass=klass.__name__)]
+
+
+def format_exception_dual(t, v, tb, limit=None, exc_only=None,
+                          plain=None):
+    """Formats a traceback as text and as HTML.
+
+    Returns two lists of lines, the same as ``format_exception(t, v, tb,
+    limit)`` returns with ``as_html`` false and true.  *exc_only* is the
+    formatted exception line, if it was formatted before.
+
+    If *plain* is a list, the lines :func:`traceback.format_exception`
+    returns, without the column markers and regardless of *limit*, are
+    added to it, unless *v* is not an exception.
+    """
+    # The formatters look for this to detect recursion.
+    __exception_formatter__ = 1  # noqa: F841
+    escape = _Escaper()
+    text = []
+    html = []
+    frames = None
+    stopped_at = None
+    if not isinstance(v, BaseException):
+        # traceback.format_exception cannot format it.
+        plain = None
+    if plain is not None:
+        _formatChain(v, plain)
+        if tb is not None:
+            plain.append(_TEXT_PREFIX)
+        frames = []
+    while tb is not None:
+        if tb.tb_frame.f_locals.get('__exception_formatter__'):
+            stopped = ['(Recursive formatException() stopped, '
+                       'trying traceback.format_tb)\n']
+            stopped.extend(traceback.format_tb(tb))
+            text.extend(stopped)
+            html.extend(stopped)
+            stopped_at = tb
+            break
+        text_line, html_line = _formatFrame(tb, escape, frames)
+        text.append(text_line)
+        html.append(html_line)
+        tb = tb.tb_next
+
+    if limit is None:
+        limit = getattr(sys, 'tracebacklimit', 200)
+    _obeyLimit(text, limit, TextExceptionFormatter)
+    _obeyLimit(html, limit, HTMLExceptionFormatter)
+
+    if exc_only is None:
+        exc_only = TextExceptionFormatter().formatExceptionOnly(t, v)
+    text.insert(0, _TEXT_PREFIX)
+    text.append(exc_only)
+    html.insert(0, _HTML_PREFIX)
+    html.append(('</ul><p>%s</p>' % escape(exc_only))
+                .replace('\n', _HTML_SEP))
+    if plain is not None:
+        _collapseRepeats(frames, plain)
+        if stopped_at is not None:
+            plain.extend(traceback.format_tb(stopped_at))
+        plain.extend(traceback.format_exception_only(t, v))
+    return text, html
+
+
+# Repetitions of a frame after which traceback.format_exception only
+# counts them.
+_RECURSIVE_CUTOFF = 3
+
+
+def _collapseRepeats(frames, plain):
+    # Adds *frames* to *plain*, counting repetitions of the same frame as
+    # traceback.format_exception does.
+    last = None
+    count = 0
+    for frame in frames:
+        if frame == last:
+            count += 1
+        else:
+            _addRepeated(count, plain)
+            last = frame
+            count = 1
+        if count <= _RECURSIVE_CUTOFF:
+            plain.append(frame)
+    _addRepeated(count, plain)
+
+
+def _addRepeated(count, plain):
+    count -= _RECURSIVE_CUTOFF
+    if count > 0:
+        plain.append('  [Previous line repeated %d more time%s]\n'
+                     % (count, 's' if count > 1 else ''))
+
+
+def _formatChain(v, plain):
+    # Adds the exceptions *v* was raised from or while handling, as
+    # traceback.format_exception does.
+    if v.__cause__ is not None:
+        chained = v.__cause__
+        message = _CAUSE_MESSAGE
+    elif v.__context__ is not None and not v.__suppress_context__:
+        chained = v.__context__
+        message = _CONTEXT_MESSAGE
+    else:
+        return
+    plain.extend(traceback.TracebackException(
+        type(chained), chained, chained.__traceback__).format())
+    plain.append(message)
@@ -15,6 +15,7 @@
 """
 __docformat__ = 'restructuredtext'
 
+from zope.interface import Attribute
 from zope.interface import Interface
 
 
@@ -38,23 +39,313 @@ class ILocalErrorReportingUtility(Interface):
     def getProperties():
         """Gets the properties as dictionary.
 
-        keep_entries, copy_to_logfile, ignored_exceptions
+        keep_entries, copy_to_logfile, ignored_exceptions, lazy_formatting,
+        async_recording, queue_size, overflow_policy, block_timeout,
+        aggregate_duplicates, zlog_rate_period, zlog_rate_burst, zlog_rate_key,
+        sample_first, sample_rate, sample_window, max_value_size,
+        max_request_size, max_traceback_size, max_frames, max_bytes, storage,
+        compress_details, compression_dictionary, intern_frames
         """
 
     def setProperties(keep_entries, copy_to_zlog=1, ignored_exceptions=(),
-                      RESPONSE=None):
+                      RESPONSE=None, lazy_formatting=None,
+                      async_recording=None, queue_size=None,
+                      overflow_policy=None, block_timeout=None,
+                      aggregate_duplicates=None, zlog_rate_period=None,
+                      zlog_rate_burst=None, zlog_rate_key=None,
+                      sample_first=None, sample_rate=None,
+                      sample_window=None, max_value_size=None,
+                      max_request_size=None, max_traceback_size=None,
+                      max_frames=None, max_bytes=None, storage=None,
+                      compress_details=None, compression_dictionary=None,
+                      intern_frames=None):
         """Sets the properties
 
-        keep_entries, copy_to_logfile, ignored_exceptions
+        keep_entries, copy_to_logfile, ignored_exceptions, lazy_formatting,
+        async_recording, queue_size, overflow_policy, block_timeout,
+        aggregate_duplicates, zlog_rate_period, zlog_rate_burst, zlog_rate_key,
+        sample_first, sample_rate, sample_window, max_value_size,
+        max_request_size, max_traceback_size, max_frames, max_bytes, storage,
+        compress_details, compression_dictionary, intern_frames
+
+        The properties following ``ignored_exceptions`` are optional; passing
+        None leaves their current value unchanged.
 
         :keyword tuple ignored_exceptions: A sequence of *str* unqualified
             class names (such as ``'Unauthorized'``) that will be ignored.
             The values here will be compared with the ``__name__`` of the first
             member of the ``info`` passed to :meth:`raising`.
+        :keyword bool lazy_formatting: If true, :meth:`raising` only takes a
+            cheap snapshot of the traceback; the text and HTML renderings are
+            produced when an entry is first retrieved.  Traceback
+            supplements and ``__traceback_info__`` are formatted at once.
+        :keyword bool async_recording: If true, :meth:`raising` only queues
+            the exception; a background thread formats and logs it.
+        :keyword int queue_size: The maximum number of exceptions waiting to
+            be recorded in the background.
+        :keyword str overflow_policy: What to do when the queue is full:
+            ``'drop-oldest'``, ``'drop-newest'`` or ``'block'``.
+        :keyword float block_timeout: How many seconds ``'block'`` waits for
+            room in the queue before dropping the exception.
+        :keyword bool aggregate_duplicates: If true, an exception with the
+            same fingerprint as a logged one only updates the occurrence
+            count, times and samples of that entry.
+        :keyword float zlog_rate_period: The average number of seconds
+            between two copies of exceptions to the Event Log.
+        :keyword int zlog_rate_burst: The number of copies to the Event Log
+            allowed in a burst before ``zlog_rate_period`` applies.
+        :keyword str zlog_rate_key: Whether the Event Log rate limit applies
+            per exception ``'type'`` or per ``'fingerprint'``.
+        :keyword int sample_first: While sampling, the number of exceptions
+            of a type that are always recorded in each sampling window.
+        :keyword float sample_rate: The fraction of the remaining exceptions
+            of a type that is recorded. 1 disables sampling.
+        :keyword float sample_window: The length of a sampling window in
+            seconds.
+        :keyword int max_value_size: The maximum number of characters kept
+            of the exception value and of each request key and value.
+        :keyword int max_request_size: The maximum number of characters of
+            the request dump.
+        :keyword int max_traceback_size: The maximum number of characters of
+            each traceback rendering.  The frames in the middle are left
+            out first; the first line and the exception are always kept.
+        :keyword int max_frames: The maximum number of frames rendered; the
+            middle of longer tracebacks is left out.
+
+        For the size limits, 0 means unlimited; longer values are cut off
+        and marked as truncated.
+
+        :keyword int max_bytes: The maximum estimated memory used by the
+            log entries; 0 means unlimited. The oldest entries are evicted
+            to stay below this, as they are when there are more than
+            ``keep_entries``. The most recent entry is always kept.
+            Lazily formatted tracebacks count once they are rendered.
+        :keyword str storage: The name of the :class:`IErrorLogStorageFactory`
+            utility that creates the storage of the log. With the default,
+            an empty name, the unnamed factory is used if there is one, and
+            otherwise the entries are kept in memory.
+        :keyword bool compress_details: If true, the tracebacks and the
+            request dump of new entries are compressed with zlib.  They are
+            decompressed whenever they are read.
+        :keyword bool compression_dictionary: If true, they are compressed
+            with a preset dictionary made of recent entries, which
+            compresses the repeated parts of tracebacks much better.  The
+            dictionaries use up to 32 KiB each and are replaced every 256
+            entries, but kept as long as entries compressed with them.
+        :keyword bool intern_frames: If true and the details are not
+            compressed, the formatted frames of tracebacks are shared by
+            the entries of the log instead of being copied into each, and
+            joined when read.  Frames are forgotten once no entry uses
+            them.  Lazily formatted tracebacks are not shared.
+        """
+
+    def flush(timeout=None):
+        """Waits until the errors queued for background recording are logged.
+
+        Returns False if that did not happen within *timeout* seconds.
+        """
+
+    def shutdown(timeout=None):
+        """Logs the errors queued for background recording and stops the
+        background thread.
+
+        Returns False if the queue could not be drained within *timeout*
+        seconds.
+        """
+
+    def getQueueStatistics():
+        """Returns the background recording queue statistics.
+
+        A dictionary with the number of ``queued``, ``processed`` and
+        ``dropped`` errors.
+        """
+
+    def getSamplingStatistics():
+        """Returns how many exceptions were seen and recorded while sampling.
+
+        A dictionary mapping exception type names to dictionaries with the
+        number of exceptions ``seen`` and ``recorded``.
+        """
+
+    def getRateLimitStatistics():
+        """Returns statistics about the Event Log rate limit.
+
+        A dictionary with the number of ``allowed`` and ``suppressed``
+        copies, the number of tracked ``keys`` and, as ``pending``, the
+        number of copies suppressed per key since the last allowed one.
+        """
+
+    def getLogStatistics():
+        """Returns the size of the log.
+
+        A dictionary with the number of ``entries``, their estimated size in
+        ``bytes``, the number of entries ``evicted`` so far and the
+        ``keep_entries`` and ``max_bytes`` limits.  With a journal, also
+        the number of ``journal_records`` written and the number and size
+        of the ``journal_segments`` as ``journal_bytes``.  With
+        ``intern_frames``, also the number of ``interned_lines`` shared by
+        the entries and their size in ``interned_bytes``, which are not
+        part of ``bytes``.
+        """
+
+    def getExportStatistics():
+        """Returns statistics about the structured export.
+
+        A dictionary with the number of ``exported`` and ``dropped``
+        records and the number of records ``pending`` to be written.
+        """
+
+    def getMetrics():
+        """Returns the metrics of the utility.
+
+        A dictionary with the number of exceptions ``raised`` and
+        ``ignored``, each a dictionary by exception type name; the
+        number of copies to the Event Log, ``zlog_copies``, and of those
+        suppressed by the rate limit, ``zlog_suppressed``; the
+        ``log_entries``, ``log_bytes`` and ``log_evicted`` statistics of
+        the log; and the number of errors ``queued`` for background
+        recording and ``dropped`` from its queue.
+
+        ``durations`` maps the phases of recording an error to histograms
+        of the seconds they took: getting the ``username``, ``formatting``
+        the traceback, dumping the ``request``, ``storing`` the entry in
+        the log, ``logging`` it to the Event Log and the ``total`` of
+        recording it.  Each histogram is a dictionary with the ``count``
+        and ``sum`` of the durations and, as ``buckets``, a list of
+        ``(bound, count)`` tuples with the number of durations up to each
+        bound, the last bound being infinity.
+
+        :func:`zope.error.metrics.renderPrometheus` renders these in the
+        Prometheus text format.
         """
 
     def getLogEntries():
         """Returns the entries in the log, most recent first."""
 
+    def getLogHistory(offset=0, limit=20):
+        """Returns logged entries, most recent first.
+
+        With a journal, this includes entries no longer kept in memory.
+        The first *offset* entries are skipped and at most *limit* are
+        returned.
+        """
+
     def getLogEntryById(id):
         """Return LogEntry by ID"""
+
+    def getLogEntryDetails(id):
+        """Returns the tracebacks and the request dump of a log entry.
+
+        A dictionary with the ``tb_text``, ``tb_html`` and ``req_html`` of
+        the entry with *id*, or None if there is no such entry.  Together
+        with the summaries returned by :meth:`queryLogEntries` this is all
+        an entry holds.
+        """
+
+    def queryLogEntries(offset=0, limit=20, type=None, since=None,
+                        until=None, username=None, url=None, text=None,
+                        full=False):
+        """Returns the logged entries matching the criteria, most recent
+        first.
+
+        The first *offset* matching entries are skipped and at most *limit*
+        are returned; a *limit* of None returns all of them.  The criteria
+        are those of :meth:`IErrorLogStorage.query`.
+
+        Unless *full* is true, the entries are returned as summaries:
+        dictionaries without the tracebacks and the request dump.
+        """
+
+
+class IErrorLogStorage(Interface):
+    """Storage for the entries of an error log.
+
+    The entries are :class:`~zope.error.log.ErrorLogEntry` objects.  A
+    storage keeps at most ``capacity`` entries and, unless ``max_bytes`` is
+    0, entries of at most about that many bytes in total, evicting the
+    oldest ones to stay within these bounds.  It must be safe to use from
+    several threads.
+    """
+
+    capacity = Attribute("The maximum number of entries.")
+
+    max_bytes = Attribute(
+        "The maximum size of the entries in bytes; 0 means unlimited.")
+
+    def append(entry, capacity=None, max_bytes=None):
+        """Adds *entry*, first changing the bounds if given.
+
+        An entry with the id of a stored one replaces it.
+        """
+
+    def addOccurrence(fingerprint, now, sample, max_samples):
+        """Counts another occurrence of the error with *fingerprint*.
+
+        Replaces the most recent entry with that fingerprint with the result
+        of its ``withOccurrence`` method, which becomes the most recent
+        entry and is returned.  Returns None if there is no entry with
+        that fingerprint.
+        """
+
+    def resize(capacity, max_bytes=None):
+        """Changes the bounds, evicting the oldest entries as needed."""
+
+    def getEntries():
+        """Returns a list of the entries, most recent first."""
+
+    def getEntryById(id):
+        """Returns the entry with the given id, or None."""
+
+    def getEntryByFingerprint(fingerprint):
+        """Returns the most recent entry with the given fingerprint, or None.
+        """
+
+    def query(offset=0, limit=None, type=None, since=None, until=None,
+              username=None, url=None, text=None):
+        """Returns the entries matching all the given criteria, most recent
+        first.
+
+        The first *offset* matching entries are skipped and at most *limit*
+        are returned.  The criteria are the exception *type*, a time range
+        that ``last_seen`` is in, from *since* to *until*, parts of the
+        *username* and the *url*, and *text* to look for, ignoring case,
+        in the value and the text traceback.
+        """
+
+    def getStatistics():
+        """Returns a dictionary with statistics about the storage.
+
+        It contains at least the number of ``entries``, their size in
+        ``bytes`` and the number of entries ``evicted`` so far.
+        """
+
+    def clear():
+        """Removes all entries."""
+
+    def close():
+        """Releases the resources held by the storage.
+
+        The storage is not used afterwards.
+        """
+
+    def __len__():
+        """Returns the number of entries."""
+
+    def __iter__():
+        """Iterates over the entries, oldest first."""
+
+
+class IErrorLogStorageFactory(Interface):
+    """Creates the storage of error logs.
+
+    Register a factory as a utility to use it for all error reporting
+    utilities, or under a name that is set as the ``storage`` property of
+    some of them.
+    """
+
+    def __call__(key, capacity, max_bytes):
+        """Returns an :class:`IErrorLogStorage` for the log with *key*.
+
+        *key* identifies the error reporting utility, and is the same in
+        all processes.  *capacity* and *max_bytes* are the initial bounds.
+        """
@@ -0,0 +1,415 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Append-only on-disk journal of logged errors
+
+The journal is a directory of numbered segment files.  Each segment is a
+sequence of records, each a header with the length and CRC-32 checksum of
+the payload followed by the payload, a JSON object.  A record either
+holds a complete entry or another occurrence of an aggregated one.
+
+Records are only ever appended, so a crash can at worst leave a torn
+record at the end of the last segment; it is detected by its length or
+checksum and cut off when the journal is opened again.
+"""
+__docformat__ = 'restructuredtext'
+
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+from threading import Condition
+from threading import Lock
+from threading import Thread
+
+from zope.interface import implementer
+
+from zope.error.interfaces import IErrorLogStorage
+from zope.error.log import ErrorLogEntry
+from zope.error.log import RingBufferLog
+
+
+logger = logging.getLogger('SiteError')
+
+# The payload length and its CRC-32 checksum.
+_HEADER = struct.Struct('>II')
+_SUFFIX = '.journal'
+
+
+def _dumpEntry(entry):
+    record = entry.copy()
+    record['op'] = 'entry'
+    return record
+
+
+def _scan(buffer):
+    """Yields the start and end of the intact record payloads in *buffer*.
+
+    Stops at the first torn or corrupt record.
+    """
+    offset = 0
+    size = len(buffer)
+    while offset + _HEADER.size <= size:
+        length, checksum = _HEADER.unpack_from(buffer, offset)
+        start = offset + _HEADER.size
+        end = start + length
+        if end > size or zlib.crc32(buffer[start:end]) != checksum:
+            return
+        yield start, end
+        offset = end
+
+
+@implementer(IErrorLogStorage)
+class JournalLog:
+    """An error log that also writes every entry to an on-disk journal.
+
+    The most recent entries are kept in a :class:`RingBufferLog`, with the
+    same bounds and API, so reading the log does not touch the disk.  When
+    the log is created, it is filled from the journal in *directory*,
+    reading only as many of the most recent segments as needed for
+    *capacity* entries.  Older entries can be paged through with
+    :meth:`getHistory`.
+
+    Records are written to the operating system right away, so they
+    survive the process crashing.  They are synced to disk by a background
+    thread at most *fsync_interval* seconds after they were written, so
+    logging an error never waits for the disk, and when the log is closed.
+    A segment is rotated once it holds *segment_size* bytes, and only the
+    most recent *max_segments* segments are kept.
+
+    Tracebacks that are rendered lazily are rendered when the entry is
+    written to the journal.  A journal directory must not be shared by
+    several logs.
+    """
+
+    def __init__(self, directory, capacity, max_bytes=0,
+                 segment_size=4 * 1024 * 1024, max_segments=16,
+                 fsync_interval=1.0):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.max_segments = max(1, max_segments)
+        self.fsync_interval = fsync_interval
+        self._lock = Lock()
+        self._condition = Condition(self._lock)
+        self._memory = RingBufferLog(capacity, max_bytes)
+        self._file = None
+        self._written = 0
+        # The time the oldest record not synced to disk was written, and
+        # the files of rotated segments that are still to be synced.
+        self._unsynced_since = None
+        self._retired = []
+        self._thread = None
+        self._syncing = False
+        self._closing = False
+        os.makedirs(directory, exist_ok=True)
+        self._reload()
+        numbers = self._segmentNumbers()
+        self._openSegment(numbers[-1] if numbers else 1)
+
+    @property
+    def capacity(self):
+        return self._memory.capacity
+
+    @property
+    def max_bytes(self):
+        return self._memory.max_bytes
+
+    def _segmentPath(self, number):
+        return os.path.join(self.directory, '%012d%s' % (number, _SUFFIX))
+
+    def _segmentNumbers(self):
+        numbers = []
+        for name in os.listdir(self.directory):
+            stem, ext = os.path.splitext(name)
+            if ext == _SUFFIX and stem.isdigit():
+                numbers.append(int(stem))
+        return sorted(numbers)
+
+    def _readRecords(self, number):
+        """Returns the intact records of a segment, oldest first."""
+        try:
+            with open(self._segmentPath(number), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:  # pragma: no cover
+            # Removed by a rotation in the meantime.
+            return []
+        return [json.loads(data[start:end]) for start, end in _scan(data)]
+
+    def _reload(self):
+        # Read segments from the most recent one back until they hold
+        # enough entries, then replay them in order.
+        segments = []
+        ids = set()
+        for number in reversed(self._segmentNumbers()):
+            if len(ids) >= self._memory.capacity:
+                break
+            records = self._readRecords(number)
+            segments.append(records)
+            ids.update(r['id'] for r in records if r['op'] == 'entry')
+        for records in reversed(segments):
+            for record in records:
+                self._replay(record)
+
+    def _replay(self, record):
+        if record['op'] == 'entry':
+            self._memory.append(ErrorLogEntry.fromMapping(record))
+        else:
+            self._memory.addOccurrence(
+                record['fingerprint'], record['now'],
+                tuple(record['sample']), record['max_samples'])
+
+    def _openSegment(self, number):
+        path = self._segmentPath(number)
+        # Cut off a record torn by a crash, so appended records can be read.
+        if os.path.exists(path):
+            with open(path, 'r+b') as f:
+                data = f.read()
+                end = 0
+                for _start, end in _scan(data):
+                    pass
+                if end < len(data):
+                    f.truncate(end)
+        self._number = number
+        self._file = open(path, 'ab')
+        self._size = self._file.tell()
+
+    def _rotate(self):
+        # The background thread syncs and closes the previous segment.
+        self._retired.append(self._file)
+        self._openSegment(self._number + 1)
+        numbers = self._segmentNumbers()
+        for number in numbers[:-self.max_segments]:
+            try:
+                os.remove(self._segmentPath(number))
+            except FileNotFoundError:  # pragma: no cover
+                pass
+
+    def _sync(self):
+        files, self._retired = self._retired, []
+        for f in files:
+            with f:
+                os.fsync(f.fileno())
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._unsynced_since = None
+
+    def _ensureSyncer(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = Thread(
+                target=self._run, name='zope.error journal', daemon=True)
+            self._thread.start()
+
+    def _nextSync(self):
+        # Waits until records are due to be synced, and returns the rotated
+        # files and a duplicate of the descriptor of the current one, or
+        # None when closing.
+        while not self._closing:
+            timeout = None
+            if self._unsynced_since is not None:
+                timeout = (self._unsynced_since + self.fsync_interval
+                           - time.monotonic())
+                if timeout <= 0:
+                    files, self._retired = self._retired, []
+                    self._unsynced_since = None
+                    return files, os.dup(self._file.fileno())
+            self._condition.wait(timeout)
+        return None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                due = self._nextSync()
+                if due is None:
+                    return
+                self._syncing = True
+            files, fd = due
+            try:
+                for f in files:
+                    with f:
+                        os.fsync(f.fileno())
+                os.fsync(fd)
+            except OSError:
+                logger.exception("Error in ErrorReportingUtility while"
+                                 " syncing the journal in %s", self.directory)
+            finally:
+                os.close(fd)
+                with self._condition:
+                    self._syncing = False
+                    self._condition.notify_all()
+
+    def _write(self, record):
+        try:
+            self._writeRecord(record)
+        except OSError:
+            # The entry is still logged in memory.
+            logger.exception("Error in ErrorReportingUtility while writing"
+                             " to the journal in %s", self.directory)
+
+    def _writeRecord(self, record):
+        payload = json.dumps(record, separators=(',', ':')).encode('utf-8')
+        self._file.write(_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self._file.write(payload)
+        self._file.flush()
+        self._size += _HEADER.size + len(payload)
+        self._written += 1
+        if self._unsynced_since is None:
+            self._unsynced_since = time.monotonic()
+            self._ensureSyncer()
+            self._condition.notify_all()
+        if self._size >= self.segment_size:
+            self._rotate()
+
+    def append(self, entry, capacity=None, max_bytes=None):
+        """Adds *entry*, first changing the bounds if given."""
+        with self._lock:
+            self._memory.append(entry, capacity, max_bytes)
+            self._write(_dumpEntry(entry))
+
+    def addOccurrence(self, fingerprint, now, sample, max_samples):
+        """Counts another occurrence of the error with *fingerprint*.
+
+        See :meth:`RingBufferLog.addOccurrence`.
+        """
+        with self._lock:
+            entry = self._memory.addOccurrence(
+                fingerprint, now, sample, max_samples)
+            if entry is not None:
+                self._write({
+                    'op': 'occurrence',
+                    'id': entry.id,
+                    'fingerprint': fingerprint,
+                    'now': now,
+                    'sample': sample,
+                    'max_samples': max_samples,
+                })
+            return entry
+
+    def resize(self, capacity, max_bytes=None):
+        """Changes the bounds of the in-memory entries."""
+        self._memory.resize(capacity, max_bytes)
+
+    def getEntries(self):
+        """Returns a list of the in-memory entries, most recent first."""
+        return self._memory.getEntries()
+
+    def getEntryById(self, id):
+        """Returns the in-memory entry with the given id, or None."""
+        return self._memory.getEntryById(id)
+
+    def getEntryByFingerprint(self, fingerprint):
+        """Returns the most recent entry with the given fingerprint, or None.
+        """
+        return self._memory.getEntryByFingerprint(fingerprint)
+
+    def query(self, offset=0, limit=None, type=None, since=None, until=None,
+              username=None, url=None, text=None):
+        """Returns the in-memory entries matching the criteria, most recent
+        first.
+        """
+        return self._memory.query(offset, limit, type, since, until,
+                                  username, url, text)
+
+    def getHistory(self, offset=0, limit=None):
+        """Returns entries from the journal, most recent first.
+
+        The first *offset* entries are skipped and at most *limit* are
+        returned.  The segments are memory-mapped and read from the most
+        recent one back only as far as needed, so paging through the
+        history does not load it into memory.  Entries are ordered by the
+        time they were first logged.
+        """
+        with self._lock:
+            self._file.flush()
+            numbers = self._segmentNumbers()
+        result = []
+        skipped = 0
+        # Occurrences found so far of entries that are still to be read.
+        occurrences = {}
+        for number in reversed(numbers):
+            if limit is not None and len(result) >= limit:
+                break
+            try:
+                with open(self._segmentPath(number), 'rb') as f:
+                    if not os.fstat(f.fileno()).st_size:
+                        continue
+                    buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:  # pragma: no cover
+                # Removed by a rotation in the meantime.
+                continue
+            with buffer:
+                for start, end in reversed(list(_scan(buffer))):
+                    record = json.loads(buffer[start:end])
+                    if record['op'] != 'entry':
+                        occurrences.setdefault(
+                            record['fingerprint'], []).append(record)
+                        continue
+                    if skipped < offset:
+                        occurrences.pop(record['fingerprint'], None)
+                        skipped += 1
+                        continue
+                    entry = ErrorLogEntry.fromMapping(record)
+                    for occurrence in reversed(
+                            occurrences.pop(record['fingerprint'], ())):
+                        entry = entry.withOccurrence(
+                            occurrence['now'], tuple(occurrence['sample']),
+                            occurrence['max_samples'])
+                    result.append(entry)
+                    if limit is not None and len(result) >= limit:
+                        break
+        return result
+
+    def getStatistics(self):
+        """Returns the statistics of the in-memory entries, the number of
+        records written and the number and size of the journal segments.
+        """
+        stats = self._memory.getStatistics()
+        with self._lock:
+            numbers = self._segmentNumbers()
+            stats['journal_records'] = self._written
+        stats['journal_segments'] = len(numbers)
+        stats['journal_bytes'] = sum(
+            os.path.getsize(self._segmentPath(number)) for number in numbers)
+        return stats
+
+    def sync(self):
+        """Syncs the written records to disk."""
+        with self._condition:
+            self._condition.wait_for(lambda: not self._syncing)
+            self._sync()
+
+    def clear(self):
+        """Forgets the in-memory entries; the journal is kept."""
+        self._memory.clear()
+
+    def close(self):
+        """Syncs and closes the journal."""
+        with self._condition:
+            self._closing = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+                self._file.close()
+
+    def __len__(self):
+        return len(self._memory)
+
+    def __iter__(self):
+        """Iterates over a copy of the in-memory entries, oldest first."""
+        return iter(self._memory)
@@ -0,0 +1,676 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""In-memory storage for logged errors
+"""
+__docformat__ = 'restructuredtext'
+
+import sys
+import time as _time
+from bisect import bisect_left
+from bisect import bisect_right
+from collections import OrderedDict
+from collections import deque
+from collections.abc import Mapping
+from itertools import islice
+from threading import Lock
+from threading import RLock
+
+from zope.interface import implementer
+
+from zope.error.compression import ZLIB
+from zope.error.interfaces import IErrorLogStorage
+
+
+class StringTable:
+    """A table of strings shared by several log entries.
+
+    Tracebacks of the same code repeat the same frames, so log entries can
+    share the formatted frames instead of keeping a copy each.  The table
+    counts the references to each string and forgets it when it is
+    released as often as it was interned.
+    """
+
+    def __init__(self):
+        # Strings are released when entries are garbage collected, which
+        # may happen while the table is being changed.
+        self._lock = RLock()
+        self._strings = {}  # { string -> [string, references] }
+
+    def intern(self, strings):
+        """Returns a tuple of the shared copies of *strings*."""
+        result = []
+        with self._lock:
+            for string in strings:
+                item = self._strings.get(string)
+                if item is None:
+                    item = self._strings[string] = [string, 0]
+                item[1] += 1
+                result.append(item[0])
+        return tuple(result)
+
+    def release(self, strings):
+        """Releases *strings*, which were interned before."""
+        with self._lock:
+            for string in strings:
+                item = self._strings[string]
+                item[1] -= 1
+                if not item[1]:
+                    del self._strings[string]
+
+    def getStatistics(self):
+        """Returns the number of strings, their size in bytes and the
+        number of references to them.
+        """
+        with self._lock:
+            items = list(self._strings.values())
+        return {
+            'strings': len(items),
+            'bytes': sum(sys.getsizeof(item[0]) for item in items),
+            'references': sum(item[1] for item in items),
+        }
+
+    def __len__(self):
+        return len(self._strings)
+
+
+class EntryDetails:
+    """The tracebacks and the request dump of a log entry.
+
+    These are by far the largest fields of an entry, and are only needed
+    to show the entry in detail, so they are kept apart from the others.
+    If *compress* is a :class:`~zope.error.compression.ZlibCodec`, or true
+    to use zlib without a dictionary, they are compressed and decompressed
+    on each access.
+
+    Otherwise, with a :class:`StringTable` as *table*, tracebacks given as
+    lists of lines are kept as tuples of lines interned in the table, and
+    joined on each access.  The log storing the details releases them
+    with :meth:`release` when it drops them; details that are garbage
+    collected without being released release them then.
+    """
+
+    __slots__ = ('_fields', '_codec', '_table')
+
+    def __init__(self, tb_text=None, tb_html=None, req_html=None,
+                 compress=False, table=None):
+        self._table = None
+        if compress is True:
+            compress = ZLIB
+        self._codec = compress or None
+        if table is not None and self._codec is None:
+            self._table = table
+        tb_text = self._intern(tb_text)
+        tb_html = self._intern(tb_html)
+        self._fields = self._encode((tb_text, tb_html, req_html))
+
+    def _intern(self, value):
+        if isinstance(value, list):
+            if self._table is None:
+                return ''.join(value)
+            return self._table.intern(value)
+        return value
+
+    def _encode(self, fields):
+        codec = self._codec
+        if codec is None:
+            return fields
+        return tuple(None if value is None else codec.compress(value)
+                     for value in fields)
+
+    def _get(self, index):
+        value = self._fields[index]
+        if value is None:
+            return value
+        if self._codec is not None:
+            return self._codec.decompress(value)
+        if type(value) is tuple:
+            return ''.join(value)
+        return value
+
+    def release(self):
+        """Releases the interned lines of the tracebacks.
+
+        The tracebacks can still be read, but their lines are no longer
+        shared with those of new entries.  Releasing again does nothing.
+        """
+        table = self._table
+        if table is not None:
+            self._table = None
+            for value in self._fields[:2]:
+                if type(value) is tuple:
+                    table.release(value)
+
+    def __del__(self):
+        self.release()
+
+    @property
+    def tb_text(self):
+        return self._get(0)
+
+    @property
+    def tb_html(self):
+        return self._get(1)
+
+    @property
+    def req_html(self):
+        return self._get(2)
+
+    def withTracebacks(self, tb_text, tb_html):
+        """Returns a copy with the given tracebacks."""
+        details = self.__class__()
+        details._codec = self._codec
+        details._fields = (details._encode((tb_text, tb_html))
+                           + self._fields[2:])
+        return details
+
+    def getSize(self):
+        """Returns the memory used by the stored fields in bytes.
+
+        The dictionary of the codec and the interned lines are shared, so
+        they are not counted.
+        """
+        size = sys.getsizeof(self) + sys.getsizeof(self._fields)
+        for value in self._fields:
+            if value is not None:
+                size += sys.getsizeof(value)
+        return size
+
+
+class ErrorLogEntry(Mapping):
+    """An immutable record of a logged error.
+
+    The fields can be read as attributes or, for compatibility with the
+    dictionaries logged before, as items.  As entries cannot be changed,
+    they can be handed out without copying.
+
+    The tracebacks may be rendered lazily: *render* is called on first
+    access to ``tb_text`` or ``tb_html`` and must return both.
+
+    The tracebacks and the request dump are kept in :class:`EntryDetails`,
+    compressed as *compress* says, or given as *details* instead.
+    :meth:`getSummary` returns the other fields and :meth:`getDetails`
+    these.
+
+    An entry may stand for several occurrences of the same error, see
+    :meth:`withOccurrence`.  ``first_seen`` and ``last_seen`` are
+    timestamps, and ``samples`` holds ``(timestamp, url, username)`` of the
+    most recent occurrences.
+    """
+
+    __slots__ = ('id', 'type', 'value', 'time', '_details', 'username',
+                 'url', '_render', 'fingerprint', 'count', 'first_seen',
+                 'last_seen', 'samples', '_on_render')
+
+    _fields = ('type', 'value', 'time', 'id', 'tb_text', 'tb_html',
+               'username', 'url', 'req_html', 'fingerprint', 'count',
+               'first_seen', 'last_seen', 'samples')
+
+    def __init__(self, id, type, value, time, tb_text=None, tb_html=None,
+                 username=None, url=None, req_html=None, render=None,
+                 fingerprint=None, count=1, first_seen=None, last_seen=None,
+                 samples=(), compress=False, details=None):
+        init = super().__setattr__
+        init('id', id)
+        init('type', type)
+        init('value', value)
+        init('time', time)
+        if details is None:
+            details = EntryDetails(tb_text, tb_html, req_html, compress)
+        init('_details', details)
+        init('username', username)
+        init('url', url)
+        init('_render', render)
+        init('fingerprint', fingerprint)
+        init('count', count)
+        init('first_seen', first_seen)
+        init('last_seen', last_seen)
+        init('samples', tuple(samples))
+        init('_on_render', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ErrorLogEntry objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('ErrorLogEntry objects are immutable')
+
+    def _renderTracebacks(self):
+        render = self._render
+        if render is not None:
+            tb_text, tb_html = render()
+            # Set the renderings before dropping the renderer, so that
+            # concurrent readers never see a half-rendered entry.
+            super().__setattr__(
+                '_details', self._details.withTracebacks(tb_text, tb_html))
+            super().__setattr__('_render', None)
+            on_render = self._on_render
+            if on_render is not None:
+                super().__setattr__('_on_render', None)
+                on_render(self)
+
+    def _notifyRendered(self, callback):
+        # Called by the log storing the entry, to account for the size of
+        # the tracebacks once they are rendered.
+        super().__setattr__('_on_render', callback)
+
+    def _releaseDetails(self):
+        # Called by the log storing the entry when it drops it.
+        self._details.release()
+
+    @property
+    def tb_text(self):
+        self._renderTracebacks()
+        return self._details.tb_text
+
+    @property
+    def tb_html(self):
+        self._renderTracebacks()
+        return self._details.tb_html
+
+    @property
+    def req_html(self):
+        return self._details.req_html
+
+    def withOccurrence(self, now, sample, max_samples):
+        """Returns a copy counting one more occurrence at *now*.
+
+        *sample* is added to the most recent ``samples``, of which at most
+        *max_samples* are kept.  ``time`` becomes the time of the new
+        occurrence.
+        """
+        samples = (self.samples + (sample,))[-max_samples:]
+        return self.__class__(
+            id=self.id,
+            type=self.type,
+            value=self.value,
+            time=_time.ctime(now),
+            username=self.username,
+            url=self.url,
+            render=self._render,
+            fingerprint=self.fingerprint,
+            count=self.count + 1,
+            first_seen=self.first_seen,
+            last_seen=now,
+            samples=samples if max_samples > 0 else (),
+            details=self._details,
+        )
+
+    def getSize(self):
+        """Returns an estimate of the memory used by this entry in bytes.
+
+        Tracebacks that have not been rendered yet are not counted, and
+        compressed fields are counted in their compressed size.
+        """
+        size = sys.getsizeof(self) + self._details.getSize()
+        for value in (self.id, self.type, self.value, self.time,
+                      self.username, self.url, self.fingerprint):
+            if value is not None:
+                size += sys.getsizeof(value)
+        if self.samples:
+            size += sys.getsizeof(self.samples)
+            for sample in self.samples:
+                size += sys.getsizeof(sample)
+        return size
+
+    def __getitem__(self, key):
+        if key not in self._fields:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def copy(self):
+        """Returns the fields as a new dictionary."""
+        return dict(self)
+
+    def getSummary(self):
+        """Returns the fields except the tracebacks and the request dump
+        as a new dictionary.
+
+        Lazily rendered tracebacks are not rendered.
+        """
+        return {
+            'type': self.type,
+            'value': self.value,
+            'time': self.time,
+            'id': self.id,
+            'username': self.username,
+            'url': self.url,
+            'fingerprint': self.fingerprint,
+            'count': self.count,
+            'first_seen': self.first_seen,
+            'last_seen': self.last_seen,
+            'samples': self.samples,
+        }
+
+    def getDetails(self):
+        """Returns the tracebacks and the request dump as a new dictionary.
+        """
+        self._renderTracebacks()
+        details = self._details
+        return {
+            'tb_text': details.tb_text,
+            'tb_html': details.tb_html,
+            'req_html': details.req_html,
+        }
+
+    @classmethod
+    def fromMapping(cls, fields):
+        """Creates an entry from a mapping like the one :meth:`copy` returns.
+
+        This is the inverse of :meth:`copy` for fields that were stored
+        somewhere that does not keep tuples, like JSON.
+        """
+        fields = {name: fields.get(name) for name in cls._fields}
+        fields['count'] = fields['count'] or 1
+        fields['samples'] = [
+            tuple(sample) for sample in fields['samples'] or ()]
+        return cls(**fields)
+
+    def __repr__(self):
+        return '<{} {} {}: {}>'.format(
+            type(self).__name__, self.id, self.type, self.value)
+
+
+def _matches(entry, type, since, until, username, url, text):
+    if type is not None and entry.type != type:
+        return False
+    if since is not None or until is not None:
+        last_seen = entry.last_seen
+        if last_seen is None:
+            return False
+        if since is not None and last_seen < since:
+            return False
+        if until is not None and last_seen > until:
+            return False
+    if username is not None and username not in (entry.username or ''):
+        return False
+    if url is not None and url not in (entry.url or ''):
+        return False
+    if text is not None:
+        return (text in str(entry.value).lower()
+                or text in (entry.tb_text or '').lower())
+    return True
+
+
+def filterEntries(entries, offset=0, limit=None, type=None, since=None,
+                  until=None, username=None, url=None, text=None):
+    """Returns the *entries* matching the criteria.
+
+    See :meth:`zope.error.interfaces.IErrorLogStorage.query` for the
+    criteria.  The order of *entries* is kept.  Only as many entries are
+    looked at as needed for *limit* matches.
+    """
+    if text is not None:
+        text = text.lower()
+    result = []
+    for entry in entries:
+        if limit is not None and len(result) >= limit:
+            break
+        if _matches(entry, type, since, until, username, url, text):
+            if offset:
+                offset -= 1
+            else:
+                result.append(entry)
+    return result
+
+
+@implementer(IErrorLogStorage)
+class RingBufferLog:
+    """A bounded log of error entries.
+
+    The log holds at most *capacity* entries and, if *max_bytes* is not 0,
+    entries of at most that many bytes in total, as estimated by
+    :meth:`ErrorLogEntry.getSize`.  Appending is O(1); the oldest entries
+    are evicted to stay within the bounds, though the most recent entry is
+    always kept.  Entries whose tracebacks are rendered lazily are counted
+    again once they are rendered.
+
+    Entries are kept in an ordered mapping keyed by their id, so they can
+    be looked up, replaced and moved to the most recent position in
+    constant time.  Entries are also indexed by fingerprint, and, for
+    :meth:`query`, by type and by the time they were last seen.  Each log
+    has its own lock, so logs of different utilities do not contend with
+    each other.
+    """
+
+    def __init__(self, capacity, max_bytes=0):
+        self._lock = Lock()
+        self._capacity = max(0, capacity)
+        self._max_bytes = max(0, max_bytes)
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._evicted = 0
+        self._by_fingerprint = {}
+        # The ids of the entries of each type, in the order of the log.
+        self._by_type = {}
+        # The (last_seen, sequence, id) of the entries with a last_seen in
+        # time order, and the key of each entry in it.  The sequence number
+        # increases with each stored entry, so it orders entries like the
+        # log.  Entries are almost always last seen after the entries
+        # before them, so keys are appended; the keys of removed entries
+        # are only dropped once they are the oldest ones, or once they
+        # outnumber the others.
+        self._by_time = deque()
+        self._time_keys = {}
+        self._removed_times = set()
+        self._sequence = 0
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def append(self, entry, capacity=None, max_bytes=None):
+        """Adds *entry*, first changing the bounds if given.
+
+        An entry with the id of a logged one replaces it.
+        """
+        with self._lock:
+            self._setBounds(capacity, max_bytes)
+            if self._capacity:
+                self._store(entry)
+                if entry.fingerprint is not None:
+                    self._by_fingerprint[entry.fingerprint] = entry.id
+            else:
+                entry._releaseDetails()
+            self._evict()
+
+    def addOccurrence(self, fingerprint, now, sample, max_samples):
+        """Counts another occurrence of the error with *fingerprint*.
+
+        The aggregated entry becomes the most recent one and is returned.
+        Returns None if the log has no entry with that fingerprint.
+        """
+        with self._lock:
+            entry = self._entries.get(self._by_fingerprint.get(fingerprint))
+            if entry is None:
+                return None
+            entry = entry.withOccurrence(now, sample, max_samples)
+            self._store(entry)
+            self._evict()
+            return entry
+
+    def resize(self, capacity, max_bytes=None):
+        """Changes the bounds, keeping the most recent entries."""
+        with self._lock:
+            self._setBounds(capacity, max_bytes)
+            self._evict()
+
+    def _setBounds(self, capacity, max_bytes):
+        if capacity is not None:
+            self._capacity = max(0, capacity)
+        if max_bytes is not None:
+            self._max_bytes = max(0, max_bytes)
+
+    def _store(self, entry):
+        old = self._entries.get(entry.id)
+        if old is not None:
+            self._unindex(old)
+            # Further occurrences of an error share its details.
+            if old._details is not entry._details:
+                old._releaseDetails()
+        size = entry.getSize()
+        self._bytes += size - self._sizes.get(entry.id, 0)
+        self._sizes[entry.id] = size
+        self._entries[entry.id] = entry
+        self._entries.move_to_end(entry.id)
+        self._index(entry)
+        if entry._render is not None:
+            entry._notifyRendered(self._rendered)
+
+    def _rendered(self, entry):
+        # The tracebacks of a lazily formatted entry were rendered, which
+        # makes it larger.
+        with self._lock:
+            if self._entries.get(entry.id) is not entry:
+                return
+            size = entry.getSize()
+            self._bytes += size - self._sizes[entry.id]
+            self._sizes[entry.id] = size
+            self._evict()
+
+    def _index(self, entry):
+        self._by_type.setdefault(entry.type, OrderedDict())[entry.id] = None
+        self._sequence += 1
+        if entry.last_seen is not None:
+            key = self._time_keys[entry.id] = (
+                entry.last_seen, self._sequence, entry.id)
+            times = self._by_time
+            if not times or key > times[-1]:
+                times.append(key)
+            else:
+                times.insert(bisect_left(times, key), key)
+
+    def _unindex(self, entry):
+        ids = self._by_type[entry.type]
+        del ids[entry.id]
+        if not ids:
+            del self._by_type[entry.type]
+        key = self._time_keys.pop(entry.id, None)
+        if key is not None:
+            times = self._by_time
+            removed = self._removed_times
+            removed.add(key)
+            while times and times[0] in removed:
+                removed.remove(times.popleft())
+            if len(removed) > len(self._time_keys):
+                self._by_time = deque(
+                    key for key in times if key not in removed)
+                removed.clear()
+
+    def _evict(self):
+        entries = self._entries
+        max_bytes = self._max_bytes
+        while (len(entries) > self._capacity
+               or max_bytes and self._bytes > max_bytes and len(entries) > 1):
+            entry_id, entry = entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(entry_id)
+            self._unindex(entry)
+            entry._releaseDetails()
+            self._evicted += 1
+            if self._by_fingerprint.get(entry.fingerprint) == entry_id:
+                del self._by_fingerprint[entry.fingerprint]
+
+    def getEntries(self):
+        """Returns a list of the entries, most recent first."""
+        with self._lock:
+            return list(reversed(self._entries.values()))
+
+    def getEntryById(self, id):
+        """Returns the entry with the given id, or None."""
+        return self._entries.get(id)
+
+    def getEntryByFingerprint(self, fingerprint):
+        """Returns the most recent entry with the given fingerprint, or None.
+        """
+        return self._entries.get(self._by_fingerprint.get(fingerprint))
+
+    def query(self, offset=0, limit=None, type=None, since=None, until=None,
+              username=None, url=None, text=None):
+        """Returns the entries matching the criteria, most recent first.
+
+        Entries of a *type* or seen in a time range are found through the
+        indexes, so only they are looked at.
+        """
+        with self._lock:
+            entries = self._entries
+            if since is not None or until is not None:
+                times = self._by_time
+                removed = self._removed_times
+                start = 0 if since is None else bisect_left(times, (since,))
+                stop = len(times) if until is None else bisect_right(
+                    times, (until, float('inf')))
+                keys = sorted((key for key in islice(times, start, stop)
+                               if key not in removed),
+                              key=lambda key: key[1], reverse=True)
+                found = (entries[key[2]] for key in keys)
+                if type is not None:
+                    found = (entry for entry in found if entry.type == type)
+            elif type is not None:
+                found = map(entries.__getitem__,
+                            reversed(self._by_type.get(type, ())))
+            else:
+                found = reversed(entries.values())
+            if username is None and url is None and text is None:
+                stop = None if limit is None else offset + limit
+                return list(islice(found, offset, stop))
+            found = list(found)
+        # The tracebacks may be rendered while searching, so do not hold
+        # the lock.
+        return filterEntries(found, offset, limit, username=username,
+                             url=url, text=text)
+
+    def getStatistics(self):
+        """Returns the number of entries, their estimated size in bytes and
+        the number of entries evicted so far.
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'evicted': self._evicted,
+            }
+
+    def clear(self):
+        with self._lock:
+            for entry in self._entries.values():
+                entry._releaseDetails()
+            self._entries.clear()
+            self._sizes.clear()
+            self._bytes = 0
+            self._by_fingerprint.clear()
+            self._by_type.clear()
+            self._by_time.clear()
+            self._time_keys.clear()
+            self._removed_times.clear()
+
+    def close(self):
+        """Releases the resources held by the log."""
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __iter__(self):
+        """Iterates over a copy of the entries, oldest first."""
+        with self._lock:
+            entries = list(self._entries.values())
+        return iter(entries)
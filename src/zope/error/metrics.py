@@ -0,0 +1,184 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Metrics of the error reporting utility
+
+:class:`Metrics` counts the errors raised and ignored per type and times
+the phases of recording them.  :func:`renderPrometheus` renders the
+metrics returned by ``IErrorReportingUtility.getMetrics`` in the
+Prometheus text exposition format, to be served by whatever serves the
+other metrics of the application.
+"""
+__docformat__ = 'restructuredtext'
+
+from bisect import bisect_left
+from threading import Lock
+
+
+# The upper bounds of the histogram buckets in seconds, from 10
+# microseconds to a second.
+DEFAULT_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025,
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+INF = float('inf')
+
+
+class Histogram:
+    """Counts observed values in buckets with the given upper bounds.
+
+    Histograms are not thread-safe, :class:`Metrics` locks them.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is that of the values above all bounds.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        # Bounds are inclusive, as in Prometheus.
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def getStatistics(self):
+        """Returns the ``count`` and ``sum`` of the values and, as
+        ``buckets``, a list of ``(bound, count)`` tuples with the number
+        of values up to each bound, ending with infinity.
+        """
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (INF,), self.counts):
+            cumulative += count
+            buckets.append((bound, cumulative))
+        return {'buckets': buckets, 'count': cumulative, 'sum': self.sum}
+
+
+class Metrics:
+    """Thread-safe counters of errors per type and histograms of the time
+    spent in each phase of recording them.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = Lock()
+        self._raised = {}
+        self._ignored = {}
+        self._durations = {}
+
+    def countRaised(self, type):
+        with self._lock:
+            self._raised[type] = self._raised.get(type, 0) + 1
+
+    def countIgnored(self, type):
+        with self._lock:
+            self._ignored[type] = self._ignored.get(type, 0) + 1
+
+    def observe(self, durations):
+        """Adds *durations*, a sequence of ``(phase, seconds)`` tuples, to
+        the histograms of their phase.
+        """
+        with self._lock:
+            for phase, seconds in durations:
+                histogram = self._durations.get(phase)
+                if histogram is None:
+                    histogram = self._durations[phase] = Histogram(
+                        self.buckets)
+                histogram.observe(seconds)
+
+    def getStatistics(self):
+        """Returns the number of errors ``raised`` and ``ignored`` per type
+        and, as ``durations``, the statistics of the histogram of each
+        phase.
+        """
+        with self._lock:
+            return {
+                'raised': dict(self._raised),
+                'ignored': dict(self._ignored),
+                'durations': {phase: histogram.getStatistics()
+                              for phase, histogram
+                              in self._durations.items()},
+            }
+
+
+# The metrics rendered by renderPrometheus: the key in the result of
+# getMetrics, the name, the type unless it is a counter per type, and the
+# help text.
+_PER_TYPE = (
+    ('raised', 'raised_total', 'Errors passed to the utility.'),
+    ('ignored', 'ignored_total', 'Errors ignored as ignored_exceptions.'),
+)
+
+_VALUES = (
+    ('zlog_copies', 'zlog_copies_total', 'counter',
+     'Errors copied to the Event Log.'),
+    ('zlog_suppressed', 'zlog_suppressed_total', 'counter',
+     'Copies to the Event Log suppressed by the rate limit.'),
+    ('log_entries', 'log_entries', 'gauge', 'Entries in the log.'),
+    ('log_bytes', 'log_bytes', 'gauge',
+     'Estimated size of the entries in the log.'),
+    ('log_evicted', 'log_evicted_total', 'counter',
+     'Entries evicted from the log.'),
+    ('queued', 'queued', 'gauge',
+     'Errors queued for background recording.'),
+    ('dropped', 'dropped_total', 'counter',
+     'Errors dropped from the background recording queue.'),
+)
+
+
+def _escapeLabel(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _formatValue(value):
+    if value == INF:
+        return '+Inf'
+    return repr(value)
+
+
+def renderPrometheus(metrics, prefix='zope_error'):
+    """Returns *metrics*, as returned by ``getMetrics``, in the Prometheus
+    text exposition format.
+
+    Metric names start with *prefix*.
+    """
+    lines = []
+
+    def header(name, type, help):
+        lines.append('# HELP {}_{} {}'.format(prefix, name, help))
+        lines.append('# TYPE {}_{} {}'.format(prefix, name, type))
+
+    for key, name, help in _PER_TYPE:
+        header(name, 'counter', help)
+        for type, count in sorted(metrics[key].items()):
+            lines.append('{}_{}{{type="{}"}} {}'.format(
+                prefix, name, _escapeLabel(type), count))
+
+    name = 'duration_seconds'
+    header(name, 'histogram', 'Time spent recording errors, by phase.')
+    for phase, stats in sorted(metrics['durations'].items()):
+        phase = _escapeLabel(phase)
+        for bound, count in stats['buckets']:
+            lines.append('{}_{}_bucket{{phase="{}",le="{}"}} {}'.format(
+                prefix, name, phase, _formatValue(bound), count))
+        lines.append('{}_{}_sum{{phase="{}"}} {}'.format(
+            prefix, name, phase, _formatValue(stats['sum'])))
+        lines.append('{}_{}_count{{phase="{}"}} {}'.format(
+            prefix, name, phase, stats['count']))
+
+    for key, name, type, help in _VALUES:
+        header(name, type, help)
+        lines.append('{}_{} {}'.format(prefix, name, metrics[key]))
+    lines.append('')
+    return '\n'.join(lines)
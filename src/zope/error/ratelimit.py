@@ -0,0 +1,118 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Rate limiting of messages
+"""
+__docformat__ = 'restructuredtext'
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class RateLimiter:
+    """A thread-safe token bucket rate limiter with one bucket per key.
+
+    On average one message per *period* seconds is allowed for each key,
+    after an initial burst of *burst* messages.  Suppressed messages are
+    counted, so a summary can be reported when a message for that key is
+    allowed again.
+
+    Keys whose bucket has filled up again are forgotten, and at most
+    *max_keys* keys are tracked; beyond that the least recently used key
+    is dropped.
+    """
+
+    def __init__(self, period=60, burst=5, max_keys=1000):
+        self.period = period
+        self.burst = burst
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.suppressed = 0
+        self._lock = Lock()
+        # key -> [tokens, time of the last refill,
+        #         number of suppressed messages, time of the first one]
+        self._buckets = OrderedDict()
+
+    def allow(self, key, now=None):
+        """Checks whether a message for *key* is allowed at *now*.
+
+        Returns None if the message should be suppressed.  Otherwise
+        returns a ``(count, since)`` tuple with the number of messages
+        suppressed since the previous allowed one and the time the first
+        of those was suppressed (None if there were none).
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0, None]
+            else:
+                self._buckets.move_to_end(key)
+                self._refill(bucket, now)
+            if bucket[0] < 1:
+                if not bucket[2]:
+                    bucket[3] = now
+                bucket[2] += 1
+                self.suppressed += 1
+                return None
+            bucket[0] -= 1
+            result = (bucket[2], bucket[3])
+            bucket[2] = 0
+            bucket[3] = None
+            self.allowed += 1
+            self._prune(now)
+            return result
+
+    def _refill(self, bucket, now):
+        tokens, last = bucket[0], bucket[1]
+        if self.period > 0:
+            tokens += (now - last) / self.period
+        else:
+            tokens = self.burst
+        bucket[0] = min(self.burst, tokens)
+        bucket[1] = now
+
+    def _prune(self, now):
+        # Forget buckets that are full again, which is the same as not
+        # having one, starting with the least recently used.
+        buckets = self._buckets
+        while buckets:
+            key, bucket = next(iter(buckets.items()))
+            if len(buckets) <= self.max_keys:
+                if bucket[2]:
+                    break
+                self._refill(bucket, now)
+                if bucket[0] < self.burst:
+                    break
+            del buckets[key]
+
+    def getSuppressed(self):
+        """Returns the number of messages suppressed per key since the last
+        allowed message for that key.
+        """
+        with self._lock:
+            return {key: bucket[2] for key, bucket in self._buckets.items()
+                    if bucket[2]}
+
+    def getStatistics(self):
+        """Returns the total number of allowed and suppressed messages and
+        the number of tracked keys.
+        """
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'suppressed': self.suppressed,
+                'keys': len(self._buckets),
+            }
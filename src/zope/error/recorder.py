@@ -0,0 +1,156 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Background recording of errors
+
+A :class:`BackgroundRecorder` owns a bounded queue and a worker thread.
+The error reporting utility hands captured exceptions to it, and the
+worker does the expensive formatting and logging.
+"""
+__docformat__ = 'restructuredtext'
+
+import logging
+import threading
+import time
+from collections import deque
+
+
+logger = logging.getLogger('SiteError')
+
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+BLOCK = 'block'
+
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class BackgroundRecorder:
+    """Runs jobs on a worker thread, fed from a bounded queue.
+
+    The queue size and overflow policy are passed to :meth:`submit`, so
+    they can be changed at any time.  When the queue is full, the policy
+    decides what happens:
+
+    ``drop-oldest``
+        The oldest queued job is discarded.
+    ``drop-newest``
+        The submitted job is discarded.
+    ``block``
+        The caller waits up to *timeout* seconds for room in the queue and
+        discards the submitted job if none becomes available.
+    """
+
+    def __init__(self, name='zope.error recorder'):
+        self.name = name
+        self.processed = 0
+        self.dropped = 0
+        self._queue = deque()
+        self._pending = 0
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopping = False
+
+    def submit(self, job, maxsize, policy=DROP_OLDEST, timeout=None):
+        """Queues *job*, a callable without arguments.
+
+        Returns False if the job was dropped.
+        """
+        if policy not in OVERFLOW_POLICIES:
+            raise ValueError('Unknown overflow policy %r' % (policy,))
+        with self._condition:
+            if self._stopping:
+                self.dropped += 1
+                return False
+            if len(self._queue) >= maxsize:
+                if policy == DROP_NEWEST:
+                    self.dropped += 1
+                    return False
+                if policy == DROP_OLDEST:
+                    while len(self._queue) >= maxsize and self._queue:
+                        self._queue.popleft()
+                        self._pending -= 1
+                        self.dropped += 1
+                else:
+                    room = self._condition.wait_for(
+                        lambda: len(self._queue) < maxsize, timeout)
+                    if not room:
+                        self.dropped += 1
+                        return False
+            self._queue.append(job)
+            self._pending += 1
+            self._ensureWorker()
+            self._condition.notify_all()
+        return True
+
+    def _ensureWorker(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._queue or self._stopping)
+                if not self._queue:
+                    return
+                job = self._queue.popleft()
+                self._condition.notify_all()
+            try:
+                job()
+            except Exception:
+                logger.exception("Error in ErrorReportingUtility while"
+                                 " recording an error in the background")
+            finally:
+                job = None
+                with self._condition:
+                    self._pending -= 1
+                    self.processed += 1
+                    self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """Waits until all queued jobs have run.
+
+        Returns False if *timeout* seconds passed before that.
+        """
+        with self._condition:
+            return self._condition.wait_for(
+                lambda: not self._pending, timeout)
+
+    def shutdown(self, timeout=None):
+        """Runs the queued jobs and stops the worker thread.
+
+        Jobs submitted afterwards are dropped.  Returns False if the queue
+        could not be drained within *timeout* seconds.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        drained = self.flush(timeout)
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            if deadline is not None:
+                timeout = max(0, deadline - time.monotonic())
+            thread.join(timeout)
+        return drained
+
+    def getStatistics(self):
+        """Returns the number of queued, processed and dropped jobs."""
+        with self._condition:
+            return {
+                'queued': len(self._queue),
+                'processed': self.processed,
+                'dropped': self.dropped,
+            }
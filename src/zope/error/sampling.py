@@ -0,0 +1,68 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Sampling of frequent errors
+"""
+__docformat__ = 'restructuredtext'
+
+import time
+from threading import Lock
+
+
+class Sampler:
+    """Decides which occurrences of an error are recorded.
+
+    Within a window of *window* seconds, starting with the first occurrence
+    of a key, the first *first* occurrences are recorded and after that
+    only a fraction *rate* of them.  The fraction is applied
+    deterministically: with a rate of 0.25 every fourth occurrence is
+    recorded.
+
+    Every occurrence is counted, whether it is recorded or not.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        # key -> [window start, seen in window, credit, seen, recorded]
+        self._counters = {}
+
+    def sample(self, key, first, rate, window, now=None):
+        """Counts an occurrence of *key* and returns whether to record it.
+        """
+        if now is None:
+            now = time.time()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None:
+                counter = self._counters[key] = [now, 0, 0.0, 0, 0]
+            elif now - counter[0] >= window:
+                counter[0:3] = [now, 0, 0.0]
+            counter[1] += 1
+            counter[3] += 1
+            if counter[1] <= first:
+                record = True
+            else:
+                counter[2] += rate
+                record = counter[2] >= 1
+                if record:
+                    counter[2] -= 1
+            if record:
+                counter[4] += 1
+            return record
+
+    def getStatistics(self):
+        """Returns how many occurrences of each key were seen and recorded.
+        """
+        with self._lock:
+            return {key: {'seen': counter[3], 'recorded': counter[4]}
+                    for key, counter in self._counters.items()}
@@ -0,0 +1,368 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Error log shared between processes
+
+The entries are stored in an SQLite database in write-ahead logging mode,
+so all worker processes on a host can write to it and read from it
+concurrently.
+"""
+__docformat__ = 'restructuredtext'
+
+import json
+import logging
+import sqlite3
+import time
+from threading import Lock
+
+from zope.interface import implementer
+
+from zope.error.interfaces import IErrorLogStorage
+from zope.error.log import ErrorLogEntry
+from zope.error.log import filterEntries
+
+
+logger = logging.getLogger('SiteError')
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    log TEXT NOT NULL,
+    id TEXT NOT NULL,
+    fingerprint TEXT,
+    size INTEGER NOT NULL,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS entries_log ON entries (log);
+CREATE INDEX IF NOT EXISTS entries_id ON entries (log, id);
+CREATE INDEX IF NOT EXISTS entries_fingerprint ON entries (log, fingerprint);
+CREATE INDEX IF NOT EXISTS entries_type
+    ON entries (log, json_extract(data, '$.type'));
+CREATE INDEX IF NOT EXISTS entries_last_seen
+    ON entries (log, json_extract(data, '$.last_seen'));
+CREATE TABLE IF NOT EXISTS evictions (
+    log TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS totals (
+    log TEXT PRIMARY KEY,
+    entries INTEGER NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries
+BEGIN
+    INSERT INTO totals (log, entries, bytes) VALUES (new.log, 1, new.size)
+    ON CONFLICT (log) DO UPDATE
+        SET entries = entries + 1, bytes = bytes + excluded.bytes;
+END;
+CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries
+BEGIN
+    UPDATE totals SET entries = entries - 1, bytes = bytes - old.size
+        WHERE log = old.log;
+END;
+"""
+
+# How long, in seconds, processes opening the database wait for each
+# other to set it up.
+SETUP_TIMEOUT = 10.0
+
+
+def _logName(key):
+    if isinstance(key, bytes):
+        return key.hex()
+    return str(key)
+
+
+@implementer(IErrorLogStorage)
+class SharedLog:
+    """An error log stored in an SQLite database at *path*.
+
+    Several logs, told apart by *key*, can share a database, as can
+    several processes.  The log has the same bounds and API as
+    :class:`~zope.error.log.RingBufferLog`, though the size of the entries
+    is that of their stored form.  The bounds are applied whenever an
+    entry is added, so processes should use the same ones.
+
+    Writers wait at most *timeout* seconds for other writers to finish.
+    An entry that cannot be written within that time, or at all, is
+    dropped and the error is logged, so that logging an error never
+    blocks for long.  Lazily rendered tracebacks are rendered when the
+    entry is written.  Processes opening the log at the same time wait
+    up to :data:`SETUP_TIMEOUT` seconds for each other to set up the
+    database.
+    """
+
+    def __init__(self, path, key, capacity, max_bytes=0, timeout=0.1):
+        self.path = path
+        self.key = _logName(key)
+        self._capacity = max(0, capacity)
+        self._max_bytes = max(0, max_bytes)
+        self._lock = Lock()
+        self._connection = sqlite3.connect(
+            path, timeout=max(timeout, SETUP_TIMEOUT), isolation_level=None,
+            check_same_thread=False)
+        try:
+            self._setUp()
+        except BaseException:
+            self._connection.close()
+            raise
+        self._connection.execute(
+            'PRAGMA busy_timeout = %d' % (timeout * 1000))
+
+    def _setUp(self):
+        # SQLite does not wait for the lock needed to change the journal
+        # mode, so retry until the other processes are done.
+        deadline = time.monotonic() + SETUP_TIMEOUT
+        while True:
+            try:
+                return self._createSchema()
+            except sqlite3.OperationalError as error:
+                if ('locked' not in str(error)
+                        or time.monotonic() >= deadline):
+                    raise
+            time.sleep(0.01)
+
+    def _createSchema(self):
+        connection = self._connection
+        # Changing the journal mode locks the whole database, so it is
+        # only done once.
+        if connection.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+            connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        try:
+            connection.executescript('BEGIN IMMEDIATE;' + _SCHEMA)
+            # Count the entries of databases written before the totals
+            # were kept.
+            self._countTotals(connection)
+            self._evict(connection)
+            connection.execute('COMMIT')
+        except BaseException:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            raise
+
+    def _countTotals(self, connection):
+        connection.execute(
+            'INSERT OR IGNORE INTO totals (log, entries, bytes)'
+            ' SELECT log, COUNT(*), TOTAL(size) FROM entries WHERE log = ?'
+            ' GROUP BY log', (self.key,))
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes
+
+    def _query(self, sql, *args):
+        with self._lock:
+            return self._connection.execute(sql, (self.key,) + args).fetchall()
+
+    def _write(self, change, *args):
+        """Runs *change* in a transaction and returns its result."""
+        with self._lock:
+            connection = self._connection
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+                try:
+                    result = change(connection, *args)
+                    self._evict(connection)
+                except BaseException:
+                    connection.execute('ROLLBACK')
+                    raise
+                connection.execute('COMMIT')
+            except sqlite3.Error:
+                logger.exception("Error in ErrorReportingUtility while"
+                                 " writing to the shared log in %s",
+                                 self.path)
+                return None
+            return result
+
+    def _insert(self, connection, entry):
+        data = json.dumps(entry.copy(), separators=(',', ':'))
+        connection.execute('DELETE FROM entries WHERE log = ? AND id = ?',
+                           (self.key, entry.id))
+        connection.execute(
+            'INSERT INTO entries (log, id, fingerprint, size, data)'
+            ' VALUES (?, ?, ?, ?, ?)',
+            (self.key, entry.id, entry.fingerprint, len(data), data))
+        return entry
+
+    def _evict(self, connection):
+        # The triggers keep the number and size of the entries of each log,
+        # so only the evicted entries are read.
+        row = connection.execute(
+            'SELECT entries, bytes FROM totals WHERE log = ?',
+            (self.key,)).fetchone()
+        if row is None:
+            return
+        entries, size = row
+        excess = entries - self._capacity
+        max_bytes = self._max_bytes
+        if max_bytes and size > max_bytes and excess < entries - 1:
+            # Find how many of the oldest entries must go, keeping the
+            # most recent one.
+            rows = connection.execute(
+                'SELECT size FROM entries WHERE log = ? ORDER BY seq',
+                (self.key,))
+            count = 0
+            for entry_size, in rows:
+                if size <= max_bytes or count >= entries - 1:
+                    break
+                size -= entry_size
+                count += 1
+            rows.close()
+            excess = max(excess, count)
+        if excess <= 0:
+            return
+        evicted = connection.execute(
+            'DELETE FROM entries WHERE seq IN (SELECT seq FROM entries'
+            ' WHERE log = ? ORDER BY seq LIMIT ?)',
+            (self.key, excess)).rowcount
+        connection.execute(
+            'INSERT INTO evictions (log, count) VALUES (?, ?)'
+            ' ON CONFLICT (log) DO UPDATE SET count = count + excluded.count',
+            (self.key, evicted))
+
+    def append(self, entry, capacity=None, max_bytes=None):
+        """Adds *entry*, first changing the bounds if given.
+
+        An entry with the id of a logged one replaces it.
+        """
+        self._setBounds(capacity, max_bytes)
+        try:
+            self._write(self._insert, entry)
+        finally:
+            # Only the stored copy of the entry is kept.
+            entry._releaseDetails()
+
+    def addOccurrence(self, fingerprint, now, sample, max_samples):
+        """Counts another occurrence of the error with *fingerprint*.
+
+        The aggregated entry becomes the most recent one and is returned.
+        Returns None if the log has no entry with that fingerprint.
+        """
+        def change(connection):
+            row = connection.execute(
+                'SELECT data FROM entries WHERE log = ? AND fingerprint = ?'
+                ' ORDER BY seq DESC LIMIT 1',
+                (self.key, fingerprint)).fetchone()
+            if row is None:
+                return None
+            entry = ErrorLogEntry.fromMapping(json.loads(row[0]))
+            entry = entry.withOccurrence(now, sample, max_samples)
+            return self._insert(connection, entry)
+        return self._write(change)
+
+    def resize(self, capacity, max_bytes=None):
+        """Changes the bounds, keeping the most recent entries."""
+        self._setBounds(capacity, max_bytes)
+        self._write(lambda connection: None)
+
+    def _setBounds(self, capacity, max_bytes):
+        if capacity is not None:
+            self._capacity = max(0, capacity)
+        if max_bytes is not None:
+            self._max_bytes = max(0, max_bytes)
+
+    def _load(self, rows):
+        return [ErrorLogEntry.fromMapping(json.loads(data))
+                for data, in rows]
+
+    def getEntries(self):
+        """Returns a list of the entries, most recent first."""
+        return self._load(self._query(
+            'SELECT data FROM entries WHERE log = ? ORDER BY seq DESC'))
+
+    def getEntryById(self, id):
+        """Returns the entry with the given id, or None."""
+        entries = self._load(self._query(
+            'SELECT data FROM entries WHERE log = ? AND id = ?', id))
+        return entries[0] if entries else None
+
+    def getEntryByFingerprint(self, fingerprint):
+        """Returns the most recent entry with the given fingerprint, or None.
+        """
+        entries = self._load(self._query(
+            'SELECT data FROM entries WHERE log = ? AND fingerprint = ?'
+            ' ORDER BY seq DESC LIMIT 1', fingerprint))
+        return entries[0] if entries else None
+
+    def query(self, offset=0, limit=None, type=None, since=None, until=None,
+              username=None, url=None, text=None):
+        """Returns the entries matching the criteria, most recent first.
+
+        The entries are selected by the database, using its indexes for
+        *type* and the time range.  Only the full-text search is done
+        after loading them.
+        """
+        sql = ['SELECT data FROM entries WHERE log = ?']
+        args = []
+        if type is not None:
+            sql.append("AND json_extract(data, '$.type') = ?")
+            args.append(type)
+        if since is not None:
+            sql.append("AND json_extract(data, '$.last_seen') >= ?")
+            args.append(since)
+        if until is not None:
+            sql.append("AND json_extract(data, '$.last_seen') <= ?")
+            args.append(until)
+        if username is not None:
+            sql.append("AND instr(json_extract(data, '$.username'), ?) > 0")
+            args.append(username)
+        if url is not None:
+            sql.append("AND instr(json_extract(data, '$.url'), ?) > 0")
+            args.append(url)
+        sql.append('ORDER BY seq DESC')
+        if text is not None:
+            # SQLite only folds the case of ASCII letters, so search the
+            # loaded entries.
+            return filterEntries(
+                self._load(self._query(' '.join(sql), *args)),
+                offset, limit, text=text)
+        if limit is not None or offset:
+            sql.append('LIMIT ? OFFSET ?')
+            args.extend((-1 if limit is None else limit, offset))
+        return self._load(self._query(' '.join(sql), *args))
+
+    def getStatistics(self):
+        """Returns the number of entries, the size of their stored form in
+        bytes and the number of entries evicted so far by all processes.
+        """
+        totals = self._query(
+            'SELECT entries, bytes FROM totals WHERE log = ?')
+        entries, size = totals[0] if totals else (0, 0)
+        evicted = self._query('SELECT count FROM evictions WHERE log = ?')
+        return {
+            'entries': entries,
+            'bytes': int(size),
+            'evicted': evicted[0][0] if evicted else 0,
+        }
+
+    def clear(self):
+        self._write(lambda connection: connection.execute(
+            'DELETE FROM entries WHERE log = ?', (self.key,)))
+
+    def close(self):
+        """Closes the connection to the database."""
+        with self._lock:
+            self._connection.close()
+
+    def __len__(self):
+        return self.getStatistics()['entries']
+
+    def __iter__(self):
+        """Iterates over the entries, oldest first."""
+        return iter(self._load(self._query(
+            'SELECT data FROM entries WHERE log = ? ORDER BY seq')))
@@ -0,0 +1,112 @@
+##############################################################################
+#
+# Copyright (c) 2026 Zope Foundation and Contributors.
+# All Rights Reserved.
+#
+# This software is subject to the provisions of the Zope Public License,
+# Version 2.1 (ZPL).  A copy of the ZPL should accompany this distribution.
+# THIS SOFTWARE IS PROVIDED "AS IS" AND ANY AND ALL EXPRESS OR IMPLIED
+# WARRANTIES ARE DISCLAIMED, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF TITLE, MERCHANTABILITY, AGAINST INFRINGEMENT, AND FITNESS
+# FOR A PARTICULAR PURPOSE.
+#
+##############################################################################
+"""Cheap traceback snapshots for deferred formatting
+
+A snapshot records just enough of a traceback for
+:mod:`zope.exceptions.exceptionformatter` to render it later, without
+keeping the frames (and everything they reference) alive.
+
+Traceback supplements and ``__traceback_info__`` are formatted when the
+snapshot is taken: they may read objects that are gone or have changed
+by the time the snapshot is rendered.
+"""
+__docformat__ = 'restructuredtext'
+
+from zope.exceptions.exceptionformatter import TextExceptionFormatter
+
+from zope.error.formatter import _Escaper
+from zope.error.formatter import format_exception_dual
+from zope.error.formatter import formatFrameExtras
+
+
+# The names the formatter looks up in the frame globals to find the
+# source.
+_GLOBAL_NAMES = ('__name__', '__loader__', '__spec__')
+
+
+class _CodeSnapshot:
+
+    __slots__ = ('co_filename', 'co_name')
+
+    def __init__(self, code):
+        self.co_filename = code.co_filename
+        self.co_name = code.co_name
+
+
+class _FrameSnapshot:
+
+    __slots__ = ('f_code', 'f_lineno', 'f_locals', 'f_globals')
+
+    def __init__(self, frame, lineno):
+        self.f_code = _CodeSnapshot(frame.f_code)
+        self.f_lineno = lineno
+        self.f_locals = {}
+        self.f_globals = _pick(frame.f_globals, _GLOBAL_NAMES)
+
+
+class _TracebackSnapshot:
+
+    __slots__ = ('tb_frame', 'tb_lineno', 'tb_next', 'tb_extras')
+
+    def __init__(self, tb, escape):
+        self.tb_lineno = tb.tb_lineno
+        self.tb_frame = _FrameSnapshot(tb.tb_frame, tb.tb_lineno)
+        self.tb_next = None
+        # The lines of the supplement and traceback info, if any.
+        text, html = formatFrameExtras(tb, escape)
+        self.tb_extras = (tuple(text), tuple(html)) if text else ((), ())
+
+
+def _pick(namespace, names):
+    return {name: namespace[name] for name in names if name in namespace}
+
+
+def _snapshotTraceback(tb):
+    head = tail = None
+    escape = _Escaper()
+    while tb is not None:
+        node = _TracebackSnapshot(tb, escape)
+        if tail is None:
+            head = node
+        else:
+            tail.tb_next = node
+        tail = node
+        tb = tb.tb_next
+    return head
+
+
+class TracebackSnapshot:
+    """A frame-free copy of exception info that can be formatted later.
+
+    The exception line is rendered eagerly, because the exception object
+    holds on to the traceback; everything else is rendered by
+    :meth:`format`.
+    """
+
+    __slots__ = ('type', 'exc_only', 'tb')
+
+    def __init__(self, info):
+        t, v, tb = info
+        self.type = t
+        self.exc_only = TextExceptionFormatter().formatExceptionOnly(t, v)
+        self.tb = _snapshotTraceback(tb)
+
+    def format(self, as_html=False, limit=None):
+        """Returns the formatted lines, like ``format_exception`` does."""
+        return self.formatDual(limit)[bool(as_html)]
+
+    def formatDual(self, limit=None):
+        """Returns the formatted lines as text and as HTML."""
+        return format_exception_dual(
+            self.type, None, self.tb, limit, self.exc_only)
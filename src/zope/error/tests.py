@@ -13,8 +13,17 @@
 ##############################################################################
 """Error Reporting Utility Tests
 """
+import json
 import logging
+import os
+import shutil
+import socket
+import sqlite3
 import sys
+import tempfile
+import threading
+import time
+import traceback
 import unittest
 from io import StringIO
 
@@ -25,6 +34,12 @@ from zope.error.error import ErrorReportingUtility
 from zope.error.error import getFormattedException
 
 
+try:
+    from zope.component import getGlobalSiteManager
+except ModuleNotFoundError:  # pragma: no cover
+    getGlobalSiteManager = None
+
+
 class Error(Exception):
 
     def __init__(self, value):
@@ -42,6 +57,74 @@ def getAnErrorInfo(value=""):
         return sys.exc_info()
 
 
+def runInThreads(func, count):
+    """Calls *func* with the thread number in *count* threads at once."""
+    barrier = threading.Barrier(count)
+
+    def run(number):
+        barrier.wait()
+        func(number)
+
+    threads = [threading.Thread(target=run, args=(number,))
+               for number in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def formatStdlibException(exc_info):
+    """Returns *exc_info* as the logging module formats it, also when
+    zope.testrunner replaced ``traceback.format_exception``.
+    """
+    lines = traceback.TracebackException(*exc_info).format()
+    return ''.join(lines).rstrip('\n')
+
+
+def waitFor(condition, timeout=5):
+    """Waits up to *timeout* seconds for *condition* to return true."""
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.001)
+    return condition()
+
+
+class Supplement:
+
+    def __init__(self, expression):
+        self.expression = expression
+        self.line = -1
+
+    def getInfo(self):
+        return 'supplement <info>'
+
+
+def raiseAnAnnotatedError(value):
+    __traceback_info__ = 'info <%s>' % value  # noqa: F841
+    __traceback_supplement__ = (Supplement, 'a < b')  # noqa: F841
+    raise Error(value)
+
+
+def recurse(depth):
+    if depth:
+        recurse(depth - 1)
+    raise Error('bottom')
+
+
+def getADeepErrorInfo(depth):
+    try:
+        recurse(depth)
+    except Error:
+        return sys.exc_info()
+
+
+def getAnAnnotatedErrorInfo(value=""):
+    try:
+        raiseAnAnnotatedError(value)
+    except Error:
+        return sys.exc_info()
+
+
 class TestRequest:
     """Mock request that mimics the zope.publisher request."""
 
@@ -99,13 +182,40 @@ class ErrorReportingUtilityTests(cleanup.CleanUp, unittest.TestCase):
         errUtility = self.makeOne()
         setProp = {
             'keep_entries': 10,
+            'max_bytes': 0,
             'copy_to_zlog': 1,
-            'ignored_exceptions': ()
+            'ignored_exceptions': (),
+            'lazy_formatting': False,
+            'async_recording': False,
+            'queue_size': 100,
+            'overflow_policy': 'drop-newest',
+            'block_timeout': 0.5,
+            'aggregate_duplicates': False,
+            'zlog_rate_period': 30.0,
+            'zlog_rate_burst': 3,
+            'zlog_rate_key': 'fingerprint',
+            'sample_first': 5,
+            'sample_rate': 0.5,
+            'sample_window': 10.0,
+            'max_value_size': 100,
+            'max_request_size': 1000,
+            'max_traceback_size': 5000,
+            'max_frames': 50,
+            'storage': '',
+            'compress_details': True,
+            'compression_dictionary': True,
+            'intern_frames': True,
         }
         errUtility.setProperties(**setProp)
         getProp = errUtility.getProperties()
         self.assertEqual(setProp, getProp)
 
+    def test_setProperties_keeps_optional_properties(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, lazy_formatting=True)
+        errUtility.setProperties(5)
+        self.assertTrue(errUtility.getProperties()['lazy_formatting'])
+
     def test_ErrorLog(self):
         # Test for Logging Error.  Create one error and check whether its
         # logged or not.
@@ -196,6 +306,24 @@ class ErrorReportingUtilityTests(cleanup.CleanUp, unittest.TestCase):
         errUtility = self.makeOne()
         self.assertIsNone(errUtility.getLogEntryById('no such id'))
 
+    def test_getLogEntryById_evicted(self):
+        errUtility = self.makeOne()
+        errUtility.keep_entries = 1
+        errUtility.raising(getAnErrorInfo("Error 1"))
+        err_id = errUtility.getLogEntries()[0]['id']
+        errUtility.raising(getAnErrorInfo("Error 2"))
+        self.assertIsNone(errUtility.getLogEntryById(err_id))
+
+    def test_entry_ids_are_unique_and_increasing(self):
+        errUtility = self.makeOne()
+        exc_info = getAnErrorInfo("Error")
+        for _i in range(3):
+            errUtility.raising(exc_info)
+        ids = [entry['id'] for entry in errUtility.getLogEntries()]
+        sequence = [int(i.rsplit('.', 1)[1]) for i in ids]
+        self.assertEqual(sorted(sequence, reverse=True), sequence)
+        self.assertEqual(3, len(set(sequence)))
+
     def test_getLogin_error(self):
         class PrincipalStub:
             id = 'id'
@@ -312,6 +440,960 @@ class ErrorReportingUtilityTests(cleanup.CleanUp, unittest.TestCase):
 
         self.assertEqual('Error 2', getErrLog[0]['value'])
 
+    def test_setProperties_resizes_log(self):
+        errUtility = self.makeOne()
+        for i in range(5):
+            errUtility.raising(getAnErrorInfo("Error %d" % i))
+        errUtility.setProperties(2)
+        self.assertEqual(['Error 4', 'Error 3'],
+                         [e['value'] for e in errUtility.getLogEntries()])
+        errUtility.setProperties(10)
+        errUtility.raising(getAnErrorInfo("Error 5"))
+        self.assertEqual(['Error 5', 'Error 4', 'Error 3'],
+                         [e['value'] for e in errUtility.getLogEntries()])
+
+    def test_lazy_formatting(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, lazy_formatting=True)
+        exc_info = getAnAnnotatedErrorInfo("Error")
+        errUtility.raising(exc_info)
+
+        entry = errUtility.getLogEntries()[0]
+        self.assertIsNotNone(entry._render)
+        self.assertIsNone(entry._details.tb_text)
+
+        self.assertEqual(getFormattedException(exc_info), entry['tb_text'])
+        self.assertIsNone(entry._render)
+        self.assertEqual(getFormattedException(exc_info, True),
+                         entry['tb_html'])
+        self.assertIn('__traceback_info__: info &lt;Error&gt;',
+                      entry['tb_text'])
+        self.assertIn('Expression: a &lt; b', entry['tb_text'])
+        self.assertIs(entry, errUtility.getLogEntryById(entry['id']))
+
+    def test_setProperties_validates_queue(self):
+        errUtility = self.makeOne()
+        self.assertRaises(ValueError, errUtility.setProperties, 10,
+                          queue_size=0)
+        self.assertRaises(ValueError, errUtility.setProperties, 10,
+                          overflow_policy='drop-everything')
+
+    def test_async_recording(self):
+        request = TestRequest(environ={'PATH_INFO': '/foobar'})
+        request.URL = URLGetter(request)
+        request.items().append(('key', 'value'))
+
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, async_recording=True)
+        exc_info = getAnErrorInfo("Error")
+        errUtility.raising(exc_info, request=request)
+        request.items()[:] = []
+        self.assertTrue(errUtility.flush(5))
+
+        getErrLog = errUtility.getLogEntries()
+        self.assertEqual(1, len(getErrLog))
+        self.assertEqual('/foobar', getErrLog[0]['url'])
+        self.assertEqual('key: value<br />\n', getErrLog[0]['req_html'])
+        self.assertEqual(getFormattedException(exc_info),
+                         getErrLog[0]['tb_text'])
+        self.assertEqual({'queued': 0, 'processed': 1, 'dropped': 0},
+                         errUtility.getQueueStatistics())
+
+        self.assertTrue(errUtility.shutdown(5))
+        self.assertTrue(errUtility.flush())
+        self.assertTrue(errUtility.shutdown())
+        self.assertEqual({'queued': 0, 'processed': 0, 'dropped': 0},
+                         errUtility.getQueueStatistics())
+
+    def test_async_recording_without_request(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, async_recording=True)
+        errUtility.raising(getAnErrorInfo("Error"))
+        self.assertTrue(errUtility.flush(5))
+        self.assertIsNone(errUtility.getLogEntries()[0]['req_html'])
+
+    def test_async_recording_does_not_use_utility(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, async_recording=True, max_value_size=5)
+        release = threading.Event()
+        errUtility._getRecorder().submit(release.wait, 10)
+        errUtility.raising(getAnErrorInfo("Error 1"))
+
+        # The worker reads the settings current when the error was raised,
+        # and never the utility itself, which may be persistent.
+        threads = set()
+        cls = type(errUtility)
+
+        def getattribute(self, name):
+            threads.add(threading.current_thread())
+            return super(cls, self).__getattribute__(name)
+
+        errUtility.setProperties(20, async_recording=True)
+        cls.__getattribute__ = getattribute
+        try:
+            release.set()
+            self.assertTrue(errUtility.flush(5))
+        finally:
+            del cls.__getattribute__
+        self.assertEqual({threading.current_thread()}, threads)
+        self.assertEqual(['Error... [2 characters truncated]'],
+                         [e['value'] for e in errUtility.getLogEntries()])
+
+    def test_aggregate_duplicates(self):
+        request = TestRequest(environ={'PATH_INFO': '/foobar'})
+        request.URL = URLGetter(request)
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, aggregate_duplicates=True)
+        for i in range(8):
+            exc_info = getAnErrorInfo("Error %d" % i)
+            errUtility.raising(exc_info, request=request)
+        errUtility.raising(getAnAnnotatedErrorInfo("Other"))
+
+        entries = errUtility.getLogEntries()
+        self.assertEqual(2, len(entries))
+        self.assertEqual(1, entries[0]['count'])
+        entry = entries[1]
+        self.assertEqual(8, entry['count'])
+        self.assertEqual('Error 0', entry['value'])
+        self.assertLessEqual(entry['first_seen'], entry['last_seen'])
+        self.assertEqual(5, len(entry['samples']))
+        self.assertEqual('/foobar', entry['samples'][-1][1])
+        self.assertIs(entry, errUtility.getLogEntryById(entry['id']))
+
+        # A new occurrence makes the entry the most recent one.
+        errUtility.raising(getAnErrorInfo("Error 8"))
+        entries = errUtility.getLogEntries()
+        self.assertEqual(9, entries[0]['count'])
+        self.assertEqual((None, None), entries[0]['samples'][-1][1:])
+
+    def test_no_aggregation_by_default(self):
+        errUtility = self.makeOne()
+        for _i in range(2):
+            errUtility.raising(getAnErrorInfo("Error"))
+        entries = errUtility.getLogEntries()
+        self.assertEqual(2, len(entries))
+        self.assertEqual(entries[0]['fingerprint'], entries[1]['fingerprint'])
+        self.assertEqual((), entries[0]['samples'])
+
+    def test_concurrent_raising(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(1000, copy_to_zlog=False)
+
+        def raiseErrors(number):
+            for i in range(25):
+                errUtility.raising(getAnErrorInfo("%d.%d" % (number, i)))
+
+        runInThreads(raiseErrors, 32)
+        entries = errUtility.getLogEntries()
+        self.assertEqual(800, len(entries))
+        self.assertEqual(800, len({entry['id'] for entry in entries}))
+        self.assertEqual(
+            {'%d.%d' % (n, i) for n in range(32) for i in range(25)},
+            {entry['value'] for entry in entries})
+
+    def test_concurrent_raising_respects_keep_entries(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(50, copy_to_zlog=False)
+
+        def raiseErrors(number):
+            for i in range(25):
+                errUtility.raising(getAnErrorInfo("%d.%d" % (number, i)))
+
+        runInThreads(raiseErrors, 32)
+        entries = errUtility.getLogEntries()
+        self.assertEqual(50, len(entries))
+        self.assertEqual(50, len({entry['id'] for entry in entries}))
+        stats = errUtility.getLogStatistics()
+        self.assertEqual(50, stats['entries'])
+        self.assertEqual(750, stats['evicted'])
+
+    def test_concurrent_aggregation(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, copy_to_zlog=False,
+                                 aggregate_duplicates=True)
+
+        def raiseErrors(number):
+            for _i in range(25):
+                errUtility.raising(getAnErrorInfo("Error"))
+
+        runInThreads(raiseErrors, 32)
+        entries = errUtility.getLogEntries()
+        self.assertEqual(1, len(entries))
+        self.assertEqual(800, entries[0]['count'])
+
+    def test_aggregation_of_distinct_errors_in_parallel(self):
+        from zope.error.error import _aggregate_locks
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, copy_to_zlog=False,
+                                 aggregate_duplicates=True)
+        formatting = threading.Event()
+        gate = threading.Event()
+
+        class BlockingSupplement:
+            def getInfo(self):
+                formatting.set()
+                gate.wait(5)
+
+        def raiseBlocked():
+            __traceback_supplement__ = (BlockingSupplement,)  # noqa: F841
+            try:
+                raise Error('blocked')
+            except Error:
+                errUtility.raising(sys.exc_info())
+
+        thread = threading.Thread(target=raiseBlocked)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(gate.set)
+        self.assertTrue(formatting.wait(5))
+        # Another error is recorded while the first one is formatted.
+        errUtility.raising(getAnErrorInfo("other"))
+        self.assertEqual(['other'],
+                         [e['value'] for e in errUtility.getLogEntries()])
+        gate.set()
+        thread.join()
+        self.assertEqual(2, len(errUtility.getLogEntries()))
+        self.assertEqual(0, len(_aggregate_locks[errUtility._getLogKey()]))
+
+    def test_log_created_once(self):
+        errUtility = self.makeOne()
+        created = []
+        createLog = errUtility._createLog
+
+        def slowCreateLog(key):
+            time.sleep(0.01)
+            created.append(key)
+            return createLog(key)
+
+        errUtility._createLog = slowCreateLog
+        logs = []
+        runInThreads(lambda number: logs.append(errUtility._getLog()), 16)
+        self.assertEqual(1, len(created))
+        self.assertEqual(1, len({id(log) for log in logs}))
+
+    def test_copy_to_zlog_rate_limited_by_type(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, zlog_rate_period=60, zlog_rate_burst=2)
+        with self.assertLogs('SiteError') as cm:
+            for _i in range(4):
+                errUtility.raising(getAnErrorInfo("Error"))
+            errUtility.raising(getAnAnnotatedErrorInfo("Error"))
+        self.assertEqual(2, len(cm.records))
+        stats = errUtility.getRateLimitStatistics()
+        self.assertEqual(2, stats['allowed'])
+        self.assertEqual(3, stats['suppressed'])
+        self.assertEqual({'Error': 3}, stats['pending'])
+
+    def test_copy_to_zlog_rate_limited_by_fingerprint(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, zlog_rate_burst=1,
+                                 zlog_rate_key='fingerprint')
+        with self.assertLogs('SiteError') as cm:
+            for _i in range(3):
+                errUtility.raising(getAnErrorInfo("Error"))
+            errUtility.raising(getAnAnnotatedErrorInfo("Error"))
+        self.assertEqual(2, len(cm.records))
+        self.assertEqual(2, errUtility.getRateLimitStatistics()['suppressed'])
+
+    def test_copy_to_zlog_reports_suppressed(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, zlog_rate_period=1, zlog_rate_burst=1)
+        exc_info = getAnErrorInfo("Error")
+        with self.assertLogs('SiteError') as cm:
+            for now in (100.0, 100.2, 100.4, 101.5):
+                errUtility._do_copy_to_zlog(now, 'Error', '/url', exc_info)
+        self.assertEqual(
+            ['ERROR', 'WARNING', 'ERROR'],
+            [record.levelname for record in cm.records])
+        self.assertEqual('Suppressed 2 Error in last 1s',
+                         cm.records[1].getMessage())
+
+    def test_copy_to_zlog_reuses_tb_text(self):
+        errUtility = self.makeOne()
+        exc_info = getAnAnnotatedErrorInfo("Error")
+        with self.assertLogs('SiteError') as cm:
+            errUtility.raising(exc_info)
+        record = cm.records[0]
+        self.assertEqual('None', record.getMessage())
+        self.assertIs(Error, record.exc_info[0])
+        # The traceback is formatted as the logging module formats it.
+        self.assertEqual(formatStdlibException(exc_info), record.exc_text)
+        self.assertEqual('_do_copy_to_zlog', record.funcName)
+
+        formatter = logging.Formatter()
+        formatter.formatException = None  # Must not be called.
+        self.assertEqual('None\n' + record.exc_text,
+                         formatter.format(record))
+
+    def test_copy_to_zlog_not_escaped_or_truncated(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, max_frames=2, max_traceback_size=100)
+        exc_info = getADeepErrorInfo(10)
+        exc_info = (exc_info[0], Error('<&>'), exc_info[2])
+        with self.assertLogs('SiteError') as cm:
+            errUtility.raising(exc_info)
+        self.assertEqual(formatStdlibException(exc_info),
+                         cm.records[0].exc_text)
+        self.assertTrue(
+            cm.records[0].exc_text.endswith('zope.error.tests.Error: <&>'))
+        self.assertIn('&lt;&amp;&gt;',
+                      errUtility.getLogEntries()[0]['tb_text'])
+
+    def test_copy_to_zlog_formatted_only_when_copied(self):
+        import zope.error.error
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, zlog_rate_burst=1)
+        formatted = []
+        format_exception_dual = zope.error.error.format_exception_dual
+
+        def recordPlain(*args, **kw):
+            formatted.append(kw['plain'] is not None)
+            return format_exception_dual(*args, **kw)
+
+        zope.error.error.format_exception_dual = recordPlain
+        try:
+            with self.assertLogs('SiteError') as cm:
+                for _i in range(3):
+                    errUtility.raising(getAnErrorInfo("Error"))
+        finally:
+            zope.error.error.format_exception_dual = format_exception_dual
+        self.assertEqual(1, len(cm.records))
+        # The suppressed copies were not formatted for the Event Log.
+        self.assertEqual([True, False, False], formatted)
+        self.assertEqual(3, len(errUtility.getLogEntries()))
+
+    def test_copy_to_zlog_lazy_formatting(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, lazy_formatting=True)
+        with self.assertLogs('SiteError') as cm:
+            errUtility.raising(getAnErrorInfo("Error"))
+        # The logging module formats the traceback itself.
+        self.assertIn('File ', cm.output[0])
+        self.assertIsNone(
+            errUtility._getLog().getEntries()[0]._details.tb_text)
+
+    def test_copy_to_zlog_disabled_logger(self):
+        errUtility = self.makeOne()
+        logger = logging.getLogger('SiteError')
+        logger.disabled = True
+        try:
+            errUtility.raising(getAnErrorInfo("Error"))
+        finally:
+            logger.disabled = False
+        self.assertEqual('', self.log_buffer.getvalue())
+
+    def test_copy_to_zlog_preformatted(self):
+        errUtility = self.makeOne()
+        with self.assertLogs('SiteError') as cm:
+            errUtility.raising((Error, Error('Error'), b'a string tb'))
+        self.assertEqual('None\na string tb', cm.records[0].getMessage())
+        self.assertIsNone(cm.records[0].exc_info)
+
+    def test_setProperties_validates_rate_limit_key(self):
+        errUtility = self.makeOne()
+        self.assertRaises(ValueError, errUtility.setProperties, 10,
+                          zlog_rate_key='value')
+        self.assertRaises(ValueError, errUtility.setProperties, 10,
+                          zlog_rate_burst=0)
+
+    def test_getRateLimitStatistics_empty(self):
+        self.assertEqual(
+            {'allowed': 0, 'suppressed': 0, 'keys': 0, 'pending': {}},
+            self.makeOne().getRateLimitStatistics())
+
+    def test_sampling(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, sample_first=2, sample_rate=0.25)
+        for i in range(10):
+            errUtility.raising(getAnErrorInfo("Error %d" % i))
+        errUtility.raising((KeyError, KeyError('key'), None))
+        self.assertEqual(
+            ['KeyError', 'Error 9', 'Error 5', 'Error 1', 'Error 0'],
+            [entry['value'] if entry['type'] == 'Error' else entry['type']
+             for entry in errUtility.getLogEntries()])
+        self.assertEqual({
+            'Error': {'seen': 10, 'recorded': 4},
+            'KeyError': {'seen': 1, 'recorded': 1},
+        }, errUtility.getSamplingStatistics())
+
+    def test_no_sampling_by_default(self):
+        errUtility = self.makeOne()
+        for _i in range(15):
+            errUtility.raising(getAnErrorInfo("Error"))
+        self.assertEqual(15, len(errUtility.getLogEntries()))
+        self.assertEqual({}, errUtility.getSamplingStatistics())
+
+    def test_setProperties_validates_sampling(self):
+        errUtility = self.makeOne()
+        self.assertRaises(ValueError, errUtility.setProperties, 10,
+                          sample_rate=1.5)
+        errUtility.setProperties(10, sample_first=-1)
+        self.assertEqual(0, errUtility.sample_first)
+
+    def test_max_bytes(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_bytes=5000)
+        for i in range(20):
+            errUtility.raising(getAnErrorInfo("Error %d" % i))
+        stats = errUtility.getLogStatistics()
+        self.assertLess(stats['entries'], 20)
+        self.assertLessEqual(stats['bytes'], 5000)
+        self.assertEqual(20 - stats['entries'], stats['evicted'])
+        self.assertEqual(20, stats['keep_entries'])
+        self.assertEqual(5000, stats['max_bytes'])
+        self.assertEqual('Error 19', errUtility.getLogEntries()[0]['value'])
+
+        errUtility.setProperties(20, max_bytes=1)
+        self.assertEqual(1, errUtility.getLogStatistics()['entries'])
+
+    def test_max_bytes_lazy_formatting(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_bytes=5000, lazy_formatting=True)
+        for i in range(20):
+            errUtility.raising(getAnErrorInfo("Error %d" % i))
+        for entry in errUtility.getLogEntries():
+            entry.getDetails()
+        stats = errUtility.getLogStatistics()
+        self.assertLessEqual(stats['bytes'], 5000)
+        self.assertEqual(
+            sum(entry.getSize() for entry in errUtility.getLogEntries()),
+            stats['bytes'])
+
+    def test_journal(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        errUtility = self.makeOne()
+        errUtility.setProperties(2)
+        errUtility.setJournal(directory, max_segments=4, fsync_interval=0)
+        for i in range(3):
+            errUtility.raising(getAnErrorInfo("Error %d" % i))
+        self.assertEqual(2, len(errUtility.getLogEntries()))
+        self.assertEqual(3, errUtility.getLogStatistics()['journal_records'])
+        history = errUtility.getLogHistory()
+        self.assertEqual(['Error 2', 'Error 1', 'Error 0'],
+                         [entry['value'] for entry in history])
+        self.assertIn('Error 0', history[-1]['tb_text'])
+
+        # The log is reloaded from the journal, e.g. after a restart.
+        entries = errUtility.getLogEntries()
+        cleanup.cleanUp()
+        errUtility.setProperties(2)
+        errUtility.setJournal(directory, segment_size=1000)
+        self.assertEqual([entry.copy() for entry in entries],
+                         [entry.copy() for entry in
+                          errUtility.getLogEntries()])
+
+        errUtility.setJournal(None)
+        self.assertEqual([], errUtility.getLogEntries())
+
+    def test_shared_log(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'errors.db')
+        errUtility = self.makeOne()
+        errUtility.setSharedLog(path, timeout=0.5)
+        self.assertEqual(0.5, errUtility.shared_log_timeout)
+        errUtility.raising(getAnErrorInfo("Error"))
+        entry = errUtility.getLogEntries()[0]
+        self.assertEqual(entry.copy(),
+                         errUtility.getLogEntryById(entry.id).copy())
+
+        # Another process sees the same log.
+        cleanup.cleanUp()
+        errUtility.setSharedLog(path)
+        self.assertEqual([entry.copy()],
+                         [e.copy() for e in errUtility.getLogEntries()])
+
+        errUtility.setSharedLog(None)
+        self.assertEqual([], errUtility.getLogEntries())
+
+    def test_unusable_storage_falls_back_to_memory(self):
+        from zope.error.log import RingBufferLog
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'file')
+        with open(path, 'w') as f:
+            f.write('not a database')
+        errUtility = self.makeOne()
+        errUtility.setSharedLog(path)
+        errUtility.raising(getAnErrorInfo("Error"))
+        self.assertIsInstance(errUtility._getLog(), RingBufferLog)
+        self.assertEqual(1, len(errUtility.getLogEntries()))
+        self.assertIn('while opening the error log',
+                      self.log_buffer.getvalue())
+
+        errUtility.setSharedLog(None)
+        errUtility.setJournal(os.path.join(path, 'journal'))
+        self.assertIsInstance(errUtility._getLog(), RingBufferLog)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), 'requires fork')
+    def test_shared_log_forked_workers(self):
+        # Workers forked from a process that imported zope.error get
+        # entry ids of their own, and do not use the connection to the
+        # shared log opened by the parent.
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'errors.db')
+        errUtility = self.makeOne()
+        errUtility.setSharedLog(path, timeout=5)
+        errUtility.copy_to_zlog = False
+        log = errUtility._getLog()
+        pids = []
+        for _i in range(3):
+            pid = os.fork()
+            if not pid:  # pragma: no cover
+                status = 1
+                try:
+                    errUtility.raising(getAnErrorInfo("Error"))
+                    if errUtility._getLog() is not log:
+                        status = 0
+                finally:
+                    os._exit(status)
+            pids.append(pid)
+        for pid in pids:
+            self.assertEqual(0, os.waitpid(pid, 0)[1])
+        entries = errUtility.getLogEntries()
+        self.assertEqual(3, len(entries))
+        self.assertEqual(3, len({entry.id for entry in entries}))
+
+    def test_shared_log_reopened_after_fork(self):
+        import zope.error.error
+        from zope.error.log import RingBufferLog
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        errUtility = self.makeOne()
+        errUtility.setSharedLog(os.path.join(directory, 'errors.db'))
+        log = errUtility._getLog()
+        memory = zope.error.error._temp_logs['memory'] = RingBufferLog(1)
+        zope.error.error._afterFork()
+        inherited = zope.error.error._inherited_logs
+        self.assertEqual([log], inherited)
+        # Other logs are kept.
+        self.assertIs(memory, zope.error.error._temp_logs['memory'])
+        inherited.remove(log)
+        log.close()
+        self.assertIsNot(log, errUtility._getLog())
+
+    def test_setProperties_validates_storage(self):
+        errUtility = self.makeOne()
+        self.assertRaises(ValueError, errUtility.setProperties, 10,
+                          storage='nonesuch')
+        self.assertEqual('', errUtility.getProperties()['storage'])
+
+    def test_missing_storage_falls_back_to_memory(self):
+        from zope.error.log import RingBufferLog
+        errUtility = self.makeOne()
+        errUtility.storage = 'gone'
+        self.assertIsInstance(errUtility._getLog(), RingBufferLog)
+        self.assertIn("No error log storage named 'gone'",
+                      self.log_buffer.getvalue())
+
+    @unittest.skipIf(getGlobalSiteManager is None, 'needs zope.component')
+    def test_storage_utility(self):
+        from zope.error.interfaces import IErrorLogStorageFactory
+        from zope.error.log import RingBufferLog
+        created = []
+
+        def factory(key, capacity, max_bytes):
+            created.append((key, capacity, max_bytes))
+            return RingBufferLog(capacity, max_bytes)
+
+        named_log = RingBufferLog(10)
+
+        def named(key, capacity, max_bytes):
+            return named_log
+
+        gsm = getGlobalSiteManager()
+        gsm.registerUtility(factory, IErrorLogStorageFactory)
+        gsm.registerUtility(named, IErrorLogStorageFactory, 'named')
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, max_bytes=100000)
+        self.assertEqual([(errUtility._getLogKey(), 10, 100000)], created)
+
+        errUtility.setProperties(10, storage='named')
+        self.assertEqual('named', errUtility.getProperties()['storage'])
+        errUtility.raising(getAnErrorInfo("Error"))
+        self.assertEqual(['Error'], [e['value'] for e in named_log])
+
+    def test_export(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'errors.jsonl')
+        request = TestRequest(environ={'PATH_INFO': '/foobar'})
+        request.URL = URLGetter(request)
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, aggregate_duplicates=True)
+        errUtility.setExport(path, batch_size=2, interval=60)
+        self.assertEqual({'exported': 0, 'dropped': 0, 'pending': 0},
+                         errUtility.getExportStatistics())
+        for _i in range(3):
+            errUtility.raising(getAnErrorInfo("Error"), request=request)
+        self.assertTrue(waitFor(
+            lambda: errUtility.getExportStatistics()['exported'] == 2))
+        self.assertEqual({'exported': 2, 'dropped': 0, 'pending': 1},
+                         errUtility.getExportStatistics())
+        errUtility.setExport(None)
+
+        with open(path) as f:
+            records = [json.loads(line) for line in f]
+        entry = errUtility.getLogEntries()[0]
+        self.assertEqual([1, 2, 3], [r['count'] for r in records])
+        # Only the first occurrence formatted the traceback.
+        self.assertEqual(entry['tb_text'], records[0]['traceback'])
+        self.assertEqual([None, None], [r['traceback'] for r in records[1:]])
+        record = records[-1]
+        self.assertEqual(entry['id'], record['id'])
+        self.assertEqual('Error', record['type'])
+        self.assertEqual('Error', record['value'])
+        self.assertEqual(entry['fingerprint'], record['fingerprint'])
+        self.assertEqual('/foobar', record['url'])
+        self.assertEqual('getAnErrorInfo', record['frames'][-1]['function'])
+        self.assertEqual(entry['last_seen'], record['timestamp'])
+
+        errUtility.raising(getAnErrorInfo("Error"))
+        with open(path) as f:
+            self.assertEqual(3, len(f.readlines()))
+
+        # Pending records are written at exit.
+        errUtility.setExport(path)
+        errUtility.raising(getAnErrorInfo("Error"))
+        cleanup.cleanUp()
+        with open(path) as f:
+            self.assertEqual(4, len(f.readlines()))
+
+    def test_export_closed_within_timeout(self):
+        import zope.error.error
+        gate = threading.Event()
+        self.addCleanup(gate.set)
+
+        class BlockingSink(ListSink):
+            def write(self, lines):
+                gate.wait()
+
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, copy_to_zlog=False)
+        timeout = zope.error.error._export_close_timeout
+        zope.error.error._export_close_timeout = 0.05
+        self.addCleanup(setattr, zope.error.error, '_export_close_timeout',
+                        timeout)
+        for close in (lambda: errUtility.setExport(None),
+                      lambda: zope.error.error._shutdown_recorders(0.05)):
+            errUtility.setExport('tcp://127.0.0.1:9', batch_size=1)
+            exporter = errUtility._getExporter()
+            sink = exporter.sink = BlockingSink()
+            for _i in range(3):
+                errUtility.raising(getAnErrorInfo("Error"))
+            self.assertTrue(waitFor(lambda: len(exporter._full) == 2))
+            # An unresponsive sink does not hold up the caller.
+            with self.assertLogs('SiteError', logging.WARNING) as cm:
+                started = time.monotonic()
+                close()
+            self.assertLess(time.monotonic() - started, 1)
+            self.assertTrue(sink.closed)
+            self.assertEqual({'exported': 0, 'dropped': 2, 'pending': 1},
+                             exporter.getStatistics())
+            self.assertIn('dropped 2 errors', cm.output[0])
+
+    def test_export_lazy_formatting(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'errors.jsonl')
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, lazy_formatting=True)
+        errUtility.setExport(path)
+        errUtility.raising(getAnErrorInfo("Error"))
+        errUtility.setExport(None)
+
+        with open(path) as f:
+            record = json.loads(f.read())
+        self.assertIsNone(record['traceback'])
+        self.assertEqual('getAnErrorInfo', record['frames'][-1]['function'])
+        # Exporting did not render the traceback.
+        entry = errUtility._getLog().getEntries()[0]
+        self.assertIsNotNone(entry._render)
+
+    def test_setExport_validates(self):
+        errUtility = self.makeOne()
+        self.assertRaises(ValueError, errUtility.setExport, 'tcp://host')
+        self.assertRaises(ValueError, errUtility.setExport, 'errors.jsonl',
+                          batch_size=0)
+        self.assertIsNone(errUtility.export_target)
+
+    def test_getLogEntryDetails(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, copy_to_zlog=False,
+                                 compress_details=True)
+        request = TestRequest()
+        request._items = [('key', 'value')]
+        errUtility.raising(getAnAnnotatedErrorInfo("Error"), request)
+        self.assertIsNone(errUtility.getLogEntryDetails('nonesuch'))
+
+        entry = errUtility.getLogEntries()[0]
+        self.assertIsInstance(entry._details._fields[0], bytes)
+        details = errUtility.getLogEntryDetails(entry.id)
+        self.assertEqual(['req_html', 'tb_html', 'tb_text'], sorted(details))
+        self.assertEqual('key: value<br />\n', details['req_html'])
+        self.assertIn('__traceback_info__: info', details['tb_text'])
+        self.assertEqual(entry.tb_html, details['tb_html'])
+
+    def test_compression_dictionary(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(100, copy_to_zlog=False,
+                                 compress_details=True)
+        for i in range(20):
+            errUtility.raising(getAnAnnotatedErrorInfo("Error %d" % i))
+        zlib_size = errUtility.getLogStatistics()['bytes']
+
+        errUtility.setProperties(100, compression_dictionary=True)
+        errUtility._getLog().clear()
+        for i in range(20):
+            errUtility.raising(getAnAnnotatedErrorInfo("Error %d" % i))
+        self.assertLess(errUtility.getLogStatistics()['bytes'], zlib_size)
+
+        entry = errUtility.getLogEntries()[0]
+        self.assertIsNotNone(entry._details._codec.zdict)
+        self.assertEqual(getFormattedException(
+            getAnAnnotatedErrorInfo("Error 19")), entry.tb_text)
+
+    def test_intern_frames(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(100, copy_to_zlog=False)
+        for i in range(10):
+            errUtility.raising(getAnAnnotatedErrorInfo("Error %d" % i))
+        plain = errUtility.getLogStatistics()
+        self.assertNotIn('interned_lines', plain)
+
+        errUtility.setProperties(3, intern_frames=True)
+        errUtility._getLog().clear()
+        for i in range(10):
+            errUtility.raising(getAnAnnotatedErrorInfo("Error %d" % i))
+        stats = errUtility.getLogStatistics()
+        self.assertLess(stats['bytes'], plain['bytes'] * 3 / 10)
+        self.assertGreater(stats['interned_bytes'], 0)
+        entry = errUtility.getLogEntries()[0]
+        self.assertIsInstance(entry._details._fields[0], tuple)
+        self.assertEqual(getFormattedException(
+            getAnAnnotatedErrorInfo("Error 9")), entry.tb_text)
+        self.assertEqual(getFormattedException(
+            getAnAnnotatedErrorInfo("Error 9"), True), entry.tb_html)
+
+        # The lines of evicted entries are released, even while the
+        # entries are still referenced.  Each entry has its own last line
+        # with the value, the other lines are shared.
+        table = errUtility._getStringTable()
+        lines = len(table)
+        evicted = errUtility.getLogEntries()[-1]
+        errUtility.raising(getAnAnnotatedErrorInfo("Error 10"))
+        self.assertEqual(lines, len(table))
+        self.assertIn('Error 7', evicted.tb_text)
+        errUtility._getLog().clear()
+        self.assertEqual(0, len(table))
+        self.assertIn('Error 9', entry.tb_text)
+
+    def test_queryLogEntries(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(10, copy_to_zlog=False,
+                                 lazy_formatting=True)
+        request = TestRequest(environ={'PATH_INFO': '/foobar'})
+        request.URL = URLGetter(request)
+        for i in range(3):
+            errUtility.raising(getAnErrorInfo("Error %d" % i), request)
+        errUtility.raising(getAnAnnotatedErrorInfo("Other"))
+
+        summaries = errUtility.queryLogEntries(limit=2)
+        self.assertEqual(['Other', 'Error 2'],
+                         [summary['value'] for summary in summaries])
+        self.assertNotIn('tb_html', summaries[0])
+        self.assertNotIn('req_html', summaries[0])
+        self.assertEqual('/foobar', summaries[1]['url'])
+        # Summaries do not render lazily formatted tracebacks.
+        entry = errUtility.getLogEntryById(summaries[1]['id'])
+        self.assertIsNotNone(entry._render)
+
+        self.assertEqual(
+            ['Error 1'],
+            [summary['value'] for summary in errUtility.queryLogEntries(
+                type='Error', url='foobar', offset=1, limit=1)])
+        entries = errUtility.queryLogEntries(text='annotated', full=True)
+        self.assertEqual(['Other'], [entry.value for entry in entries])
+        self.assertIn('Annotated', entries[0].tb_html)
+        self.assertEqual(4, len(errUtility.queryLogEntries(
+            since=time.time() - 60, limit=None)))
+
+    def test_getLogHistory_without_journal(self):
+        errUtility = self.makeOne()
+        for i in range(3):
+            errUtility.raising(getAnErrorInfo("Error %d" % i))
+        self.assertEqual(['Error 1', 'Error 0'],
+                         [entry['value']
+                          for entry in errUtility.getLogHistory(1, 5)])
+
+    def test_getLogStatistics_empty(self):
+        self.assertEqual(
+            {'entries': 0, 'bytes': 0, 'evicted': 0, 'keep_entries': 20,
+             'max_bytes': 0},
+            self.makeOne().getLogStatistics())
+
+    def test_getMetrics_empty(self):
+        self.assertEqual(
+            {'raised': {}, 'ignored': {}, 'durations': {}, 'zlog_copies': 0,
+             'zlog_suppressed': 0, 'log_entries': 0, 'log_bytes': 0,
+             'log_evicted': 0, 'queued': 0, 'dropped': 0},
+            self.makeOne().getMetrics())
+
+    def test_getMetrics(self):
+        class Unauthorized(Exception):
+            pass
+
+        request = TestRequest(environ={'PATH_INFO': '/foobar'})
+        request.URL = URLGetter(request)
+        errUtility = self.makeOne()
+        errUtility.setProperties(2, ignored_exceptions=('Unauthorized',),
+                                 zlog_rate_burst=2)
+        with self.assertLogs('SiteError'):
+            for _i in range(3):
+                errUtility.raising(getAnErrorInfo("Error"), request=request)
+        errUtility.raising((Unauthorized, None, None))
+        metrics = errUtility.getMetrics()
+        self.assertEqual({'Error': 3, 'Unauthorized': 1}, metrics['raised'])
+        self.assertEqual({'Unauthorized': 1}, metrics['ignored'])
+        self.assertEqual(2, metrics['zlog_copies'])
+        self.assertEqual(1, metrics['zlog_suppressed'])
+        self.assertEqual(2, metrics['log_entries'])
+        self.assertEqual(errUtility.getLogStatistics()['bytes'],
+                         metrics['log_bytes'])
+        self.assertEqual(1, metrics['log_evicted'])
+        durations = metrics['durations']
+        self.assertEqual(
+            ['formatting', 'logging', 'request', 'storing', 'total',
+             'username'],
+            sorted(durations))
+        for histogram in durations.values():
+            self.assertEqual(3, histogram['count'])
+            self.assertEqual((float('inf'), 3), histogram['buckets'][-1])
+        self.assertGreaterEqual(
+            durations['total']['sum'], durations['formatting']['sum'])
+
+    def test_getMetrics_aggregated(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, copy_to_zlog=False,
+                                 aggregate_duplicates=True)
+        for _i in range(3):
+            errUtility.raising(getAnErrorInfo("Error"))
+        durations = errUtility.getMetrics()['durations']
+        # Only the first occurrence is formatted and stored.
+        self.assertEqual(1, durations['formatting']['count'])
+        self.assertEqual(1, durations['storing']['count'])
+        self.assertEqual(3, durations['total']['count'])
+        self.assertNotIn('request', durations)
+
+    def test_max_value_size(self):
+        request = TestRequest()
+        request.items().append(('key', '<' * 20))
+        request.items().append(('bytes', b'x' * 20))
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_value_size=5)
+        errUtility.raising(getAnErrorInfo("Error " * 5), request=request)
+        entry = errUtility.getLogEntries()[0]
+        self.assertEqual('Error... [25 characters truncated]',
+                         entry['value'])
+        self.assertEqual(
+            'bytes: xxxxx... [15 characters truncated]<br />\n'
+            'key: &lt;&lt;&lt;&lt;&lt;... [15 characters truncated]<br />\n',
+            entry['req_html'])
+
+    def test_max_request_size(self):
+        request = TestRequest()
+        for i in range(10):
+            request.items().append(('key%d' % i, 'value'))
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_request_size=40)
+        errUtility.raising(getAnErrorInfo("Error"), request=request)
+        self.assertEqual(
+            'key0: value<br />\n'
+            'key1: value<br />\n'
+            '... [8 items truncated]<br />\n',
+            errUtility.getLogEntries()[0]['req_html'])
+
+    def test_max_traceback_size(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_traceback_size=800)
+        exc_info = getADeepErrorInfo(10)
+        errUtility.raising(exc_info)
+        entry = errUtility.getLogEntries()[0]
+        from zope.error.error import getFormattedTracebacks
+        full_text, full_html = getFormattedTracebacks(exc_info)
+        # The middle frames are left out, the exception line is kept.
+        tb_text = entry['tb_text']
+        self.assertLessEqual(len(tb_text), 800)
+        self.assertTrue(tb_text.startswith(
+            'Traceback (most recent call last):\n'))
+        self.assertTrue(tb_text.endswith('zope.error.tests.Error: bottom\n'))
+        self.assertIn('in getADeepErrorInfo', tb_text)
+        self.assertIn("raise Error('bottom')", tb_text)
+        self.assertRegex(tb_text, r'\n\.\.\. \[\d+ lines truncated\]\n  ')
+        lines = tb_text.splitlines(True)
+        self.assertTrue(full_text.startswith(''.join(lines[:3])))
+        self.assertTrue(full_text.endswith(''.join(lines[-3:])))
+        # The HTML list is still closed.
+        tb_html = entry['tb_html']
+        self.assertLessEqual(len(tb_html), 800)
+        self.assertRegex(
+            tb_html, r'</li>\n<li>\.\.\. \[\d+ lines truncated\]</li>\n<li>')
+        self.assertTrue(tb_html.endswith(
+            '</ul><p>zope.error.tests.Error: bottom<br />\r\n</p><br />\n'))
+        self.assertEqual(full_html.splitlines()[-2:],
+                         tb_html.splitlines()[-2:])
+
+    def test_max_traceback_size_keeps_exception(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_traceback_size=10)
+        errUtility.raising(getADeepErrorInfo(10))
+        entry = errUtility.getLogEntries()[0]
+        self.assertEqual('Traceback (most recent call last):\n'
+                         '... [12 lines truncated]\n'
+                         'zope.error.tests.Error: bottom\n',
+                         entry['tb_text'])
+
+    def test_max_traceback_size_preformatted(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_traceback_size=5)
+        errUtility.raising((Error, Error('Error'), 'a string tb'))
+        self.assertEqual('a str... [6 characters truncated]',
+                         errUtility.getLogEntries()[0]['tb_text'])
+
+    def test_max_frames(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_frames=6)
+        exc_info = getADeepErrorInfo(20)
+        errUtility.raising(exc_info)
+        tb_text = errUtility.getLogEntries()[0]['tb_text']
+        self.assertEqual(tb_text, getFormattedException(exc_info, limit=6))
+        self.assertIn('in getADeepErrorInfo', tb_text)
+        self.assertIn("Error: bottom", tb_text)
+        self.assertIn('16 entries omitted, because limit is 6', tb_text)
+
+    def test_max_frames_lazy(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, max_frames=6, lazy_formatting=True)
+        exc_info = getADeepErrorInfo(20)
+        errUtility.raising(exc_info)
+        entry = errUtility.getLogEntries()[0]
+        self.assertEqual(getFormattedException(exc_info, limit=6),
+                         entry['tb_text'])
+        self.assertEqual(getFormattedException(exc_info, True, limit=6),
+                         entry['tb_html'])
+
+    def test_lazy_formatting_tb_preformatted(self):
+        errUtility = self.makeOne()
+        errUtility.setProperties(20, lazy_formatting=True)
+        exc_info = getAnErrorInfo("Error")
+        errUtility.raising((exc_info[0], exc_info[1], 'a string tb'))
+
+        entry = errUtility.getLogEntries()[0]
+        self.assertEqual('a string tb', entry['tb_text'])
+        self.assertIsNone(entry['tb_html'])
+
 
 class RootErrorReportingUtilityTests(ErrorReportingUtilityTests):
 
@@ -330,6 +1412,23 @@ class GetPrintableTests(unittest.TestCase):
     def test_xml_tags_get_escaped(self):
         self.assertEqual('&lt;script&gt;', self.getPrintable('<script>'))
 
+    def test_each_special_character_gets_escaped(self):
+        self.assertEqual('a &amp; b', self.getPrintable('a & b'))
+        self.assertEqual('a &lt; b', self.getPrintable('a < b'))
+        self.assertEqual('a &gt; b', self.getPrintable('a > b'))
+
+    def test_safe_text_is_returned_as_is(self):
+        value = 'Mozilla/5.0 (X11; Linux x86_64) "quoted"'
+        self.assertIs(value, self.getPrintable(value))
+
+    def test_str_subclass(self):
+        class Text(str):
+            pass
+
+        value = self.getPrintable(Text('<b>'))
+        self.assertEqual('&lt;b&gt;', value)
+        self.assertIs(str, type(value))
+
     def test_byte_values_get_converted_to_unicode(self):
         # This one isn't much of a test because it's the literal bytes
         # '\', 'u', '0', etc.
@@ -340,6 +1439,18 @@ class GetPrintableTests(unittest.TestCase):
         self.assertEqual('\\xe1', self.getPrintable(b'\xe1'))
         self.assertIsInstance(self.getPrintable(b'\xe1'), str)
 
+    def test_max_size(self):
+        from zope.error.error import getPrintable
+        self.assertEqual('&lt;&lt;... [1 characters truncated]',
+                         getPrintable('<<<', max_size=2))
+        self.assertEqual('<<... [1 characters truncated]',
+                         getPrintable('<<<', as_html=True, max_size=2))
+        self.assertEqual('\\xe1... [2 characters truncated]',
+                         getPrintable(b'\xe1\xe1\xe1', max_size=1))
+        self.assertEqual('\\xe... [1 characters truncated]',
+                         getPrintable(b'\xe1', max_size=3))
+        self.assertEqual('<<<', getPrintable('<<<', as_html=True, max_size=3))
+
     def test_non_str_values_get_converted_using_a_str_call(self):
         class NonStr:
             def __str__(self):
@@ -399,6 +1510,1694 @@ class GetPrintableTests(unittest.TestCase):
         super().tearDown()
 
 
+class ErrorLogEntryTests(unittest.TestCase):
+
+    def makeOne(self, **kw):
+        from zope.error.log import ErrorLogEntry
+        return ErrorLogEntry('1', 'Error', 'value', 'now', **kw)
+
+    def test_getSize(self):
+        entry = self.makeOne()
+        bigger = self.makeOne(tb_text='x' * 1000)
+        self.assertGreater(bigger.getSize(), entry.getSize() + 1000)
+        sampled = self.makeOne(samples=[(1.0, '/url', 'user')])
+        self.assertGreater(sampled.getSize(), entry.getSize())
+
+    def test_mapping(self):
+        entry = self.makeOne(tb_text='tb', url='/url')
+        self.assertEqual({
+            'type': 'Error',
+            'value': 'value',
+            'time': 'now',
+            'id': '1',
+            'tb_text': 'tb',
+            'tb_html': None,
+            'username': None,
+            'url': '/url',
+            'req_html': None,
+            'fingerprint': None,
+            'count': 1,
+            'first_seen': None,
+            'last_seen': None,
+            'samples': (),
+        }, entry.copy())
+        self.assertEqual(14, len(entry))
+        self.assertEqual('/url', entry['url'])
+        self.assertEqual('/url', entry.url)
+        self.assertIsNone(entry.get('_render'))
+        self.assertRaises(KeyError, entry.__getitem__, 'nonesuch')
+        self.assertEqual("<ErrorLogEntry 1 Error: value>", repr(entry))
+
+    def test_immutable(self):
+        entry = self.makeOne()
+        self.assertFalse(hasattr(entry, '__dict__'))
+        with self.assertRaises(AttributeError):
+            entry.value = 'changed'
+        with self.assertRaises(AttributeError):
+            del entry.value
+        with self.assertRaises(AttributeError):
+            entry.extra = 'extra'
+        with self.assertRaises(TypeError):
+            entry['value'] = 'changed'
+
+    def test_withOccurrence(self):
+        entry = self.makeOne(tb_text='tb', first_seen=1.0, last_seen=1.0,
+                             samples=[(1.0, '/a', None)])
+        again = entry.withOccurrence(2.0, (2.0, '/b', 'user'), 2)
+        self.assertEqual(1, entry.count)
+        self.assertEqual(2, again.count)
+        self.assertEqual('1', again.id)
+        self.assertEqual('tb', again.tb_text)
+        self.assertEqual(1.0, again.first_seen)
+        self.assertEqual(2.0, again.last_seen)
+        self.assertEqual(time.ctime(2.0), again.time)
+        self.assertEqual(((1.0, '/a', None), (2.0, '/b', 'user')),
+                         again.samples)
+        again = again.withOccurrence(3.0, (3.0, '/c', None), 2)
+        self.assertEqual(3, again.count)
+        self.assertEqual(((2.0, '/b', 'user'), (3.0, '/c', None)),
+                         again.samples)
+        self.assertEqual((), again.withOccurrence(4.0, (), 0).samples)
+
+    def test_render_once(self):
+        calls = []
+
+        def render():
+            calls.append(1)
+            return 'text', 'html'
+        entry = self.makeOne(render=render)
+        self.assertEqual('html', entry.tb_html)
+        self.assertEqual('text', entry['tb_text'])
+        self.assertEqual(1, len(calls))
+
+    def test_render_compressed(self):
+        entry = self.makeOne(render=lambda: ('text', 'html'),
+                             req_html='request', compress=True)
+        self.assertEqual({'tb_text': 'text', 'tb_html': 'html',
+                          'req_html': 'request'}, entry.getDetails())
+        self.assertIsInstance(entry._details._fields[0], bytes)
+
+    def test_summary_and_details(self):
+        entry = self.makeOne(tb_text='tb', tb_html='html', req_html='req',
+                             url='/url')
+        summary = entry.getSummary()
+        self.assertEqual('/url', summary['url'])
+        self.assertEqual(set(entry) - {'tb_text', 'tb_html', 'req_html'},
+                         set(summary))
+        self.assertEqual({'tb_text': 'tb', 'tb_html': 'html',
+                          'req_html': 'req'}, entry.getDetails())
+
+    def test_compress(self):
+        tb_text = 'Traceback \udcff\n' + '  Module foo, line 1\n' * 100
+        entry = self.makeOne(tb_text=tb_text, req_html='req', compress=True)
+        plain = self.makeOne(tb_text=tb_text, req_html='req')
+        self.assertEqual(tb_text, entry.tb_text)
+        self.assertIsNone(entry.tb_html)
+        self.assertEqual('req', entry['req_html'])
+        self.assertEqual(plain.copy(), entry.copy())
+        self.assertLess(entry.getSize(), plain.getSize() - 1000)
+        # Occurrences share the compressed details.
+        again = entry.withOccurrence(2.0, (), 5)
+        self.assertIs(entry._details, again._details)
+
+
+class StringTableTests(unittest.TestCase):
+
+    def makeOne(self):
+        from zope.error.log import StringTable
+        return StringTable()
+
+    def test_intern(self):
+        table = self.makeOne()
+        first = table.intern(['a\n', 'line\n', 'line\n'])
+        second = table.intern([''.join(['a', '\n']), 'b\n'])
+        self.assertEqual(('a\n', 'line\n', 'line\n'), first)
+        self.assertIs(first[0], second[0])
+        self.assertEqual(3, len(table))
+        stats = table.getStatistics()
+        self.assertEqual(3, stats['strings'])
+        self.assertEqual(5, stats['references'])
+        self.assertGreater(stats['bytes'], 0)
+
+        table.release(first)
+        self.assertEqual({'a\n', 'b\n'}, set(table._strings))
+        table.release(second)
+        self.assertEqual(0, len(table))
+
+    def test_details(self):
+        from zope.error.log import EntryDetails
+        table = self.makeOne()
+        details = EntryDetails(['a\n', 'b\n'], ['<li>a</li>\n'], 'req',
+                               table=table)
+        self.assertEqual('a\nb\n', details.tb_text)
+        self.assertEqual('<li>a</li>\n', details.tb_html)
+        self.assertEqual('req', details.req_html)
+        self.assertEqual(3, len(table))
+        # Strings are kept as they are.
+        other = EntryDetails('a\n', None, table=table)
+        self.assertEqual('a\n', other.tb_text)
+        self.assertEqual(3, len(table))
+        rendered = details.withTracebacks('text', 'html')
+        self.assertEqual('text', rendered.tb_text)
+        details.release()
+        self.assertEqual(0, len(table))
+        self.assertEqual('a\nb\n', details.tb_text)
+        details.release()
+        self.assertEqual(0, len(table))
+        # Compressed details are not interned.
+        details = EntryDetails(['a\n'], None, compress=True, table=table)
+        self.assertEqual('a\n', details.tb_text)
+        self.assertEqual(0, len(table))
+
+
+class ZlibCodecTests(unittest.TestCase):
+
+    def test_roundtrip(self):
+        from zope.error.compression import ZlibCodec
+        text = 'Traceback \udcff\u20ac\n' + 'line\n' * 100
+        for codec in (ZlibCodec(), ZlibCodec(1, b'Traceback line\n')):
+            data = codec.compress(text)
+            self.assertLess(len(data), len(text))
+            self.assertEqual(text, codec.decompress(data))
+
+    def test_dictionary(self):
+        from zope.error.compression import ZlibCodec
+        text = '  Module zope.publisher.publish, line 123, in publish\n'
+        plain = ZlibCodec().compress(text)
+        preset = ZlibCodec(zdict=text.encode('utf-8')).compress(text)
+        self.assertLess(len(preset), len(plain))
+
+    def test_retire(self):
+        from zope.error.compression import ZlibCodec
+        codec = ZlibCodec(zdict=b'Traceback line\n')
+        data = codec.compress('Traceback line\n')
+        codec.retire()
+        self.assertIsNone(codec._compressor)
+        self.assertEqual(data, codec.compress('Traceback line\n'))
+        self.assertEqual('Traceback line\n', codec.decompress(data))
+
+
+class DictionaryTrainerTests(unittest.TestCase):
+
+    def makeOne(self, size=100, interval=8):
+        from zope.error.compression import DictionaryTrainer
+        return DictionaryTrainer(size, interval)
+
+    def test_training(self):
+        trainer = self.makeOne()
+        self.assertIsNone(trainer.getCodec().zdict)
+        codecs = []
+        for i in range(17):
+            trainer.addSample('sample %02d ' % i * 5, None)
+            codecs.append(trainer.getCodec())
+        # Trained after 1, 2, 4, 8 and 16 samples.
+        self.assertEqual(5, len(set(codecs)))
+        self.assertIs(codecs[7], codecs[14])
+        self.assertIsNot(codecs[14], codecs[15])
+        self.assertIsNone(codecs[14]._compressor)
+        self.assertIsNotNone(codecs[15]._compressor)
+        zdict = trainer.getCodec().zdict
+        self.assertEqual(100, len(zdict))
+        self.assertTrue(zdict.endswith(b'sample 15 '))
+
+    def test_samples_bounded(self):
+        trainer = self.makeOne()
+        trainer.addSample(None, '')
+        for _i in range(10):
+            trainer.addSample('x' * 30)
+        self.assertEqual(4, len(trainer._samples))
+        self.assertEqual(120, trainer._sample_size)
+
+
+class StorageContractTests:
+    """The tests every IErrorLogStorage implementation passes.
+
+    Test cases mix this in and provide ``makeOne(capacity)`` and
+    ``makeEntry(id, fingerprint)``.
+    """
+
+    def test_provides_IErrorLogStorage(self):
+        from zope.interface.verify import verifyObject
+
+        from zope.error.interfaces import IErrorLogStorage
+        self.assertTrue(verifyObject(IErrorLogStorage, self.makeOne(3)))
+
+    def test_contract(self):
+        log = self.makeOne(3)
+        for i in range(4):
+            log.append(self.makeEntry(str(i), 'fp%d' % i))
+        self.assertEqual(3, log.capacity)
+        self.assertEqual(3, len(log))
+        self.assertEqual(['3', '2', '1'],
+                         [entry.id for entry in log.getEntries()])
+        self.assertEqual(['1', '2', '3'], [entry.id for entry in log])
+        self.assertIsNone(log.getEntryById('0'))
+        self.assertEqual('2', log.getEntryById('2').id)
+        self.assertEqual('1', log.getEntryByFingerprint('fp1').id)
+        self.assertIsNone(log.getEntryByFingerprint('fp0'))
+
+        self.assertIsNone(log.addOccurrence('fp0', 5.0, (), 5))
+        entry = log.addOccurrence('fp1', 5.0, (5.0, None, None), 5)
+        self.assertEqual(2, entry.count)
+        self.assertEqual(5.0, entry.last_seen)
+        self.assertEqual(['1', '3', '2'],
+                         [entry.id for entry in log.getEntries()])
+
+        stats = log.getStatistics()
+        self.assertEqual(3, stats['entries'])
+        self.assertGreater(stats['bytes'], 0)
+        self.assertEqual(1, stats['evicted'])
+
+        log.resize(1)
+        self.assertEqual(['1'], [entry.id for entry in log.getEntries()])
+        log.clear()
+        self.assertEqual(0, len(log))
+        self.assertEqual([], log.getEntries())
+
+    def test_query(self):
+        from zope.error.log import ErrorLogEntry
+        log = self.makeOne(10)
+        for i, (type, username, url) in enumerate([
+                ('KeyError', 'alice, a', '/a/edit'),
+                ('ValueError', 'bob, b', '/b/view'),
+                ('KeyError', 'bob, b', '/b/edit'),
+                ('ValueError', None, None),
+                ('KeyError', 'alice, a', '/a/view')]):
+            log.append(ErrorLogEntry(
+                str(i), type, 'Value %d' % i, 'now',
+                tb_text='Traceback\nline %d' % i, username=username,
+                url=url, last_seen=float(i)))
+
+        def ids(**criteria):
+            return [entry.id for entry in log.query(**criteria)]
+
+        self.assertEqual(['4', '3', '2', '1', '0'], ids())
+        self.assertEqual(['4', '2', '0'], ids(type='KeyError'))
+        self.assertEqual([], ids(type='TypeError'))
+        self.assertEqual(['3', '2', '1'], ids(since=1.0, until=3.0))
+        self.assertEqual(['4', '3'], ids(since=3.0))
+        self.assertEqual(['1', '0'], ids(until=1.0))
+        self.assertEqual(['2'], ids(type='KeyError', since=1.0, until=3.0))
+        self.assertEqual(['2', '1'], ids(username='bob'))
+        self.assertEqual(['2', '0'], ids(url='edit'))
+        self.assertEqual(['3'], ids(text='value 3'))
+        self.assertEqual(['1'], ids(text='LINE 1'))
+        self.assertEqual(['3', '2'], ids(offset=1, limit=2))
+        self.assertEqual(['2', '0'], ids(type='KeyError', offset=1))
+        self.assertEqual(['3', '2'], ids(text='value', offset=1, limit=2))
+        self.assertEqual([], ids(limit=0))
+
+        # Replacing an entry updates the indexes.
+        log.append(ErrorLogEntry('0', 'KeyError', 'Value 0', 'now',
+                                 last_seen=5.0))
+        self.assertEqual(['0', '4', '2'], ids(type='KeyError'))
+        self.assertEqual(['0'], ids(since=4.5))
+        self.assertEqual([], ids(until=0.5))
+
+
+class RingBufferLogTests(StorageContractTests, unittest.TestCase):
+
+    def makeOne(self, capacity, max_bytes=0):
+        from zope.error.log import RingBufferLog
+        return RingBufferLog(capacity, max_bytes)
+
+    def makeEntry(self, id, fingerprint=None, value='value'):
+        from zope.error.log import ErrorLogEntry
+        return ErrorLogEntry(id, 'Error', value, 'now',
+                             fingerprint=fingerprint)
+
+    def ids(self, entries):
+        return [entry.id for entry in entries]
+
+    def test_append_evicts_oldest(self):
+        log = self.makeOne(3)
+        for i in range(5):
+            log.append(self.makeEntry(i))
+        self.assertEqual(3, len(log))
+        self.assertEqual([4, 3, 2], self.ids(log.getEntries()))
+        self.assertEqual([2, 3, 4], self.ids(log))
+
+    def test_append_resizes(self):
+        log = self.makeOne(3)
+        for i in range(3):
+            log.append(self.makeEntry(i))
+        log.append(self.makeEntry(3), capacity=2)
+        self.assertEqual(2, log.capacity)
+        self.assertEqual([3, 2], self.ids(log.getEntries()))
+        log.append(self.makeEntry(4), capacity=5)
+        self.assertEqual(5, log.capacity)
+        self.assertEqual([4, 3, 2], self.ids(log.getEntries()))
+
+    def test_resize_keeps_most_recent(self):
+        log = self.makeOne(5)
+        for i in range(5):
+            log.append(self.makeEntry(i))
+        log.resize(2)
+        self.assertEqual([4, 3], self.ids(log.getEntries()))
+        self.assertIsNone(log.getEntryById(2))
+        log.resize(-1)
+        self.assertEqual(0, log.capacity)
+        log.append(self.makeEntry(5))
+        self.assertEqual([], log.getEntries())
+        self.assertIsNone(log.getEntryById(5))
+
+    def test_query_indexes(self):
+        from zope.error.log import ErrorLogEntry
+        log = self.makeOne(2)
+        for i in range(4):
+            log.append(ErrorLogEntry(i, 'Error%d' % (i % 2), 'value', 'now',
+                                     last_seen=float(i)))
+        log.append(self.makeEntry(4))
+        # Evicted entries are removed from the indexes.
+        self.assertEqual({'Error': {4: None}, 'Error1': {3: None}},
+                         log._by_type)
+        self.assertEqual([(3.0, 4, 3)], list(log._by_time))
+        # Entries without a last_seen time are not in a time range.
+        self.assertEqual([4, 3], self.ids(log.query()))
+        self.assertEqual([3], self.ids(log.query(until=10.0)))
+        self.assertEqual([4], self.ids(log.query(type='Error')))
+        log.clear()
+        self.assertEqual({}, log._by_type)
+        self.assertEqual([], list(log._by_time))
+        self.assertEqual({}, log._time_keys)
+        self.assertEqual(set(), log._removed_times)
+
+    def test_time_index(self):
+        from zope.error.log import ErrorLogEntry
+        log = self.makeOne(3)
+
+        def append(id, last_seen):
+            log.append(ErrorLogEntry(id, 'Error', 'value', 'now',
+                                     last_seen=last_seen))
+
+        for i in range(3):
+            append(i, float(i))
+        # An entry last seen before the others is inserted in time order.
+        append(3, 0.5)
+        self.assertEqual([(0.5, 4, 3), (1.0, 2, 1), (2.0, 3, 2)],
+                         list(log._by_time))
+        self.assertEqual([3, 1], self.ids(log.query(until=1.0)))
+        # The keys of the oldest entries are dropped at once, ...
+        append(1, 5.0)
+        append(3, 6.0)
+        append(2, 7.0)
+        self.assertEqual([(5.0, 5, 1), (6.0, 6, 3), (7.0, 7, 2)],
+                         list(log._by_time))
+        self.assertEqual(set(), log._removed_times)
+        # ... others are skipped ...
+        append(3, 8.0)
+        self.assertEqual({(6.0, 6, 3)}, log._removed_times)
+        self.assertEqual([3, 2, 1], self.ids(log.query(since=0.0)))
+        self.assertEqual([1], self.ids(log.query(since=5.0, until=6.0)))
+        # ... until they outnumber the others.
+        append(2, 9.0)
+        append(2, 10.0)
+        self.assertEqual([(5.0, 5, 1), (8.0, 8, 3), (10.0, 10, 2)],
+                         list(log._by_time))
+        self.assertEqual(set(), log._removed_times)
+
+    def test_releases_details(self):
+        from zope.error.log import EntryDetails
+        from zope.error.log import ErrorLogEntry
+        from zope.error.log import StringTable
+        table = StringTable()
+
+        def makeEntry(id):
+            return ErrorLogEntry(id, 'Error', 'value', 'now', details=(
+                EntryDetails(['line %s\n' % id], None, table=table)),
+                fingerprint='fingerprint %s' % id)
+
+        log = self.makeOne(2)
+        log.append(makeEntry(0))
+        # Further occurrences of an entry keep its lines.
+        log.addOccurrence('fingerprint 0', 1.0, (1.0, None, None), 1)
+        self.assertEqual(1, table.getStatistics()['references'])
+        # Replaced entries release them, ...
+        log.append(makeEntry(0))
+        self.assertEqual(1, table.getStatistics()['references'])
+        # ... as do evicted ones, ...
+        log.append(makeEntry(1))
+        log.append(makeEntry(2))
+        self.assertEqual({'line 1\n', 'line 2\n'}, set(table._strings))
+        # ... entries not kept at all, ...
+        log.resize(0)
+        log.append(makeEntry(3))
+        self.assertEqual(0, len(table))
+        # ... and cleared ones.
+        log.resize(2)
+        log.append(makeEntry(4))
+        log.clear()
+        self.assertEqual(0, len(table))
+
+    def test_filterEntries(self):
+        from zope.error.log import ErrorLogEntry
+        from zope.error.log import filterEntries
+        entries = [
+            ErrorLogEntry(0, 'KeyError', 'value', 'now', last_seen=1.0),
+            ErrorLogEntry(1, 'KeyError', 'value', 'now'),
+            ErrorLogEntry(2, 'ValueError', 'value', 'now', last_seen=2.0),
+            ErrorLogEntry(3, 'KeyError', 'value', 'now', last_seen=3.0),
+        ]
+        self.assertEqual([0, 1, 2, 3], self.ids(filterEntries(entries)))
+        self.assertEqual([0, 1, 3], self.ids(
+            filterEntries(entries, type='KeyError')))
+        self.assertEqual([0, 3], self.ids(
+            filterEntries(entries, type='KeyError', since=0.0)))
+        self.assertEqual([2, 3], self.ids(filterEntries(entries, since=2.0)))
+        self.assertEqual([0], self.ids(filterEntries(entries, until=1.5)))
+        self.assertEqual([1, 2], self.ids(
+            filterEntries(entries, offset=1, limit=2)))
+
+    def test_getEntryById(self):
+        log = self.makeOne(2)
+        entries = [self.makeEntry(i) for i in range(3)]
+        for entry in entries:
+            log.append(entry)
+        self.assertIsNone(log.getEntryById(0))
+        self.assertIs(entries[1], log.getEntryById(1))
+        self.assertIs(entries[2], log.getEntryById(2))
+
+    def test_addOccurrence(self):
+        log = self.makeOne(3)
+        log.append(self.makeEntry('1', 'fp'))
+        log.append(self.makeEntry('2'))
+        self.assertFalse(log.addOccurrence('nonesuch', 1.0, (), 5))
+        self.assertTrue(log.addOccurrence('fp', 1.0, (), 5))
+        self.assertEqual(['1', '2'], self.ids(log.getEntries()))
+        self.assertEqual(2, log.getEntryById('1').count)
+        self.assertIs(log.getEntryById('1'), log.getEntryByFingerprint('fp'))
+
+    def test_append_replaces_same_id(self):
+        log = self.makeOne(3)
+        log.append(self.makeEntry('1'))
+        log.append(self.makeEntry('2'))
+        log.append(self.makeEntry('1', value='other'))
+        self.assertEqual(['1', '2'], self.ids(log.getEntries()))
+        self.assertEqual('other', log.getEntryById('1').value)
+
+    def test_eviction_drops_fingerprint(self):
+        log = self.makeOne(1)
+        log.append(self.makeEntry('1', 'fp'))
+        log.append(self.makeEntry('2', 'fp'))
+        self.assertEqual('2', log.getEntryByFingerprint('fp').id)
+        log.append(self.makeEntry('3'))
+        self.assertIsNone(log.getEntryByFingerprint('fp'))
+        self.assertFalse(log.addOccurrence('fp', 1.0, (), 5))
+
+    def test_max_bytes(self):
+        size = self.makeEntry('1').getSize()
+        log = self.makeOne(10, max_bytes=3 * size)
+        for i in range(1, 6):
+            log.append(self.makeEntry(str(i)))
+        self.assertEqual(['5', '4', '3'], self.ids(log.getEntries()))
+        self.assertEqual({'entries': 3, 'bytes': 3 * size, 'evicted': 2},
+                         log.getStatistics())
+        log.resize(10, 2 * size)
+        self.assertEqual(2 * size, log.max_bytes)
+        self.assertEqual(['5', '4'], self.ids(log.getEntries()))
+        log.resize(10, 0)
+        for i in range(6, 11):
+            log.append(self.makeEntry(str(i)))
+        self.assertEqual(7, len(log))
+
+    def test_lazy_rendering_is_accounted(self):
+        from zope.error.log import ErrorLogEntry
+
+        def makeLazyEntry(id):
+            return ErrorLogEntry(id, 'Error', 'value', 'now',
+                                 render=lambda: ('t' * 1000, 'h' * 1000))
+
+        size = makeLazyEntry('1').getSize()
+        log = self.makeOne(10, max_bytes=3 * size)
+        entries = [makeLazyEntry(str(i)) for i in range(3)]
+        for entry in entries:
+            log.append(entry)
+        self.assertEqual(3 * size, log.getStatistics()['bytes'])
+        # Rendering the most recent entry makes the log evict the others.
+        entries[-1].tb_text
+        self.assertEqual(['2'], self.ids(log.getEntries()))
+        self.assertEqual(entries[-1].getSize(),
+                         log.getStatistics()['bytes'])
+        # Rendering entries no longer in the log changes nothing.
+        entries[0].tb_text
+        self.assertEqual(entries[-1].getSize(),
+                         log.getStatistics()['bytes'])
+
+    def test_max_bytes_keeps_most_recent(self):
+        log = self.makeOne(10, max_bytes=1)
+        log.append(self.makeEntry('1'))
+        log.append(self.makeEntry('2'))
+        self.assertEqual(['2'], self.ids(log.getEntries()))
+
+    def test_size_accounting_on_occurrence(self):
+        log = self.makeOne(10)
+        entry = self.makeEntry('1', 'fp')
+        log.append(entry)
+        log.addOccurrence('fp', 1.0, (1.0, None, None), 5)
+        self.assertEqual(log.getEntryById('1').getSize(),
+                         log.getStatistics()['bytes'])
+        self.assertGreater(log.getEntryById('1').getSize(), entry.getSize())
+
+    def test_clear(self):
+        log = self.makeOne(5)
+        log.append(self.makeEntry(1))
+        log.clear()
+        self.assertEqual(0, len(log))
+        self.assertIsNone(log.getEntryById(1))
+        self.assertEqual(0, log.getStatistics()['bytes'])
+
+
+class JournalLogTests(StorageContractTests, unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.logs = []
+
+    def tearDown(self):
+        for log in self.logs:
+            log.close()
+
+    def makeOne(self, capacity=5, **kw):
+        from zope.error.journal import JournalLog
+        log = JournalLog(self.directory, capacity, **kw)
+        self.logs.append(log)
+        return log
+
+    def makeEntry(self, id, fingerprint=None):
+        from zope.error.log import ErrorLogEntry
+        return ErrorLogEntry(id, 'Error', 'value %s' % id, 'now',
+                             tb_text='text', tb_html='html',
+                             fingerprint=fingerprint, first_seen=1.0,
+                             last_seen=1.0, samples=[(1.0, None, None)])
+
+    def ids(self, entries):
+        return [entry.id for entry in entries]
+
+    def segments(self):
+        return sorted(os.listdir(self.directory))
+
+    def test_reload(self):
+        log = self.makeOne()
+        for i in range(7):
+            log.append(self.makeEntry(str(i)))
+        self.assertEqual(['6', '5', '4', '3', '2'], self.ids(log.getEntries()))
+        log.close()
+
+        log = self.makeOne()
+        self.assertEqual(['6', '5', '4', '3', '2'], self.ids(log.getEntries()))
+        entry = log.getEntryById('6')
+        self.assertEqual(self.makeEntry('6', None).copy(), entry.copy())
+        self.assertEqual((1.0, None, None), entry.samples[0])
+        log.append(self.makeEntry('7'))
+        self.assertEqual('7', log.getEntries()[0].id)
+
+    def test_reload_occurrences(self):
+        log = self.makeOne()
+        log.append(self.makeEntry('1', 'fp'))
+        log.append(self.makeEntry('2'))
+        self.assertIsNotNone(
+            log.addOccurrence('fp', 2.0, (2.0, '/url', 'user'), 5))
+        self.assertIsNone(log.addOccurrence('nonesuch', 2.0, (), 5))
+        log.close()
+
+        log = self.makeOne()
+        self.assertEqual(['1', '2'], self.ids(log.getEntries()))
+        entry = log.getEntryByFingerprint('fp')
+        self.assertEqual(2, entry.count)
+        self.assertEqual(2.0, entry.last_seen)
+        self.assertEqual((2.0, '/url', 'user'), entry.samples[-1])
+
+    def test_torn_record_is_cut_off(self):
+        log = self.makeOne()
+        log.append(self.makeEntry('1'))
+        log.append(self.makeEntry('2'))
+        log.close()
+        path = os.path.join(self.directory, self.segments()[0])
+        with open(path, 'r+b') as f:
+            f.truncate(os.path.getsize(path) - 3)
+
+        log = self.makeOne()
+        self.assertEqual(['1'], self.ids(log.getEntries()))
+        log.append(self.makeEntry('3'))
+        log.close()
+        log = self.makeOne()
+        self.assertEqual(['3', '1'], self.ids(log.getEntries()))
+
+    def test_corrupt_record_is_cut_off(self):
+        log = self.makeOne()
+        log.append(self.makeEntry('1'))
+        log.close()
+        path = os.path.join(self.directory, self.segments()[0])
+        with open(path, 'r+b') as f:
+            f.seek(-2, os.SEEK_END)
+            f.write(b'XX')
+        log = self.makeOne()
+        self.assertEqual([], log.getEntries())
+        self.assertEqual(0, os.path.getsize(path))
+
+    def test_rotation(self):
+        log = self.makeOne(segment_size=1, max_segments=3)
+        for i in range(5):
+            log.append(self.makeEntry(str(i)))
+        self.assertEqual(3, len(self.segments()))
+        stats = log.getStatistics()
+        self.assertEqual(5, stats['entries'])
+        self.assertEqual(5, stats['journal_records'])
+        self.assertEqual(3, stats['journal_segments'])
+        self.assertGreater(stats['journal_bytes'], 0)
+        log.close()
+
+        # Only the segments needed for the capacity are read.
+        log = self.makeOne(capacity=1)
+        self.assertEqual(['4'], self.ids(log.getEntries()))
+        log.close()
+        log = self.makeOne(capacity=10)
+        self.assertEqual(['4', '3'], self.ids(log.getEntries()))
+
+    def test_getHistory(self):
+        log = self.makeOne(capacity=2, segment_size=300)
+        for i in range(6):
+            log.append(self.makeEntry(str(i), 'fp%d' % (i % 2)))
+        log.addOccurrence('fp0', 3.0, (3.0, None, None), 2)
+        self.assertGreater(len(self.segments()), 1)
+        self.assertEqual(['4', '5'], self.ids(log.getEntries()))
+
+        history = log.getHistory()
+        self.assertEqual(['5', '4', '3', '2', '1', '0'], self.ids(history))
+        self.assertEqual([1, 2, 1, 1, 1, 1], [e.count for e in history])
+        self.assertEqual(2, len(history[1].samples))
+        self.assertEqual(['3', '2'], self.ids(log.getHistory(2, 2)))
+        self.assertEqual(['0'], self.ids(log.getHistory(5, 10)))
+        self.assertEqual([], log.getHistory(6))
+
+    def test_getHistory_empty(self):
+        log = self.makeOne()
+        self.assertEqual([], log.getHistory())
+
+    def test_write_error_is_logged(self):
+        class BrokenFile:
+            def write(self, data):
+                raise OSError('No space left on device')
+
+        log = self.makeOne()
+        real_file, log._file = log._file, BrokenFile()
+        buffer = StringIO()
+        handler = logging.StreamHandler(buffer)
+        logging.getLogger('SiteError').addHandler(handler)
+        try:
+            log.append(self.makeEntry('1'))
+        finally:
+            logging.getLogger('SiteError').removeHandler(handler)
+            log._file = real_file
+        self.assertEqual(['1'], self.ids(log.getEntries()))
+        self.assertIn('writing to the journal', buffer.getvalue())
+
+    def recordSyncs(self, *errors):
+        # Records the threads calling os.fsync, which raises *errors* first.
+        threads = []
+        errors = list(errors)
+        fsync = os.fsync
+
+        def recordSync(fd):
+            threads.append(threading.current_thread())
+            if errors:
+                raise errors.pop(0)
+            fsync(fd)
+
+        os.fsync = recordSync
+        self.addCleanup(setattr, os, 'fsync', fsync)
+        return threads
+
+    def test_background_sync(self):
+        threads = self.recordSyncs()
+        # Every record rotates the segment.
+        log = self.makeOne(segment_size=1, fsync_interval=0.5)
+        started = time.monotonic()
+        for i in range(3):
+            log.append(self.makeEntry(str(i)))
+        self.assertEqual([], threads)
+        retired = list(log._retired)
+        self.assertEqual(3, len(retired))
+
+        # The rotated segments and the current one are synced once the
+        # interval has passed, and never by the thread writing records.
+        self.assertTrue(waitFor(lambda: len(threads) == 4))
+        self.assertGreaterEqual(time.monotonic() - started, 0.5)
+        self.assertNotIn(threading.current_thread(), threads)
+        self.assertTrue(all(f.closed for f in retired))
+        self.assertIsNone(log._unsynced_since)
+
+        # Closing the log syncs the rest right away.
+        log.append(self.makeEntry('3'))
+        log.close()
+        self.assertEqual([threading.current_thread()] * 2, threads[4:])
+        self.assertFalse(log._thread.is_alive())
+
+    def test_sync_error_is_logged(self):
+        threads = self.recordSyncs(OSError('Input/output error'))
+        log = self.makeOne(fsync_interval=0)
+        with self.assertLogs('SiteError') as cm:
+            log.append(self.makeEntry('1'))
+            self.assertTrue(waitFor(lambda: cm.records))
+        self.assertIn('syncing the journal', cm.output[0])
+        self.assertEqual(['1'], self.ids(log.getEntries()))
+        # The log goes on, and the record is synced when it is closed.
+        log.close()
+        self.assertEqual(2, len(threads))
+
+    def test_sync_and_resize(self):
+        log = self.makeOne(fsync_interval=0)
+        for i in range(3):
+            log.append(self.makeEntry(str(i)))
+        log.sync()
+        log.resize(2, 1000000)
+        self.assertEqual(2, log.capacity)
+        self.assertEqual(1000000, log.max_bytes)
+        self.assertEqual(2, len(log))
+        self.assertEqual(['1', '2'], self.ids(log))
+        log.clear()
+        self.assertEqual([], log.getEntries())
+        self.assertEqual(['2', '1'], self.ids(log.getHistory(limit=2)))
+        log.close()
+        log.close()
+
+
+class SharedLogTests(StorageContractTests, unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'errors.db')
+        self.logs = []
+
+    def tearDown(self):
+        for log in self.logs:
+            log.close()
+
+    def makeOne(self, capacity=3, key='root', path=None, **kw):
+        from zope.error.shared import SharedLog
+        log = SharedLog(path or self.path, key, capacity, **kw)
+        self.logs.append(log)
+        return log
+
+    def makeEntry(self, id, fingerprint=None):
+        from zope.error.log import ErrorLogEntry
+        return ErrorLogEntry(id, 'Error', 'value', 'now', tb_text='text',
+                             fingerprint=fingerprint)
+
+    def ids(self, entries):
+        return [entry.id for entry in entries]
+
+    def test_releases_details(self):
+        from zope.error.log import EntryDetails
+        from zope.error.log import ErrorLogEntry
+        from zope.error.log import StringTable
+        table = StringTable()
+        entry = ErrorLogEntry('1', 'Error', 'value', 'now', details=(
+            EntryDetails(['line\n'], None, table=table)))
+        log = self.makeOne()
+        log.append(entry)
+        self.assertEqual(0, len(table))
+        self.assertEqual('line\n', log.getEntryById('1').tb_text)
+
+    def test_waits_for_setup(self):
+        # A process opening the log waits for another one setting up the
+        # database, however short the timeout for writing is.
+        other = sqlite3.connect(self.path, isolation_level=None,
+                                check_same_thread=False)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        timer = threading.Timer(0.2, other.execute, ('COMMIT',))
+        timer.start()
+        self.addCleanup(timer.join)
+        log = self.makeOne(timeout=0)
+        log.append(self.makeEntry('1'))
+        self.assertEqual(['1'], self.ids(log.getEntries()))
+
+    def test_setup_errors(self):
+        import zope.error.shared
+
+        # Errors other than locks are not retried.
+        self.assertRaises(sqlite3.OperationalError, self.makeOne,
+                          path=os.path.join(self.path, 'errors.db'))
+        # Locks are retried until the setup timeout.
+        self.makeOne().close()
+        other = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(other.close)
+        other.execute('BEGIN IMMEDIATE')
+        timeout = zope.error.shared.SETUP_TIMEOUT
+        zope.error.shared.SETUP_TIMEOUT = 0
+        try:
+            self.assertRaises(sqlite3.OperationalError, self.makeOne)
+        finally:
+            zope.error.shared.SETUP_TIMEOUT = timeout
+        other.execute('COMMIT')
+
+    def test_setup_rolled_back(self):
+        from zope.error.shared import SharedLog
+
+        class FailingLog(SharedLog):
+            def _countTotals(self, connection):
+                raise sqlite3.DatabaseError('disk I/O error')
+
+        self.assertRaises(sqlite3.DatabaseError, FailingLog,
+                          self.path, 'root', 3)
+        self.makeOne().close()
+
+    def test_shared_between_connections(self):
+        # Each process has its own connection.
+        one = self.makeOne()
+        other = self.makeOne()
+        one.append(self.makeEntry('1'))
+        other.append(self.makeEntry('2'))
+        one.append(self.makeEntry('3'))
+        self.assertEqual(['3', '2', '1'], self.ids(other.getEntries()))
+        self.assertEqual(['1', '2', '3'], self.ids(one))
+        self.assertEqual(3, len(other))
+        self.assertEqual(self.makeEntry('2').copy(),
+                         one.getEntryById('2').copy())
+        self.assertIsNone(one.getEntryById('4'))
+
+    def test_totals(self):
+        # The number and size of the entries are kept up to date.
+        log = self.makeOne(capacity=3)
+        other = self.makeOne(capacity=3, key='other')
+        for i in range(5):
+            log.append(self.makeEntry(str(i)))
+        other.append(self.makeEntry('1'))
+        log.append(self.makeEntry('3'))
+        connection = sqlite3.connect(self.path)
+        self.addCleanup(connection.close)
+        [(entries, size)] = connection.execute(
+            "SELECT COUNT(*), TOTAL(size) FROM entries WHERE log = 'root'"
+        ).fetchall()
+        self.assertEqual({'entries': entries, 'bytes': int(size),
+                          'evicted': 2},
+                         log.getStatistics())
+        self.assertEqual(1, len(other))
+        log.clear()
+        self.assertEqual({'entries': 0, 'bytes': 0, 'evicted': 2},
+                         log.getStatistics())
+
+    def test_totals_counted_for_older_databases(self):
+        log = self.makeOne(capacity=3)
+        for i in range(3):
+            log.append(self.makeEntry(str(i)))
+        stats = log.getStatistics()
+        connection = sqlite3.connect(self.path)
+        self.addCleanup(connection.close)
+        with connection:
+            connection.execute('DELETE FROM totals')
+        self.assertEqual(stats, self.makeOne(capacity=3).getStatistics())
+
+    def test_logs_are_keyed(self):
+        root = self.makeOne()
+        local = self.makeOne(key=b'\x00\x01')
+        root.append(self.makeEntry('1'))
+        local.append(self.makeEntry('2'))
+        self.assertEqual('0001', local.key)
+        self.assertEqual(['1'], self.ids(root.getEntries()))
+        self.assertEqual(['2'], self.ids(local.getEntries()))
+
+    def test_eviction(self):
+        log = self.makeOne(capacity=2)
+        for i in range(4):
+            log.append(self.makeEntry(str(i)))
+        self.assertEqual(['3', '2'], self.ids(log.getEntries()))
+        stats = log.getStatistics()
+        self.assertEqual(2, stats['entries'])
+        self.assertEqual(2, stats['evicted'])
+        size = stats['bytes'] // 2
+        log.resize(5, size)
+        self.assertEqual(5, log.capacity)
+        self.assertEqual(size, log.max_bytes)
+        self.assertEqual(['3'], self.ids(log.getEntries()))
+        log.append(self.makeEntry('4'), max_bytes=1)
+        self.assertEqual(['4'], self.ids(log.getEntries()))
+        log.resize(0)
+        self.assertEqual([], log.getEntries())
+        self.assertEqual(
+            {'entries': 0, 'bytes': 0, 'evicted': 5}, log.getStatistics())
+
+    def test_addOccurrence(self):
+        one = self.makeOne()
+        other = self.makeOne()
+        one.append(self.makeEntry('1', 'fp'))
+        one.append(self.makeEntry('2'))
+        self.assertIsNone(other.addOccurrence('nonesuch', 1.0, (), 5))
+        entry = other.addOccurrence('fp', 1.0, (1.0, '/url', None), 5)
+        self.assertEqual(2, entry.count)
+        self.assertEqual(['1', '2'], self.ids(one.getEntries()))
+        self.assertEqual(entry.copy(), one.getEntryByFingerprint('fp').copy())
+        self.assertEqual((1.0, '/url', None), entry.samples[-1])
+        self.assertIsNone(one.getEntryByFingerprint('nonesuch'))
+
+    def test_append_replaces_same_id(self):
+        log = self.makeOne()
+        log.append(self.makeEntry('1'))
+        log.append(self.makeEntry('2'))
+        log.append(self.makeEntry('1', 'fp'))
+        self.assertEqual(['1', '2'], self.ids(log.getEntries()))
+        self.assertEqual('fp', log.getEntryById('1').fingerprint)
+
+    def test_clear(self):
+        log = self.makeOne()
+        log.append(self.makeEntry('1'))
+        log.clear()
+        self.assertEqual(0, len(log))
+
+    def test_busy_writer_drops_entry(self):
+        log = self.makeOne(timeout=0)
+        blocker = sqlite3.connect(self.path, isolation_level=None)
+        blocker.execute('BEGIN IMMEDIATE')
+        buffer = StringIO()
+        handler = logging.StreamHandler(buffer)
+        logging.getLogger('SiteError').addHandler(handler)
+        try:
+            log.append(self.makeEntry('1'))
+        finally:
+            logging.getLogger('SiteError').removeHandler(handler)
+            blocker.execute('ROLLBACK')
+            blocker.close()
+        self.assertIn('writing to the shared log', buffer.getvalue())
+        self.assertEqual([], log.getEntries())
+
+    def test_failed_change_is_rolled_back(self):
+        log = self.makeOne()
+
+        def change(connection):
+            connection.execute('DELETE FROM entries')
+            raise ValueError
+
+        log.append(self.makeEntry('1'))
+        self.assertRaises(ValueError, log._write, change)
+        self.assertEqual(1, len(log))
+
+
+class ListSink:
+
+    def __init__(self):
+        self.batches = []
+        self.closed = False
+
+    def write(self, lines):
+        self.batches.append(lines)
+
+    def close(self):
+        self.closed = True
+
+
+class BatchExporterTests(unittest.TestCase):
+
+    def makeOne(self, sink, batch_size=2, interval=60, max_pending=10000):
+        from zope.error.export import BatchExporter
+        exporter = BatchExporter(sink, batch_size, interval, max_pending)
+        self.addCleanup(exporter.close)
+        return exporter
+
+    def test_batch_size(self):
+        sink = ListSink()
+        exporter = self.makeOne(sink)
+        for i in range(5):
+            exporter.export({'id': i})
+        self.assertTrue(waitFor(lambda: len(sink.batches) == 2))
+        self.assertEqual([['{"id":0}\n', '{"id":1}\n'],
+                          ['{"id":2}\n', '{"id":3}\n']], sink.batches)
+        self.assertEqual({'exported': 4, 'dropped': 0, 'pending': 1},
+                         exporter.getStatistics())
+        exporter.close()
+        self.assertEqual(['{"id":4}\n'], sink.batches[-1])
+        self.assertTrue(sink.closed)
+
+    def test_interval(self):
+        sink = ListSink()
+        exporter = self.makeOne(sink, batch_size=100, interval=0.01)
+        exporter.export({'id': 0, 'time': time})
+        exporter.export({'id': 1})
+        self.assertTrue(waitFor(lambda: sink.batches))
+        self.assertEqual(1, len(sink.batches))
+        self.assertEqual(2, len(sink.batches[0]))
+        self.assertIn('"time":"<module', sink.batches[0][0])
+        exporter.flush()
+        self.assertEqual(1, len(sink.batches))
+
+    def test_failing_sink(self):
+        class FailingSink(ListSink):
+            def write(self, lines):
+                raise OSError('Connection refused')
+
+        exporter = self.makeOne(FailingSink(), batch_size=1)
+        buffer = StringIO()
+        handler = logging.StreamHandler(buffer)
+        logging.getLogger('SiteError').addHandler(handler)
+        try:
+            exporter.export({'id': 0})
+            self.assertTrue(exporter.flush(5))
+        finally:
+            logging.getLogger('SiteError').removeHandler(handler)
+        self.assertEqual({'exported': 0, 'dropped': 1, 'pending': 0},
+                         exporter.getStatistics())
+        self.assertIn('exporting 1 errors', buffer.getvalue())
+
+    def test_export_does_not_wait_for_sink(self):
+        gate = threading.Event()
+
+        class BlockingSink(ListSink):
+            def write(self, lines):
+                gate.wait()
+                ListSink.write(self, lines)
+
+        sink = BlockingSink()
+        exporter = self.makeOne(sink, batch_size=1, max_pending=3)
+        self.addCleanup(gate.set)
+        for i in range(5):
+            exporter.export({'id': i})
+        self.assertEqual({'exported': 0, 'dropped': 2, 'pending': 3},
+                         exporter.getStatistics())
+        self.assertFalse(exporter.flush(0.01))
+        gate.set()
+        self.assertTrue(exporter.flush(5))
+        self.assertEqual({'exported': 3, 'dropped': 2, 'pending': 0},
+                         exporter.getStatistics())
+        self.assertEqual([['{"id":%d}\n' % i] for i in range(3)],
+                         sorted(sink.batches))
+
+    def test_close_timeout(self):
+        gate = threading.Event()
+
+        class BlockingSink(ListSink):
+            def write(self, lines):
+                gate.wait()
+                ListSink.write(self, lines)
+
+        sink = BlockingSink()
+        exporter = self.makeOne(sink, batch_size=1)
+        self.addCleanup(gate.set)
+        for i in range(3):
+            exporter.export({'id': i})
+        self.assertTrue(waitFor(lambda: len(exporter._full) == 2))
+        with self.assertLogs('SiteError', logging.WARNING):
+            self.assertFalse(exporter.close(0.01))
+        self.assertTrue(sink.closed)
+        # The batch being written is still counted when it is done.
+        self.assertEqual({'exported': 0, 'dropped': 2, 'pending': 1},
+                         exporter.getStatistics())
+        gate.set()
+        self.assertTrue(exporter.flush(5))
+        self.assertEqual([['{"id":0}\n']], sink.batches)
+        self.assertEqual({'exported': 1, 'dropped': 2, 'pending': 0},
+                         exporter.getStatistics())
+        self.assertTrue(exporter.close(5))
+
+    def test_makeSink(self):
+        from zope.error.export import FileSink
+        from zope.error.export import SocketSink
+        from zope.error.export import makeSink
+        sink = makeSink('/var/log/errors.jsonl')
+        self.assertIsInstance(sink, FileSink)
+        self.assertEqual('/var/log/errors.jsonl', sink.path)
+        sink = makeSink('tcp://[::1]:5170')
+        self.assertIsInstance(sink, SocketSink)
+        self.assertEqual(('::1', 5170), (sink.host, sink.port))
+        self.assertRaises(ValueError, makeSink, 'tcp://localhost')
+        self.assertRaises(ValueError, makeSink, 'tcp://:80')
+
+    def test_FileSink(self):
+        from zope.error.export import FileSink
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        sink = FileSink(os.path.join(directory, 'errors.jsonl'))
+        sink.write(['a\n'])
+        sink.write(['b\n', 'c\n'])
+        sink.close()
+        with open(sink.path) as f:
+            self.assertEqual('a\nb\nc\n', f.read())
+
+    def test_SocketSink(self):
+        from zope.error.export import SocketSink
+        server = socket.create_server(('127.0.0.1', 0))
+        self.addCleanup(server.close)
+        sink = SocketSink('127.0.0.1', server.getsockname()[1])
+        sink.write(['a\n', 'b\n'])
+        connection, _address = server.accept()
+        with connection:
+            self.assertEqual(b'a\nb\n', connection.recv(100))
+        sink.close()
+        sink.close()
+        server.close()
+        self.assertRaises(OSError, sink.write, ['c\n'])
+        self.assertIsNone(sink._socket)
+
+    def test_getFrames(self):
+        from zope.error.export import getFrames
+        frames = getFrames(getAnErrorInfo()[2])
+        self.assertEqual([{
+            'module': __name__,
+            'filename': __file__,
+            'lineno': frames[0]['lineno'],
+            'function': 'getAnErrorInfo',
+        }], frames)
+        self.assertEqual([], getFrames('Traceback'))
+
+
+class BackgroundRecorderTests(unittest.TestCase):
+
+    def setUp(self):
+        from zope.error.recorder import BackgroundRecorder
+        self.recorder = BackgroundRecorder()
+        self.gate = threading.Event()
+        self.done = []
+
+    def tearDown(self):
+        self.gate.set()
+        self.recorder.shutdown(5)
+
+    def job(self, name):
+        def job():
+            self.gate.wait(5)
+            self.done.append(name)
+        return job
+
+    def fill(self, policy, timeout=None):
+        # The first job blocks the worker, the next two fill the queue.
+        submit = self.recorder.submit
+        self.assertTrue(submit(self.job(1), 2, policy))
+        while self.recorder.getStatistics()['queued']:
+            time.sleep(0.001)
+        self.assertTrue(submit(self.job(2), 2, policy))
+        self.assertTrue(submit(self.job(3), 2, policy))
+        return submit(self.job(4), 2, policy, timeout)
+
+    def test_drop_oldest(self):
+        self.assertTrue(self.fill('drop-oldest'))
+        self.gate.set()
+        self.assertTrue(self.recorder.flush(5))
+        self.assertEqual([1, 3, 4], self.done)
+        self.assertEqual({'queued': 0, 'processed': 3, 'dropped': 1},
+                         self.recorder.getStatistics())
+
+    def test_drop_newest(self):
+        self.assertFalse(self.fill('drop-newest'))
+        self.gate.set()
+        self.assertTrue(self.recorder.flush(5))
+        self.assertEqual([1, 2, 3], self.done)
+        self.assertEqual(1, self.recorder.getStatistics()['dropped'])
+
+    def test_block_timeout(self):
+        self.assertFalse(self.fill('block', timeout=0.01))
+        self.gate.set()
+        self.assertTrue(self.recorder.flush(5))
+        self.assertEqual([1, 2, 3], self.done)
+        self.assertEqual(1, self.recorder.getStatistics()['dropped'])
+
+    def test_block_waits_for_room(self):
+        threading.Timer(0.05, self.gate.set).start()
+        self.assertTrue(self.fill('block', timeout=5))
+        self.assertTrue(self.recorder.flush(5))
+        self.assertEqual([1, 2, 3, 4], self.done)
+
+    def test_unknown_policy(self):
+        self.assertRaises(ValueError, self.recorder.submit, self.job(1), 1,
+                          'drop-everything')
+
+    def test_flush_timeout(self):
+        self.recorder.submit(self.job(1), 1)
+        self.assertFalse(self.recorder.flush(0.01))
+
+    def test_failing_job_is_logged(self):
+        def job():
+            raise ValueError('boom')
+        with self.assertLogs('SiteError', logging.ERROR):
+            self.recorder.submit(job, 1)
+            self.assertTrue(self.recorder.flush(5))
+        self.assertEqual(1, self.recorder.getStatistics()['processed'])
+
+    def test_submit_after_shutdown(self):
+        self.gate.set()
+        self.assertTrue(self.recorder.shutdown(5))
+        self.assertFalse(self.recorder.submit(self.job(1), 1))
+        self.assertEqual(1, self.recorder.getStatistics()['dropped'])
+
+
+class RateLimiterTests(unittest.TestCase):
+
+    def makeOne(self, **kw):
+        from zope.error.ratelimit import RateLimiter
+        return RateLimiter(**kw)
+
+    def test_burst_then_period(self):
+        limiter = self.makeOne(period=10, burst=3)
+        self.assertEqual(
+            [(0, None), (0, None), (0, None), None, None],
+            [limiter.allow('key', 100) for _i in range(5)])
+        self.assertEqual({'key': 2}, limiter.getSuppressed())
+        self.assertIsNone(limiter.allow('key', 105))
+        self.assertEqual((3, 100), limiter.allow('key', 110))
+        self.assertEqual({}, limiter.getSuppressed())
+        self.assertIsNone(limiter.allow('key', 110))
+        self.assertEqual(
+            {'allowed': 4, 'suppressed': 4, 'keys': 1},
+            limiter.getStatistics())
+
+    def test_keys_are_independent(self):
+        limiter = self.makeOne(period=10, burst=1)
+        self.assertIsNotNone(limiter.allow('a', 100))
+        self.assertIsNone(limiter.allow('a', 100))
+        self.assertIsNotNone(limiter.allow('b', 100))
+
+    def test_refilled_keys_are_forgotten(self):
+        limiter = self.makeOne(period=10, burst=2)
+        limiter.allow('a', 100)
+        limiter.allow('b', 125)
+        self.assertEqual(1, limiter.getStatistics()['keys'])
+
+    def test_max_keys(self):
+        limiter = self.makeOne(period=10, burst=1, max_keys=2)
+        for key in 'abc':
+            limiter.allow(key, 100)
+        limiter.allow('b', 100)
+        limiter.allow('d', 100)
+        self.assertEqual(2, limiter.getStatistics()['keys'])
+        self.assertEqual({'b': 1}, limiter.getSuppressed())
+
+    def test_default_now(self):
+        self.assertEqual((0, None), self.makeOne().allow('key'))
+
+    def test_no_period(self):
+        limiter = self.makeOne(period=0, burst=1)
+        self.assertIsNotNone(limiter.allow('key', 100))
+        self.assertIsNotNone(limiter.allow('key', 100))
+
+
+class MetricsTests(unittest.TestCase):
+
+    def makeOne(self, **kw):
+        from zope.error.metrics import Metrics
+        return Metrics(**kw)
+
+    def test_counters(self):
+        metrics = self.makeOne()
+        metrics.countRaised('KeyError')
+        metrics.countRaised('KeyError')
+        metrics.countRaised('Unauthorized')
+        metrics.countIgnored('Unauthorized')
+        self.assertEqual(
+            {'raised': {'KeyError': 2, 'Unauthorized': 1},
+             'ignored': {'Unauthorized': 1}, 'durations': {}},
+            metrics.getStatistics())
+
+    def test_histograms(self):
+        metrics = self.makeOne(buckets=(0.1, 1.0))
+        metrics.observe([('formatting', 0.05), ('formatting', 0.1)])
+        metrics.observe([('formatting', 0.5), ('request', 0.5),
+                         ('formatting', 2.0)])
+        durations = metrics.getStatistics()['durations']
+        self.assertEqual(
+            {'buckets': [(0.1, 2), (1.0, 3), (float('inf'), 4)],
+             'count': 4, 'sum': 2.65},
+            durations['formatting'])
+        self.assertEqual([(0.1, 0), (1.0, 1), (float('inf'), 1)],
+                         durations['request']['buckets'])
+
+    def test_threads(self):
+        metrics = self.makeOne()
+
+        def run(number):
+            for _i in range(100):
+                metrics.countRaised('Error')
+                metrics.observe([('total', 0.001)])
+        runInThreads(run, 8)
+        stats = metrics.getStatistics()
+        self.assertEqual({'Error': 800}, stats['raised'])
+        self.assertEqual(800, stats['durations']['total']['count'])
+
+
+class RenderPrometheusTests(unittest.TestCase):
+
+    METRICS = {
+        'raised': {'KeyError': 2, 'Quoted"\\\n': 1},
+        'ignored': {},
+        'durations': {'total': {
+            'buckets': [(0.001, 1), (0.01, 2), (float('inf'), 2)],
+            'count': 2, 'sum': 0.0055}},
+        'zlog_copies': 2,
+        'zlog_suppressed': 1,
+        'log_entries': 3,
+        'log_bytes': 4096,
+        'log_evicted': 0,
+        'queued': 0,
+        'dropped': 0,
+    }
+
+    def test_render(self):
+        from zope.error.metrics import renderPrometheus
+        text = renderPrometheus(self.METRICS, prefix='errors')
+        lines = text.splitlines()
+        self.assertTrue(text.endswith('\n'))
+        self.assertIn('# TYPE errors_raised_total counter', lines)
+        self.assertIn('errors_raised_total{type="KeyError"} 2', lines)
+        self.assertIn('errors_raised_total{type="Quoted\\"\\\\\\n"} 1',
+                      lines)
+        self.assertIn('# TYPE errors_ignored_total counter', lines)
+        self.assertIn('# TYPE errors_duration_seconds histogram', lines)
+        self.assertIn(
+            'errors_duration_seconds_bucket{phase="total",le="0.001"} 1',
+            lines)
+        self.assertIn(
+            'errors_duration_seconds_bucket{phase="total",le="+Inf"} 2',
+            lines)
+        self.assertIn('errors_duration_seconds_sum{phase="total"} 0.0055',
+                      lines)
+        self.assertIn('errors_duration_seconds_count{phase="total"} 2',
+                      lines)
+        self.assertIn('# TYPE errors_log_bytes gauge', lines)
+        self.assertIn('errors_log_bytes 4096', lines)
+        self.assertIn('# TYPE errors_zlog_suppressed_total counter', lines)
+        self.assertIn('errors_zlog_suppressed_total 1', lines)
+
+    def test_render_utility_metrics(self):
+        from zope.error.metrics import renderPrometheus
+        errUtility = ErrorReportingUtility()
+        errUtility.setProperties(20, copy_to_zlog=False)
+        errUtility.raising(getAnErrorInfo("Error"))
+        self.addCleanup(errUtility._resetLog)
+        text = renderPrometheus(errUtility.getMetrics())
+        self.assertIn('zope_error_raised_total{type="Error"} 1\n', text)
+        self.assertIn('zope_error_log_entries 1\n', text)
+        self.assertIn(
+            'zope_error_duration_seconds_count{phase="formatting"} 1\n',
+            text)
+
+
+class SamplerTests(unittest.TestCase):
+
+    def makeOne(self):
+        from zope.error.sampling import Sampler
+        return Sampler()
+
+    def test_first_then_fraction(self):
+        sampler = self.makeOne()
+        self.assertEqual(
+            [True, True, True, False, False, True, False, False, True],
+            [sampler.sample('key', 3, 1 / 3, 60, 100) for _i in range(9)])
+        self.assertEqual({'key': {'seen': 9, 'recorded': 5}},
+                         sampler.getStatistics())
+
+    def test_window_restarts(self):
+        sampler = self.makeOne()
+        self.assertTrue(sampler.sample('key', 1, 0, 60, 100))
+        self.assertFalse(sampler.sample('key', 1, 0, 60, 159))
+        self.assertTrue(sampler.sample('key', 1, 0, 60, 160))
+        self.assertFalse(sampler.sample('key', 1, 0, 60, 161))
+        self.assertTrue(sampler.sample('other', 1, 0, 60, 161))
+        self.assertEqual({'key': {'seen': 4, 'recorded': 2},
+                          'other': {'seen': 1, 'recorded': 1}},
+                         sampler.getStatistics())
+
+    def test_default_now(self):
+        self.assertTrue(self.makeOne().sample('key', 1, 0, 60))
+
+
+class GetFingerprintTests(unittest.TestCase):
+
+    def getFingerprint(self, info):
+        from zope.error.error import getFingerprint
+        return getFingerprint(info)
+
+    def test_ignores_value(self):
+        self.assertEqual(self.getFingerprint(getAnErrorInfo("a")),
+                         self.getFingerprint(getAnErrorInfo("b")))
+
+    def test_depends_on_location(self):
+        self.assertNotEqual(
+            self.getFingerprint(getAnErrorInfo()),
+            self.getFingerprint(getAnAnnotatedErrorInfo()))
+
+    def test_depends_on_type(self):
+        info = getAnErrorInfo()
+        self.assertNotEqual(self.getFingerprint(info),
+                            self.getFingerprint((KeyError,) + info[1:]))
+
+    def test_snapshot(self):
+        from zope.error.snapshot import TracebackSnapshot
+        info = getAnAnnotatedErrorInfo()
+        snapshot = TracebackSnapshot(info)
+        self.assertEqual(self.getFingerprint(info),
+                         self.getFingerprint((info[0], None, snapshot.tb)))
+
+    def test_preformatted(self):
+        self.assertEqual(self.getFingerprint((Error, None, 'tb')),
+                         self.getFingerprint((Error, None, b'tb')))
+        self.assertNotEqual(self.getFingerprint((Error, None, 'tb')),
+                            self.getFingerprint((Error, None, 'other tb')))
+        self.assertNotEqual(self.getFingerprint(('Error', None, None)),
+                            self.getFingerprint((Error, None, None)))
+
+
+class TracebackSnapshotTests(unittest.TestCase):
+
+    def makeOne(self, info):
+        from zope.error.snapshot import TracebackSnapshot
+        return TracebackSnapshot(info)
+
+    def test_format_matches_format_exception(self):
+        exc_info = getAnAnnotatedErrorInfo("<boom>")
+        snapshot = self.makeOne(exc_info)
+        for as_html in (False, True):
+            self.assertEqual(format_exception(as_html=as_html, *exc_info),
+                             snapshot.format(as_html))
+
+    def test_does_not_keep_frames(self):
+        import types
+        snapshot = self.makeOne(getAnErrorInfo("Error"))
+        tb = snapshot.tb
+        self.assertIsNotNone(tb)
+        while tb is not None:
+            self.assertNotIsInstance(tb.tb_frame, types.FrameType)
+            self.assertEqual({}, tb.tb_frame.f_locals)
+            tb = tb.tb_next
+
+    def test_supplement_and_info_formatted_eagerly(self):
+        calls = []
+
+        class State:
+            value = 'before'
+
+            def __str__(self):
+                return 'state %s' % self.value
+
+        class RecordingSupplement(Supplement):
+            def __init__(self, expression):
+                calls.append(expression)
+                super().__init__(expression)
+
+        state = State()
+
+        def raiseIt():
+            __traceback_info__ = state  # noqa: F841
+            __traceback_supplement__ = (  # noqa: F841
+                RecordingSupplement, 'a < b')
+            raise Error('Error')
+
+        try:
+            raiseIt()
+        except Error:
+            exc_info = sys.exc_info()
+        expected = format_exception(*exc_info)
+        snapshot = self.makeOne(exc_info)
+        self.assertEqual(2, len(calls))
+        state.value = 'after'
+        self.assertEqual(expected, snapshot.format())
+        self.assertIn('state before', ''.join(snapshot.format(True)))
+        self.assertEqual(2, len(calls))
+
+    def test_no_traceback(self):
+        snapshot = self.makeOne((Error, Error('Error'), None))
+        self.assertEqual(format_exception(Error, Error('Error'), None),
+                         snapshot.format())
+
+
+class FullSupplement:
+
+    source_url = 'http://example.com/<page>'
+    line = 0
+    column = 3
+    expression = 'a & b'
+    warnings = ['deprecated <tag>']
+
+    def __init__(self, line=0):
+        self.line = line
+
+    def getInfo(self):
+        return 'two  spaces\nand <markup>'
+
+
+def raiseAFullyAnnotatedError():
+    __traceback_info__ = {'key': '<value>\nsecond line'}  # noqa: F841
+    __traceback_supplement__ = (FullSupplement, 12)  # noqa: F841
+    raiseAnAnnotatedError('<inner> & "quoted"')
+
+
+def raiseFromAFormatter():
+    __exception_formatter__ = 1  # noqa: F841
+    recurse(2)
+
+
+class FormatExceptionDualTests(unittest.TestCase):
+
+    def assertSameAsFormatException(self, exc_info, limit=None):
+        from zope.error.formatter import format_exception_dual
+        plain = []
+        text, html = format_exception_dual(*exc_info, limit=limit,
+                                           plain=plain)
+        self.assertEqual(format_exception(*exc_info, limit=limit), text)
+        self.assertEqual(
+            format_exception(*exc_info, limit=limit, as_html=True), html)
+        # Not traceback.format_exception, which zope.testrunner replaces.
+        self.assertEqual(
+            list(traceback.TracebackException(*exc_info).format()), plain)
+
+    def getInfo(self, func, *args):
+        try:
+            func(*args)
+        except Error:
+            return sys.exc_info()
+
+    def test_plain(self):
+        self.assertSameAsFormatException(getAnErrorInfo("<Error>"))
+
+    def test_annotated(self):
+        self.assertSameAsFormatException(
+            self.getInfo(raiseAFullyAnnotatedError))
+
+    def test_supplement_column_only(self):
+        class ColumnSupplement(FullSupplement):
+            source_url = None
+            warnings = ()
+
+            def getInfo(self):
+                return None
+
+        def raiseIt():
+            __traceback_supplement__ = (ColumnSupplement,)  # noqa: F841
+            raise Error('column')
+
+        self.assertSameAsFormatException(self.getInfo(raiseIt))
+
+    def test_module_supplement(self):
+        namespace = {'__name__': 'script', 'Error': Error,
+                     '__traceback_supplement__': (FullSupplement, -1)}
+        exec(compile('def run():\n    raise Error("script")\n',
+                     '<script>', 'exec'), namespace)
+        self.assertSameAsFormatException(self.getInfo(namespace['run']))
+
+    def test_limit(self):
+        exc_info = getADeepErrorInfo(10)
+        self.assertSameAsFormatException(exc_info)
+        self.assertSameAsFormatException(exc_info, limit=4)
+        self.assertSameAsFormatException(exc_info, limit=5)
+
+    def test_recursion(self):
+        self.assertSameAsFormatException(self.getInfo(raiseFromAFormatter))
+
+    def test_repeated_once(self):
+        self.assertSameAsFormatException(getADeepErrorInfo(3))
+
+    def test_chained(self):
+        def raiseFrom(cause):
+            try:
+                raise Error('cause')
+            except Error as e:
+                if cause:
+                    raise Error('<&>') from e
+                raise Error('<&>')
+
+        self.assertSameAsFormatException(self.getInfo(raiseFrom, True))
+        self.assertSameAsFormatException(self.getInfo(raiseFrom, False))
+
+    def test_plain_without_traceback(self):
+        from zope.error.formatter import format_exception_dual
+        plain = []
+        format_exception_dual(Error, Error('<&>'), None, plain=plain)
+        self.assertEqual(['zope.error.tests.Error: <&>\n'], plain)
+        plain = []
+        format_exception_dual(Error, 'value', None, plain=plain)
+        self.assertEqual([], plain)
+
+    def test_no_traceback(self):
+        self.assertSameAsFormatException((Error, Error('<none>'), None))
+
+    def test_identical_lines_are_escaped_once(self):
+        from zope.error.formatter import _Escaper
+        escape = _Escaper()
+        first = escape('a <b>')
+        self.assertEqual('a &lt;b&gt;', first)
+        self.assertIs(first, escape('a <b>'))
+        self.assertEqual('1', escape(1))
+        self.assertEqual('True', escape(True))
+
+    def test_frame_lines_are_cached(self):
+        from zope.error.formatter import clearCache
+        from zope.error.formatter import format_exception_dual
+        from zope.error.formatter import getCacheInfo
+        clearCache()
+        exc_info = getADeepErrorInfo(5)
+        first = format_exception_dual(*exc_info)
+        # Frames of the recursion share their lines.
+        self.assertEqual({'hits': 4, 'misses': 3, 'size': 3}, getCacheInfo())
+        self.assertEqual(first, format_exception_dual(*exc_info))
+        self.assertEqual({'hits': 11, 'misses': 3, 'size': 3},
+                         getCacheInfo())
+        clearCache()
+        self.assertEqual({'hits': 0, 'misses': 0, 'size': 0}, getCacheInfo())
+
+    def test_changed_source_is_read_again(self):
+        import importlib.util
+
+        from zope.error import formatter
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'changing.py')
+        with open(path, 'w') as f:
+            f.write('def run():\n    raise ValueError("old")\n')
+        spec = importlib.util.spec_from_file_location('changing', path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        try:
+            module.run()
+        except ValueError:
+            exc_info = sys.exc_info()
+
+        self.assertIn('raise ValueError("old")',
+                      formatter.format_exception_dual(*exc_info)[0][-2])
+        with open(path, 'w') as f:
+            f.write('def run():\n    raise ValueError("new")\n')
+        mtime = os.stat(path).st_mtime + 10
+        os.utime(path, (mtime, mtime))
+        # The file is only checked again after a while.
+        self.assertIn('raise ValueError("old")',
+                      formatter.format_exception_dual(*exc_info)[0][-2])
+        self.addCleanup(setattr, formatter, 'STAT_INTERVAL',
+                        formatter.STAT_INTERVAL)
+        formatter.STAT_INTERVAL = 0
+        text, html = formatter.format_exception_dual(*exc_info)
+        self.assertIn('raise ValueError("new")', text[-2])
+        self.assertIn('raise ValueError("new")', html[-2])
+
+    def test_getFormattedTracebacks(self):
+        from zope.error.error import getFormattedTracebacks
+        exc_info = self.getInfo(raiseAFullyAnnotatedError)
+        self.assertEqual((getFormattedException(exc_info),
+                          getFormattedException(exc_info, True)),
+                         getFormattedTracebacks(exc_info))
+        exc_info = getADeepErrorInfo(10)
+        self.assertEqual(
+            (getFormattedException(exc_info, False, 4, 300),
+             getFormattedException(exc_info, True, 4, 300)),
+            getFormattedTracebacks(exc_info, 4, 300))
+
+
 class TestErrorHandler(unittest.TestCase):
 
     def test_round_trip(self):